@@ -1,15 +1,26 @@
 
+from . import asyncconn
 from . import auth
 from . import client
+from . import commands
+from . import connpool
 from . import cryptostring
+from . import dbconn
 from . import dbhandler
 from . import encryption
+from . import framing
 from . import items
 from . import keycard
+from . import keycardcache
+from . import metrics
+from . import migrations
 from . import retval
 from . import rpc
+from . import search
 from . import serverconn
 from . import storage
 from . import userprofile
 from . import utils
+from . import validation
+from . import wire
 from . import workspace
@@ -0,0 +1,365 @@
+'''This module contains asyncio-based versions of the functions in serverconn. A single event loop
+can drive many sessions at once using AsyncServerConnection instead of dedicating a thread to each
+blocking ServerConnection. The command functions behave the same as their serverconn counterparts 
+except that they must be awaited: requests are built and responses are checked by the commands 
+module, as in serverconn, and only the network I/O is done here. Connections always use JSON. Commands are 
+timed in the same metrics histograms as their serverconn counterparts.'''
+
+import asyncio
+import uuid
+
+import pyanselus.commands as commands
+from pyanselus.cryptostring import CryptoString
+from pyanselus.encryption import DecryptionFailure, EncryptionPair, SigningPair
+from pyanselus.framing import MAX_FRAME_SIZE, READ_BUFFER_SIZE
+from pyanselus.keycard import EntryBase
+import pyanselus.metrics as metrics
+from pyanselus.retval import RetVal, ExceptionThrown, NetworkError
+import pyanselus.wire as wire
+
+# Number of seconds to wait for the server greeting after connecting
+CONNECT_TIMEOUT = 10.0
+
+class AsyncServerConnection:
+	'''asyncio counterpart to serverconn.ServerConnection'''
+	def __init__(self, max_frame_size=MAX_FRAME_SIZE, validate=True):
+		'''Server responses are checked against their schemas unless validate is False, which 
+		saves the work for trusted, high-throughput connections.'''
+		self.reader = None
+		self.writer = None
+		self.framer = wire.JSONCodec.make_framer(max_frame_size)
+		self.validate = validate
+		self.codec = wire.JSONCodec
+
+		# Totals for the life of the object
+		self.bytes_sent = 0
+		self.bytes_received = 0
+	
+	async def connect(self, address: str, port: int) -> RetVal:
+		'''Creates a connection to the server.'''
+		self.framer.clear()
+		try:
+			reader, writer = await asyncio.wait_for(asyncio.open_connection(address, port),
+				CONNECT_TIMEOUT)
+		except Exception as e:
+			return RetVal(ExceptionThrown, e)
+		
+		self.reader = reader
+		self.writer = writer
+
+		# absorb the hello string
+		try:
+			status = await asyncio.wait_for(self.__read_frame(), CONNECT_TIMEOUT)
+		except Exception as e:
+			status = RetVal(ExceptionThrown, e)
+		
+		if status.error():
+			await self.close()
+		return status
+
+	def is_connected(self) -> bool:
+		'''Returns whether or not the instance is connected to a server'''
+		return self.writer is not None
+
+	async def close(self):
+		'''Closes the connection without notifying the server'''
+		if self.writer:
+			self.writer.close()
+			try:
+				await self.writer.wait_closed()
+			except Exception: # pylint: disable=broad-except
+				pass
+		self.reader = None
+		self.writer = None
+		self.framer.clear()
+
+	async def disconnect(self) -> RetVal:
+		'''Disconnects by sending a QUIT command to the server'''
+		status = await self.send_message({'Action':'QUIT','Data':{}})
+		await self.close()
+		return status
+
+	async def send_message(self, command : dict) -> RetVal:
+		'''Sends a message to the server with command sent as JSON data'''
+		if not self.writer:
+			return RetVal(NetworkError, 'not connected')
+		
+		try:
+			data = self.codec.encode(command)
+			self.writer.write(data)
+			await self.writer.drain()
+		except Exception as e:
+			await self.close()
+			return RetVal(ExceptionThrown, e)
+		
+		self.__count_sent(len(data))
+		return RetVal()
+
+	async def read_response(self, schema: dict) -> RetVal:
+		'''Reads a server response and returns a separated code and string'''
+		
+		status = await self.__read_frame()
+		if status.error():
+			return status
+		
+		return commands.parse_response(self.codec, status['frame'],
+			schema if self.validate else None)
+	
+	async def read(self) -> str:
+		'''Reads a string from the network connection'''
+		
+		status = await self.__read_frame()
+		if status.error():
+			return None
+		return status['frame'].decode()
+
+	async def write(self, text: str) -> RetVal:
+		'''Sends a string over the connection'''
+
+		if not self.writer:
+			return RetVal(NetworkError, 'not connected')
+		
+		try:
+			data = text.encode()
+			self.writer.write(data)
+			await self.writer.drain()
+		except Exception as e:
+			await self.close()
+			return RetVal(ExceptionThrown, e)
+		
+		self.__count_sent(len(data))
+		return RetVal()
+
+	async def __read_frame(self) -> RetVal:
+		'''Returns the next message from the server in the field 'frame' '''
+		if not self.reader:
+			return RetVal(NetworkError, 'not connected')
+
+		while True:
+			status = self.framer.next_frame()
+			if status.error():
+				await self.close()
+				return status
+			
+			if status['frame'] is not None:
+				return status
+
+			try:
+				rawdata = await self.reader.read(READ_BUFFER_SIZE)
+			except Exception as e:
+				await self.close()
+				return RetVal(ExceptionThrown, e)
+
+			if not rawdata:
+				await self.close()
+				return RetVal(NetworkError, 'connection closed by peer')
+			self.__count_received(len(rawdata))
+			self.framer.feed(rawdata)
+
+	def __count_sent(self, count: int):
+		'''Adds to the number of bytes sent'''
+		self.bytes_sent = self.bytes_sent + count
+		metrics.count(metrics.BYTES_SENT, count)
+
+	def __count_received(self, count: int):
+		'''Adds to the number of bytes received'''
+		self.bytes_received = self.bytes_received + count
+		metrics.count(metrics.BYTES_RECEIVED, count)
+
+
+async def _exchange(conn: AsyncServerConnection, command: dict,
+	schema=commands.server_response) -> RetVal:
+	'''Sends a message and returns the server's response. If sending fails, the error is returned 
+	instead.'''
+	status = await conn.send_message(command)
+	if status.error():
+		return status
+	return await conn.read_response(schema)
+
+
+@metrics.timed(metrics.COMMAND)
+async def addentry(conn: AsyncServerConnection, entry: EntryBase, ovkey: CryptoString,
+	spair: SigningPair) -> RetVal:
+	'''Handles the process to upload an entry to the server.'''
+	response = await _exchange(conn, commands.addentry_request(entry))
+	status = commands.addentry_sign(response, entry, ovkey, spair)
+	if status.error():
+		return status
+
+	return commands.check_response(await _exchange(conn, status['request']), 200)
+
+
+@metrics.timed(metrics.COMMAND)
+async def cancel(conn: AsyncServerConnection):
+	'''Returns the session to a state where it is ready for the next command'''
+	return commands.check_response(await _exchange(conn, commands.cancel_request(), None), 200)
+
+
+@metrics.timed(metrics.COMMAND)
+async def device(conn: AsyncServerConnection, devid: str, devpair: EncryptionPair) -> RetVal:
+	'''Completes the login process by submitting device ID and its session string.'''
+	status = commands.device_request(devid, devpair)
+	if status.error():
+		return status
+
+	status = commands.device_answer(await _exchange(conn, status['request']), devid, devpair)
+	if status.error():
+		if status.error() == DecryptionFailure:
+			await _exchange(conn, commands.cancel_request(), None)
+		return status
+
+	return commands.check_response(await _exchange(conn, status['request'], None), 200)
+
+
+@metrics.timed(metrics.COMMAND)
+async def devkey(conn: AsyncServerConnection, devid: str, oldpair: EncryptionPair,
+	newpair: EncryptionPair):
+	'''Replaces the specified device's key stored on the server'''
+	status = commands.devkey_request(devid, oldpair, newpair)
+	if status.error():
+		return status
+
+	status = commands.devkey_answer(await _exchange(conn, status['request']), oldpair, newpair)
+	if status.error():
+		if status.error() == DecryptionFailure:
+			await _exchange(conn, commands.cancel_request(), None)
+		return status
+
+	return commands.check_response(await _exchange(conn, status['request'], None), 200)
+
+
+@metrics.timed(metrics.COMMAND)
+async def exists(conn: AsyncServerConnection, path: str) -> RetVal:
+	'''Checks to see if a path exists on the server side.'''
+	if not path:
+		return RetVal().set_value('exists', False)
+
+	return commands.exists_result(await _exchange(conn, commands.exists_request(path)))
+
+
+@metrics.timed(metrics.COMMAND)
+async def getwid(conn: AsyncServerConnection, uid: str, domain: str) -> RetVal:
+	'''Looks up a wid based on the specified user ID and optional domain'''
+	status = commands.getwid_request(uid, domain)
+	if status.error():
+		return status
+
+	return commands.getwid_result(await _exchange(conn, status['request']))
+
+
+@metrics.timed(metrics.COMMAND)
+async def iscurrent(conn: AsyncServerConnection, index: int, wid='') -> RetVal:
+	'''Finds out if an entry index is current. If wid is empty, the index is checked for the
+	organization.'''
+	status = commands.iscurrent_request(index, wid)
+	if status.error():
+		return status
+
+	return commands.iscurrent_result(await _exchange(conn, status['request']))
+
+
+@metrics.timed(metrics.COMMAND)
+async def login(conn: AsyncServerConnection, wid: str, serverkey: CryptoString) -> RetVal:
+	'''Starts the login process by sending the requested workspace ID.'''
+	status = commands.login_request(wid, serverkey)
+	if status.error():
+		return status
+
+	return commands.login_result(await _exchange(conn, status['request']), status['challenge'])
+
+
+@metrics.timed(metrics.COMMAND)
+async def logout(conn: AsyncServerConnection) -> RetVal:
+	'''Starts the login process by sending the requested workspace ID.'''
+	return commands.check_response(await _exchange(conn, commands.logout_request()), 200)
+
+
+@metrics.timed(metrics.COMMAND)
+async def passcode(conn: AsyncServerConnection, wid: str, reset_code: str, pwhash: str) -> RetVal:
+	'''Resets a workspace's password'''
+	request = commands.passcode_request(wid, reset_code, pwhash)
+	return commands.check_response(await _exchange(conn, request), 200)
+
+
+@metrics.timed(metrics.COMMAND)
+async def password(conn: AsyncServerConnection, wid: str, pwhash: str) -> RetVal:
+	'''Continues the login process sending a password hash to the server.'''
+	status = commands.password_request(wid, pwhash)
+	if status.error():
+		return status
+
+	return commands.check_response(await _exchange(conn, status['request']), 100)
+
+
+@metrics.timed(metrics.COMMAND)
+async def preregister(conn: AsyncServerConnection, wid: str, uid: str, domain: str) -> RetVal:
+	'''Provisions a preregistered account on the server.'''
+	request = commands.preregister_request(wid, uid, domain)
+	return commands.preregister_result(await _exchange(conn, request))
+
+
+@metrics.timed(metrics.COMMAND)
+async def regcode(conn: AsyncServerConnection, regid: str, code: str, pwhash: str, devid: str, 
+	devpair: EncryptionPair, domain: str) -> RetVal:
+	'''Finishes registration of a workspace'''
+	request = commands.regcode_request(regid, code, pwhash, devid, devpair, domain)
+	return commands.check_response(await _exchange(conn, request), 201)
+
+
+@metrics.timed(metrics.COMMAND)
+async def register(conn: AsyncServerConnection, uid: str, pwhash: str,
+	devicekey: CryptoString) -> RetVal:
+	'''Creates an account on the server.'''
+
+	# As in serverconn.register(), a new workspace ID is tried if the server already has the one
+	# sent, pausing after every 10 collisions
+	devid = str(uuid.uuid4())
+	tries = 1
+	while True:
+		if not tries % 10:
+			await asyncio.sleep(3.0)
+
+		status = commands.register_request(uid, pwhash, devid, devicekey)
+		if status.error():
+			return status
+
+		request = status['request']
+		status = commands.register_result(await _exchange(conn, request), request)
+		if status.error() or not status.has_value('retry'):
+			return status
+		tries = tries + 1
+
+
+@metrics.timed(metrics.COMMAND)
+async def reset_password(conn: AsyncServerConnection, wid: str, reset_code='',
+	expires='') -> RetVal:
+	'''Resets a workspace's password'''
+	response = await _exchange(conn, commands.reset_password_request(wid, reset_code, expires))
+	return commands.reset_password_result(response)
+
+
+@metrics.timed(metrics.COMMAND)
+async def setpassword(conn: AsyncServerConnection, pwhash: str, newpwhash: str) -> RetVal:
+	'''Changes the password for the workspace'''
+	request = commands.setpassword_request(pwhash, newpwhash)
+	return commands.check_response(await _exchange(conn, request), 200)
+
+
+@metrics.timed(metrics.COMMAND)
+async def setstatus(conn: AsyncServerConnection, wid: str, status: str):
+	'''Sets the activity status of the workspace specified. Requires admin privileges'''
+	out = commands.setstatus_request(wid, status)
+	if out.error():
+		return out
+
+	return commands.check_response(await _exchange(conn, out['request']), 200)
+
+
+@metrics.timed(metrics.COMMAND)
+async def unregister(conn: AsyncServerConnection, pwhash: str, wid: str) -> RetVal:
+	'''Deletes the online account at the specified server.'''
+	status = commands.unregister_request(pwhash, wid)
+	if status.error():
+		return status
+
+	return commands.check_response(await _exchange(conn, status['request']), 202)
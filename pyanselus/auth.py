@@ -1,12 +1,15 @@
 '''This module encapsulates authentication, credentials, and session management'''
 
-import base64
 import sqlite3
 
+import pyanselus.dbconn as dbconn
 import pyanselus.encryption as encryption
+import pyanselus.metrics as metrics
 import pyanselus.utils as utils
+from pyanselus.cryptostring import CryptoString
 from pyanselus.retval import RetVal, ResourceNotFound, ResourceExists, BadParameterValue
 
+@metrics.timed(metrics.SQL)
 def get_credentials(db: sqlite3.Connection, wid: str, domain: str) -> RetVal:
 	'''Returns the stored login credentials for the requested wid'''
 	cursor = db.cursor()
@@ -22,6 +25,7 @@ def get_credentials(db: sqlite3.Connection, wid: str, domain: str) -> RetVal:
 	return status
 
 
+@metrics.timed(metrics.SQL)
 def set_credentials(db, wid: str, domain: str, pw: encryption.Password) -> RetVal:
 	'''Sets the password and hash type for the specified workspace. A boolean success 
 	value is returned.'''
@@ -34,9 +38,10 @@ def set_credentials(db, wid: str, domain: str, pw: encryption.Password) -> RetVa
 	cursor = db.cursor()
 	cursor.execute("UPDATE workspaces SET password=?,pwhashtype=? WHERE wid=? AND domain=?",
 		(pw.hashstring, pw.hashtype, wid, domain))
-	db.commit()
+	dbconn.commit(db)
 	return RetVal()
 
+@metrics.timed(metrics.SQL)
 def add_device_session(db, address: str, devid: str, enctype: str, public_key: str, 
 		private_key: str, devname='') -> RetVal:
 	'''Adds a device to a workspace'''
@@ -78,10 +83,11 @@ def add_device_session(db, address: str, devid: str, enctype: str, public_key: s
 				address, devid, enctype, public_key, private_key) 
 				VALUES(?,?,?,?,?)''',
 				(address, devid, enctype, public_key, private_key))
-	db.commit()
+	dbconn.commit(db)
 	return RetVal()
 
 
+@metrics.timed(metrics.SQL)
 def remove_device_session(db, devid: str) -> RetVal:
 	'''
 	Removes an authorized device from the workspace. Returns a boolean success code.
@@ -93,10 +99,11 @@ def remove_device_session(db, devid: str) -> RetVal:
 		return RetVal(ResourceNotFound)
 
 	cursor.execute("DELETE FROM sessions WHERE devid=?", (devid,))
-	db.commit()
+	dbconn.commit(db)
 	return RetVal()
 
 
+@metrics.timed(metrics.SQL)
 def get_session_public_key(db: sqlite3.Connection, address: str) -> RetVal:
 	'''Returns the public key for the device for a session'''
 	cursor = db.cursor()
@@ -107,6 +114,7 @@ def get_session_public_key(db: sqlite3.Connection, address: str) -> RetVal:
 	return RetVal().set_value('key', results[0])
 
 
+@metrics.timed(metrics.SQL)
 def get_session_private_key(db: sqlite3.Connection, address: str) -> RetVal:
 	'''Returns the private key for the device for a session'''
 	cursor = db.cursor()
@@ -117,6 +125,7 @@ def get_session_private_key(db: sqlite3.Connection, address: str) -> RetVal:
 	return RetVal().set_value('key', results[0])
 
 
+@metrics.timed(metrics.SQL)
 def add_key(db: sqlite3.Connection, key: encryption.CryptoKey, address: str) -> RetVal:
 	'''Adds an encryption key to a workspace.
 	Parameters:
@@ -136,19 +145,20 @@ def add_key(db: sqlite3.Connection, key: encryption.CryptoKey, address: str) ->
 		cursor.execute('''INSERT INTO keys(keyid,address,type,category,private,algorithm)
 			VALUES(?,?,?,?,?,?)''', (key.get_id(), address, 'symmetric', '',
 				key.get_key(), key.enctype))
-		db.commit()
+		dbconn.commit(db)
 		return RetVal()
 	
 	if key.enctype == 'CURVE25519':
 		cursor.execute('''INSERT INTO keys(keyid,address,type,category,private,public,algorithm)
 			VALUES(?,?,?,?,?,?,?)''', (key.get_id(), address, 'asymmetric', '',
 				key.private.as_string(), key.public.as_string(), key.enctype))
-		db.commit()
+		dbconn.commit(db)
 		return RetVal()
 	
 	return RetVal(BadParameterValue, "Key must be 'asymmetric' or 'symmetric'")
 
 
+@metrics.timed(metrics.SQL)
 def remove_key(db: sqlite3.Connection, keyid: str) -> RetVal:
 	'''Deletes an encryption key from a workspace.
 	Parameters:
@@ -164,10 +174,11 @@ def remove_key(db: sqlite3.Connection, keyid: str) -> RetVal:
 		return RetVal(ResourceNotFound)
 
 	cursor.execute("DELETE FROM keys WHERE keyid=?", (keyid,))
-	db.commit()
+	dbconn.commit(db)
 	return RetVal()
 
 
+@metrics.timed(metrics.SQL)
 def get_key(db: sqlite3.Connection, keyid: str) -> RetVal:
 	'''Gets the specified key.
 	Parameters:
@@ -187,15 +198,15 @@ def get_key(db: sqlite3.Connection, keyid: str) -> RetVal:
 	if not results or not results[0]:
 		return RetVal(ResourceNotFound)
 	
+	# Keys are stored in CryptoString format by add_key()
 	if results[1] == 'asymmetric':
-		public = base64.b85decode(results[4])
-		private = base64.b85decode(results[3])
-		key = encryption.EncryptionPair(public,	private)
+		key = encryption.EncryptionPair(CryptoString(results[4]), CryptoString(results[3]))
+		key.id = keyid
 		return RetVal().set_value('key', key)
 	
 	if results[1] == 'symmetric':
-		private = base64.b85decode(results[3])
-		key = encryption.SecretKey(private)
+		key = encryption.SecretKey(CryptoString(results[3]))
+		key.id = keyid
 		return RetVal().set_value('key', key)
 	
 	return RetVal(BadParameterValue, "Key must be 'asymmetric' or 'symmetric'")
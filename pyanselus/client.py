@@ -4,8 +4,10 @@ import socket
 
 import pyanselus.auth as auth
 import pyanselus.serverconn as serverconn
-from pyanselus.encryption import Password, EncryptionPair
-from pyanselus.retval import RetVal, InternalError, BadParameterValue, ResourceExists
+from pyanselus.connpool import ConnectionPool
+from pyanselus.encryption import Password, EncryptionPair, get_password_hasher
+from pyanselus.retval import RetVal, InternalError, BadParameterValue, ExceptionThrown, \
+	NetworkError, ResourceExists
 from pyanselus.storage import ClientStorage
 from pyanselus.userprofile import Profile
 from pyanselus.workspace import Workspace
@@ -19,7 +21,8 @@ class AnselusClient:
 	def __init__(self):
 		self.fs = ClientStorage()
 		self.active_profile = ''
-		self.conn = serverconn.ServerConnection()
+		self.pool = ConnectionPool()
+		self.hasher = get_password_hasher()
 
 	def activate_profile(self, name) -> RetVal:
 		'''Activates the specified profile'''
@@ -28,10 +31,11 @@ class AnselusClient:
 		if status.error():
 			return status
 		
-		self.conn.disconnect()
-		
-		status = self.conn.connect(status['host'],status['port'])
-		return status
+		# Connect now so that the first command can reuse the connection from the pool
+		status = self.pool.acquire(status['host'],status['port'])
+		if status.error():
+			return status
+		return self.pool.release(status['conn'])
 	
 	def get_active_profile(self) -> Profile:
 		'''Returns a copy of the active profile'''
@@ -85,14 +89,14 @@ class AnselusClient:
 		if '"' in uid or '/' in uid:
 			return RetVal(BadParameterValue, "User ID can't contain \" or /")
 
-		status = self.conn.connect('127.0.0.1', port)
+		status = self.pool.acquire('127.0.0.1', port)
 		if status.error():
 			return status
 		
-		regdata = serverconn.preregister(self.conn, '', uid, '')
+		regdata = serverconn.preregister(status['conn'], '', uid, '')
+		self.__release(status['conn'], regdata)
 		if regdata.error():
 			return regdata
-		self.conn.disconnect()
 
 		if regdata['status'] != 200:
 			return regdata
@@ -157,21 +161,21 @@ class AnselusClient:
 		# Password requirements aren't really set here, but we do have to draw the 
 		# line *somewhere*.
 		pw = Password()
-		status = pw.Set(userpass)
+		status = self.hasher.set(pw, userpass).result()
 		if status.error():
 			return status
 		
 		# Add the device to the workspace
 		devpair = EncryptionPair()
 
-		status = self.conn.connect(host, port)
+		status = self.pool.acquire(host, port)
 		if status.error():
 			return status
 		
-		regdata = serverconn.register(self.conn, userid, pw.hashstring, devpair.public)
+		regdata = serverconn.register(status['conn'], userid, pw.hashstring, devpair.public)
+		self.__release(status['conn'], regdata)
 		if regdata.error():
 			return regdata
-		self.conn.disconnect()
 
 		# Possible status codes from register()
 		# 304 - Registration closed
@@ -201,3 +205,16 @@ class AnselusClient:
 			return status
 
 		return regdata
+
+	def __release(self, conn: serverconn.ServerConnection, status: RetVal):
+		'''Returns a connection to the pool after a command. A command which failed may have left 
+		the session partway through, so the session is cancelled before the connection is reused. 
+		The connection is closed instead if the failure was in the connection itself or the cancel 
+		fails.'''
+		if not status.error():
+			self.pool.release(conn)
+			return
+		
+		reuse = status.error() not in [ExceptionThrown, NetworkError] \
+			and not serverconn.cancel(conn).error()
+		self.pool.release(conn, reuse)
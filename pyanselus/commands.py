@@ -0,0 +1,578 @@
+'''This module builds the requests for Anselus commands and checks the server's responses to 
+them. It does no network I/O of its own and is shared by the blocking commands in serverconn and 
+the asyncio ones in asyncconn, so the two always send the same requests and handle responses the 
+same way. Applications should use those modules instead of this one.
+
+Most commands have a <command>_request() function, which returns the request or, if it has to 
+check its parameters, a RetVal with the request in the field 'request'. Commands whose response 
+needs more than a check of its code have a <command>_result() function. Commands which answer a 
+server challenge have <command>_answer() or <command>_sign() functions, which take the response 
+to the first request and return the second one.'''
+
+from base64 import b85encode
+import re
+import secrets
+import uuid
+
+from pyanselus.cryptostring import CryptoString
+from pyanselus.encryption import DecryptionFailure, EncryptionPair, PublicKey, SigningPair
+from pyanselus.keycard import EntryBase
+from pyanselus.retval import RetVal, BadParameterValue, ExceptionThrown, ResourceExists, \
+	ServerError
+import pyanselus.utils as utils
+from pyanselus.validation import validate as validate_schema
+
+AnsBadRequest = '400-BadRequest'
+
+server_response = {
+	'title' : 'Anselus Server Response',
+	'type' : 'object',
+	'required' : [ 'Code', 'Status', 'Data' ],
+	'properties' : {
+		'Code' : {
+			'type' : 'integer'
+		},
+		'Status' : {
+			'type' : 'string'
+		},
+		'Data' : {
+			'type' : 'object'
+		}
+	}
+}
+
+
+def parse_response(codec, frame: bytes, schema: dict) -> RetVal:
+	'''Turns a message received from the server into a response, checking it against schema if 
+	one is given'''
+	try:
+		rawresponse = codec.decode(frame)
+		if schema:
+			validate_schema(rawresponse, schema)
+
+		response = RetVal()
+		response['Code'] = rawresponse['Code']
+		response['Status'] = rawresponse['Status']
+		response['Info'] = rawresponse.get('Info', '')
+		response['Data'] = rawresponse['Data']
+	except Exception as e:
+		return RetVal(ExceptionThrown, e)
+	
+	return response
+
+
+def check_response(response: RetVal, code: int) -> RetVal:
+	'''Returns the error from a failed read or, if the server's response code isn't the one 
+	expected, the server's error. An empty RetVal is returned otherwise.'''
+	if response.error():
+		return response
+	
+	if response['Code'] != code:
+		return wrap_server_error(response)
+	
+	return RetVal()
+
+
+def wrap_server_error(response) -> RetVal:
+	'''Wraps a server response into a RetVal object'''
+	out = RetVal(ServerError, response['Status']).set_values({
+		'Code' : response['Code'],
+		'Status' : response['Status'],
+		'Info' : ''
+	})
+	
+	if 'Info' in response:
+		out['Info'] = response['Info']
+	
+	return out
+
+
+def addentry_request(entry: EntryBase) -> dict:
+	'''Returns the first request of an ADDENTRY command, which uploads the entry'''
+	return {
+		'Action' : "ADDENTRY",
+		'Data' : { 'Base-Entry' : entry.make_bytestring(0).decode() }
+	}
+
+
+def addentry_sign(response: RetVal, entry: EntryBase, ovkey: CryptoString,
+	spair: SigningPair) -> RetVal:
+	'''Processes the server's response to the first ADDENTRY request, which checks the
+	organization's signature and the hash and adds the user's signature. The final request is
+	returned in the field 'request'.'''
+	status = check_response(response, 100)
+	if status.error():
+		return status
+
+	for field in ['Organization-Signature', 'Hash', 'Previous-Hash']	:
+		if field not in response['Data']:
+			return RetVal(ServerError, f"Server did not return required field {field}")
+
+	entry.signatures['Organization'] =  response['Data']['Organization-Signature']
+
+	# A regular client will check the entry cache, pull updates to the org card, and get the
+	# verification key. Because this is just an integration test, we skip all that and just use
+	# the known verification key from earlier in the test.
+	status = entry.verify_signature(ovkey, 'Organization')
+	if status.error():
+		return status
+
+	entry.prev_hash = response['Data']['Previous-Hash']
+	entry.hash = response['Data']['Hash']
+	status = entry.verify_hash()
+	if status.error():
+		return status
+
+	# User sign and verify
+	status = entry.sign(spair.private, 'User')
+	if status.error():
+		return status
+
+	status = entry.verify_signature(spair.public, 'User')
+	if status.error():
+		return status
+
+	status = entry.is_compliant()
+	if status.error():
+		return status
+
+	return RetVal().set_value('request', {
+		'Action' : "ADDENTRY",
+		'Data' : { 'User-Signature' : entry.signatures['User'] }
+	})
+
+
+def cancel_request() -> dict:
+	'''Returns the request for a CANCEL command'''
+	return { 'Action' : "CANCEL", 'Data' : {}}
+
+
+def device_request(devid: str, devpair: EncryptionPair) -> RetVal:
+	'''Validates the parameters for a DEVICE command. The request is returned in the field
+	'request'.'''
+	if not utils.validate_uuid(devid):
+		return RetVal(AnsBadRequest, 'Invalid device ID').set_value('status', 400)
+
+	return RetVal().set_value('request', {
+		'Action' : "DEVICE",
+		'Data' : {
+			'Device-ID' : devid,
+			'Device-Key' : devpair.public
+		}
+	})
+
+
+def device_answer(response: RetVal, devid: str, devpair: EncryptionPair) -> RetVal:
+	'''Decrypts the challenge in the server's response to a DEVICE request and returns the request
+	containing the answer in the field 'request'. DecryptionFailure is returned if the challenge
+	can't be decrypted, in which case the command should be cancelled.'''
+	status = check_response(response, 100)
+	if status.error():
+		return status
+
+	if 'Challenge' not in response['Data']:
+		return RetVal(ServerError, 'server did not return a device challenge')
+
+	status = devpair.decrypt(response['Data']['Challenge'])
+	if status.error():
+		return RetVal(DecryptionFailure, 'failed to decrypt device challenge')
+
+	return RetVal().set_value('request', {
+		'Action' : "DEVICE",
+		'Data' : {
+			'Device-ID' : devid,
+			'Device-Key' : devpair.public,
+			'Response' : status['data']
+		}
+	})
+
+
+def devkey_request(devid: str, oldpair: EncryptionPair, newpair: EncryptionPair) -> RetVal:
+	'''Validates the parameters for a DEVKEY command. The request is returned in the field
+	'request'.'''
+	if not utils.validate_uuid(devid):
+		return RetVal(AnsBadRequest, 'Invalid device ID').set_value('status', 400)
+
+	return RetVal().set_value('request', {
+		'Action' : "DEVKEY",
+		'Data' : {
+			'Device-ID': devid,
+			'Old-Key': oldpair.public,
+			'New-Key': newpair.public
+		}
+	})
+
+
+def devkey_answer(response: RetVal, oldpair: EncryptionPair, newpair: EncryptionPair) -> RetVal:
+	'''Decrypts the challenges in the server's response to a DEVKEY request and returns the
+	request containing the answers in the field 'request'. DecryptionFailure is returned if
+	either challenge can't be decrypted, in which case the command should be cancelled.'''
+	status = check_response(response, 100)
+	if status.error():
+		return status
+
+	if 'Challenge' not in response['Data'] or 'New-Challenge' not in response['Data']:
+		return RetVal(ServerError, 'server did not return both device challenges')
+
+	status = oldpair.decrypt(response['Data']['Challenge'])
+	if status.error():
+		return RetVal(DecryptionFailure, 'failed to decrypt device challenge for old key')
+
+	request = {
+		'Action' : "DEVKEY",
+		'Data' : {
+			'Response' : status['data']
+		}
+	}
+
+	status = newpair.decrypt(response['Data']['New-Challenge'])
+	if status.error():
+		return RetVal(DecryptionFailure, 'failed to decrypt device challenge for new key')
+	request['Data']['New-Response'] = status['data']
+	return RetVal().set_value('request', request)
+
+
+def exists_request(path: str) -> dict:
+	'''Returns the request for an EXISTS command'''
+	return {
+		'Action' : 'EXISTS',
+		'Data' : {
+			'Path' : path
+		}}
+
+
+def exists_result(response: RetVal) -> RetVal:
+	'''Processes the server's response to an EXISTS command'''
+	if response.error():
+		return response
+
+	if response['Code'] == 200:
+		return RetVal().set_value('exists', True)
+
+	return RetVal().set_value('exists', False)
+
+
+def getwid_request(uid: str, domain: str) -> RetVal:
+	'''Validates the parameters for a GETWID command. The request is returned in the field 
+	'request'.'''
+	if re.findall(r'[\\\/\s"]', uid) or len(uid) >= 64:
+		return RetVal(BadParameterValue, 'user id')
+	
+	if domain:
+		m = re.match(r'([a-zA-Z0-9]+\.)+[a-zA-Z0-9]+', domain)
+		if not m or len(domain) >= 64:
+			return RetVal(BadParameterValue, 'bad domain value')
+	
+	request = {
+		'Action' : 'GETWID',
+		'Data' : {
+			'User-ID': uid
+		}
+	}
+	if domain:
+		request['Data']['Domain'] = domain
+	
+	return RetVal().set_value('request', request)
+
+
+def getwid_result(response: RetVal) -> RetVal:
+	'''Processes the server's response to a GETWID command'''
+	status = check_response(response, 200)
+	if status.error():
+		return status
+
+	if 'Workspace-ID' not in response['Data']:
+		return RetVal(ServerError, 'server did not return a workspace ID')
+
+	return RetVal().set_value('Workspace-ID', response['Data']['Workspace-ID'])
+
+
+def iscurrent_request(index: int, wid: str) -> RetVal:
+	'''Validates the parameters for an ISCURRENT command. The request is returned in the field 
+	'request'.'''
+	if wid and not utils.validate_uuid(wid):
+		return RetVal(AnsBadRequest).set_value('status', 400)
+	
+	request = {
+		'Action' : 'ISCURRENT',
+		'Data' : {
+			'Index' : str(index)
+		}
+	}
+	if wid:
+		request['Data']['Workspace-ID'] = wid
+	
+	return RetVal().set_value('request', request)
+
+
+def iscurrent_result(response: RetVal) -> RetVal:
+	'''Processes the server's response to an ISCURRENT command'''
+	status = check_response(response, 200)
+	if status.error():
+		return status
+
+	if 'Is-Current' not in response['Data']:
+		return RetVal(ServerError, 'server did not return an answer')
+
+	return RetVal().set_value('iscurrent', bool(response['Data']['Is-Current'] == 'YES'))
+
+
+def login_request(wid: str, serverkey: CryptoString) -> RetVal:
+	'''Validates the parameters for a LOGIN command and makes a challenge for the server. The
+	request is returned in the field 'request' and the challenge in the field 'challenge'.'''
+	if not utils.validate_uuid(wid):
+		return RetVal(BadParameterValue)
+
+	challenge = b85encode(secrets.token_bytes(32))
+	ekey = PublicKey(serverkey)
+	status = ekey.encrypt(challenge)
+	if status.error():
+		return status
+
+	return RetVal().set_values({
+		'request' : {
+			'Action' : "LOGIN",
+			'Data' : {
+				'Workspace-ID' : wid,
+				'Login-Type' : 'PLAIN',
+				'Challenge' : status['data']
+			}
+		},
+		'challenge' : challenge.decode()
+	})
+
+
+def login_result(response: RetVal, challenge: str) -> RetVal:
+	'''Processes the server's response to a LOGIN command, which must contain the decrypted
+	challenge'''
+	status = check_response(response, 100)
+	if status.error():
+		return status
+
+	if response['Data'].get('Response') != challenge:
+		return RetVal(ServerError, 'server failed to decrypt challenge')
+
+	return RetVal()
+
+
+def logout_request() -> dict:
+	'''Returns the request for a LOGOUT command'''
+	return {'Action':'LOGOUT', 'Data':{}}
+
+
+def passcode_request(wid: str, reset_code: str, pwhash: str) -> dict:
+	'''Returns the request for a PASSCODE command'''
+	return {
+		'Action': 'PASSCODE',
+		'Data': {
+			'Workspace-ID': wid,
+			'Reset-Code': reset_code,
+			'Password-Hash': pwhash
+		}
+	}
+
+
+def password_request(wid: str, pwhash: str) -> RetVal:
+	'''Validates the parameters for a PASSWORD command. The request is returned in the field
+	'request'.'''
+	if not pwhash or not utils.validate_uuid(wid):
+		return RetVal(BadParameterValue)
+
+	return RetVal().set_value('request', {
+		'Action' : "PASSWORD",
+		'Data' : { 'Password-Hash' : pwhash }
+	})
+
+
+def preregister_request(wid: str, uid: str, domain: str) -> dict:
+	'''Returns the request for a PREREG command'''
+	request = { 'Action':'PREREG', 'Data':{} }
+	if wid:
+		request['Data']['Workspace-ID'] = wid
+	if uid:
+		request['Data']['User-ID'] = uid
+	if domain:
+		request['Data']['Domain'] = domain
+	return request
+
+
+def preregister_result(response: RetVal) -> RetVal:
+	'''Processes the server's response to a PREREG command'''
+	status = check_response(response, 200)
+	if status.error():
+		return status
+
+	out = RetVal()
+
+	# Validate response fields
+	fields = { 'Domain':'domain', 'Workspace-ID':'wid', 'Reg-Code':'regcode' }
+	for k,v in fields.items():
+		if k in response['Data']:
+			if isinstance(response['Data'][k], str):
+				out[v] = response['Data'][k]
+			else:
+				out.set_error(ServerError, 'server returned incorrect data')
+		else:
+			out.set_error(ServerError, 'server did not return all required fields')
+
+	if 'User-ID' in response['Data']:
+		if isinstance(response['Data']['User-ID'], str):
+			out['uid'] = response['Data']['User-ID']
+		else:
+			out.set_error(ServerError, 'server returned incorrect data')
+
+	return out
+
+
+def regcode_request(regid: str, code: str, pwhash: str, devid: str, devpair: EncryptionPair,
+	domain: str) -> dict:
+	'''Returns the request for a REGCODE command'''
+	request = {
+		'Action':'REGCODE',
+		'Data':{
+			'Reg-Code': code,
+			'Password-Hash':pwhash,
+			'Device-ID':devid,
+			'Device-Key':devpair.public
+		}
+	}
+
+	if domain:
+		request['Data']['Domain'] = domain
+
+	if utils.validate_uuid(regid):
+		request['Data']['Workspace-ID'] = regid
+	else:
+		request['Data']['User-ID'] = regid
+	return request
+
+
+def register_request(uid: str, pwhash: str, devid: str, devicekey: CryptoString) -> RetVal:
+	'''Validates the parameters for a REGISTER command and returns a request with a newly-generated
+	workspace ID in the field 'request'.'''
+	if uid and len(re.findall(r'[\/" \s]',uid)) > 0:
+		return RetVal(BadParameterValue, 'user id contains illegal characters')
+
+	# Technically, the active profile already has a WID, but it is not attached to a domain and
+	# doesn't matter as a result. Rather than adding complexity, we just generate a new UUID
+	# and always return the replacement value
+	request = {
+		'Action' : 'REGISTER',
+		'Data' : {
+			'Workspace-ID' : str(uuid.uuid4()),
+			'Password-Hash' : pwhash,
+			'Device-ID' : devid,
+			'Device-Key' : devicekey
+		}
+	}
+	if uid:
+		request['Data']['User-ID'] = uid
+	return RetVal().set_value('request', request)
+
+
+def register_result(response: RetVal, request: dict) -> RetVal:
+	'''Processes the server's response to a REGISTER command. If the workspace ID in the request
+	already exists, the field 'retry' is set and the command should be sent again with a new
+	one.'''
+	if response.error():
+		return response
+
+	if response['Code'] in [ 101, 201]:		# Pending, Success
+		if 'Domain' not in response['Data']:
+			return RetVal(ServerError, 'server did not return the domain')
+
+		return RetVal().set_values({
+			'devid' : request['Data']['Device-ID'],
+			'wid' : request['Data']['Workspace-ID'],
+			'domain' : response['Data']['Domain'],
+			'uid' : request['Data'].get('User-ID', '')
+		})
+
+	if response['Code'] == 408:	# WID or UID exists
+		if 'Field' not in response['Data']:
+			return RetVal(ServerError, 'server sent 408 without telling what existed')
+
+		if response['Data']['Field'] not in ['User-ID', 'Workspace-ID']:
+			return RetVal(ServerError, 'server sent bad 408 response').set_value( \
+				'Field', response['Data']['Field'])
+
+		if response['Data']['Field'] == 'User-ID':
+			return RetVal(ResourceExists, 'user id')
+
+		return RetVal().set_value('retry', True)
+
+	# Something we didn't expect -- reg closed, payment req'd, etc.
+	return wrap_server_error(response)
+
+
+def reset_password_request(wid: str, reset_code: str, expires: str) -> dict:
+	'''Returns the request for a RESETPASSWORD command'''
+	return {
+		'Action': 'RESETPASSWORD',
+		'Data': {
+			'Workspace-ID': wid,
+			'Reset-Code': reset_code,
+			'Expires': expires
+		}
+	}
+
+
+def reset_password_result(response: RetVal) -> RetVal:
+	'''Processes the server's response to a RESETPASSWORD command'''
+	status = check_response(response, 200)
+	if status.error():
+		return status
+
+	if 'Reset-Code' not in response['Data'] or 'Expires' not in response['Data']:
+		return RetVal(ServerError, 'server did not return all required fields')
+
+	out = RetVal()
+	out['resetcode'] = response['Data']['Reset-Code']
+	out['expires'] = response['Data']['Expires']
+	return out
+
+
+def setpassword_request(pwhash: str, newpwhash: str) -> dict:
+	'''Returns the request for a SETPASSWORD command'''
+	return {
+		'Action' : 'SETPASSWORD',
+		'Data' : {
+			'Password-Hash': pwhash,
+			'NewPassword-Hash': newpwhash
+		}
+	}
+
+
+def setstatus_request(wid: str, status: str) -> RetVal:
+	'''Validates the parameters for a SETSTATUS command. The request is returned in the field
+	'request'.'''
+	if status not in ['active', 'disabled', 'approved']:
+		return RetVal(BadParameterValue, "status must be 'active','disabled', or 'approved'")
+
+	if not utils.validate_uuid(wid):
+		return RetVal(BadParameterValue, 'bad wid')
+
+	return RetVal().set_value('request', {
+		'Action' : 'SETSTATUS',
+		'Data' : {
+			'Workspace-ID': wid,
+			'Status': status
+		}
+	})
+
+
+def unregister_request(pwhash: str, wid: str) -> RetVal:
+	'''Validates the parameters for an UNREGISTER command. The request is returned in the field
+	'request'.'''
+	if wid and not utils.validate_uuid(wid):
+		return RetVal(BadParameterValue, 'bad workspace id')
+
+	request = {
+		'Action' : 'UNREGISTER',
+		'Data' : {
+			'Password-Hash' : pwhash
+		}
+	}
+	if wid:
+		request['Data']['Workspace-ID'] = wid
+	return RetVal().set_value('request', request)
@@ -0,0 +1,146 @@
+'''This module provides a thread-safe pool of ServerConnection objects so that repeated commands
+to the same server can skip connection setup, the greeting, and logging in again.'''
+
+import contextlib
+import threading
+import time
+
+from pyanselus.retval import RetVal, BadParameterValue, ResourceNotFound
+import pyanselus.serverconn as serverconn
+
+# Maximum number of idle connections kept for each host/port/workspace combination
+MAX_IDLE_PER_KEY = 4
+
+# Number of seconds an unused connection is kept before it is closed
+IDLE_TIMEOUT = 300.0
+
+class ConnectionPool:
+	'''Keeps connections alive between commands. Connections are keyed by host, port, and the
+	workspace ID they are logged into, if any. A connection handed out by acquire() is used by only
+	one caller at a time until it is given back with release().'''
+	def __init__(self, max_idle=MAX_IDLE_PER_KEY, idle_timeout=IDLE_TIMEOUT):
+		self.max_idle = max_idle
+		self.idle_timeout = idle_timeout
+		self.__lock = threading.Lock()
+
+		# Maps (host, port, wid) to a list of (ServerConnection, time last used)
+		self.__idle = dict()
+
+		# Maps id(ServerConnection) to the key of connections which are currently in use and the
+		# generation of the pool they were handed out in. close() starts a new generation so that
+		# connections in use at the time are closed when released.
+		self.__in_use = dict()
+		self.__generation = 0
+
+	def acquire(self, host: str, port: int, wid='', login=None) -> RetVal:
+		'''Returns a connection to the requested server in the field 'conn'. An idle connection is
+		reused if a healthy one exists. Otherwise, a new connection is made and, if wid is not
+		empty, the callable login is called with the new connection. It is expected to log into
+		the workspace and return a RetVal.'''
+		if wid and login is None:
+			return RetVal(BadParameterValue, 'login is required when wid is specified')
+
+		key = (host, port, wid)
+		self.evict_idle()
+
+		while True:
+			with self.__lock:
+				idle_list = self.__idle.get(key)
+				if not idle_list:
+					break
+				conn, _ = idle_list.pop()
+
+			if conn.is_alive():
+				with self.__lock:
+					self.__in_use[id(conn)] = (key, self.__generation)
+				return RetVal().set_value('conn', conn)
+			conn.close()
+
+		conn = serverconn.ServerConnection()
+		status = conn.connect(host, port)
+		if status.error():
+			return status
+
+		if wid:
+			status = login(conn)
+			if status.error():
+				conn.disconnect()
+				return status
+
+		with self.__lock:
+			self.__in_use[id(conn)] = (key, self.__generation)
+		return RetVal().set_value('conn', conn)
+
+	def release(self, conn: serverconn.ServerConnection, reuse=True) -> RetVal:
+		'''Returns a connection to the pool. If reuse is False, such as when a command fails partway
+		through and the session state is unknown, the connection is closed instead.'''
+		with self.__lock:
+			entry = self.__in_use.pop(id(conn), None)
+			if entry is None:
+				return RetVal(ResourceNotFound, 'connection does not belong to this pool')
+
+			key, generation = entry
+			reuse = reuse and generation == self.__generation
+			idle_list = self.__idle.setdefault(key, list())
+			if reuse and conn.is_connected() and len(idle_list) < self.max_idle:
+				idle_list.append((conn, time.monotonic()))
+				return RetVal()
+
+		conn.disconnect()
+		return RetVal()
+
+	@contextlib.contextmanager
+	def connection(self, host: str, port: int, wid='', login=None):
+		'''Context manager wrapper around acquire() and release(). The acquire() RetVal is yielded
+		and the connection is closed instead of returned if an exception is raised.'''
+		status = self.acquire(host, port, wid, login)
+		if status.error():
+			yield status
+			return
+
+		try:
+			yield status
+		except BaseException:
+			self.release(status['conn'], False)
+			raise
+		self.release(status['conn'])
+
+	def evict_idle(self) -> int:
+		'''Closes connections which have been idle longer than the idle timeout. Returns the number
+		of connections closed.'''
+		expired = list()
+		cutoff = time.monotonic() - self.idle_timeout
+		with self.__lock:
+			for key in list(self.__idle.keys()):
+				keep = list()
+				for item in self.__idle[key]:
+					if item[1] < cutoff:
+						expired.append(item[0])
+					else:
+						keep.append(item)
+
+				if keep:
+					self.__idle[key] = keep
+				else:
+					del self.__idle[key]
+
+		for conn in expired:
+			conn.disconnect()
+		return len(expired)
+
+	def idle_count(self) -> int:
+		'''Returns the number of idle connections in the pool'''
+		with self.__lock:
+			return sum([len(x) for x in self.__idle.values()])
+
+	def close(self):
+		'''Closes all idle connections. Connections which are in use are closed when released. The 
+		pool can still be used afterward.'''
+		with self.__lock:
+			idle = self.__idle
+			self.__idle = dict()
+			self.__generation = self.__generation + 1
+
+		for idle_list in idle.values():
+			for conn, _ in idle_list:
+				conn.disconnect()
@@ -7,37 +7,58 @@ import re
 
 from pyanselus.retval import RetVal, BadData, BadParameterValue
 
+# Matches the algorithm name and the colon after it
+_PREFIX_PATTERN = re.compile(r'[A-Z0-9-]{1,15}:')
+
 class CryptoString:
 	'''This class encapsulates code for working with strings associated with an algorithm. This 
-	includes hashes and encryption keys.'''
-	def __init__(self, data=''):
+	includes hashes and encryption keys. The decoded bytes are kept once they have been decoded, 
+	so validating the string and using the key only costs one Base85 decode.'''
+	__slots__ = ('prefix', '_data', '_raw')
+
+	def __init__(self, data='', lazy=False):
+		self._raw = None
 		if data:
-			self.set(data)
+			self.set(data, lazy)
 		else:
 			self.prefix = ''
-			self.data = ''
+			self._data = ''
 	
-	def set(self, data: str) -> RetVal:
+	@property
+	def data(self) -> str:
+		'''The Base85-encoded data'''
+		return self._data
+
+	@data.setter
+	def data(self, value: str):
+		self._data = value
+		self._raw = None
+
+	def set(self, data: str, lazy=False) -> RetVal:
 		'''Initializes the instance from data passed to it. The string is expected to follow the 
-		format ALGORITHM:DATA, where DATA is assumed to be base85-encoded raw byte data'''
+		format ALGORITHM:DATA, where DATA is assumed to be base85-encoded raw byte data.
+
+		The data is decoded to validate it and the result is kept for raw_data(). If lazy is True, 
+		only the prefix is checked and decoding waits until raw_data() is first called, which 
+		saves the work for strings which are only stored or passed along. raw_data() raises 
+		ValueError if the data turns out to be invalid.'''
 		
-		self.prefix = self.data = ''
+		self.prefix = self._data = ''
+		self._raw = None
 
-		m = re.match(r'^[A-Z0-9-]{1,15}:', data)
+		m = _PREFIX_PATTERN.match(data)
 		if not m:
 			return RetVal(BadParameterValue, 'prefix is non-compliant')
 	
-		parts = data.split(':', 1)
-		if len(parts) != 2:
-			return RetVal(BadParameterValue, 'bad data string')
-		
-		try:
-			_ = base64.b85decode(parts[1])
-		except:
-			return RetVal(BadParameterValue, 'error decoding data')
+		encoded = data[m.end():]
+		if not lazy:
+			try:
+				self._raw = base64.b85decode(encoded)
+			except:
+				return RetVal(BadParameterValue, 'error decoding data')
 		
-		self.prefix = parts[0]
-		self.data = parts[1]
+		self.prefix = data[:m.end() - 1]
+		self._data = encoded
 		return RetVal()
 
 	def set_bytes(self, data: bytes) -> RetVal:
@@ -47,14 +68,25 @@ class CryptoString:
 		except Exception as e:
 			return RetVal(BadData, e)
 	
+	def set_raw(self, prefix: str, data: bytes) -> RetVal:
+		'''Initializes the instance from an algorithm name and undecoded bytes, such as a newly 
+		generated key, without having to decode the result again'''
+		if not _PREFIX_PATTERN.fullmatch(prefix + ':'):
+			return RetVal(BadParameterValue, 'prefix is non-compliant')
+		
+		self.prefix = prefix
+		self._raw = bytes(data)
+		self._data = base64.b85encode(self._raw).decode()
+		return RetVal()
+	
 	def __str__(self):
-		return '%s:%s' % (self.prefix, self.data)
+		return '%s:%s' % (self.prefix, self._data)
 	
 	def __eq__(self, b):
-		return self.prefix == b.prefix and self.data == b.data
+		return self.prefix == b.prefix and self._data == b.data
 
 	def __ne__(self, b):
-		return self.prefix != b.prefix or self.data != b.data
+		return self.prefix != b.prefix or self._data != b.data
 
 	def as_string(self):
 		'''Returns the instance information as a string'''
@@ -62,17 +94,25 @@ class CryptoString:
 	
 	def as_bytes(self) -> bytes:
 		'''Returns the instance information as a byte string'''
-		return b'%s:%s' % (self.prefix, self.data)
+		return str(self).encode()
 	
 	def raw_data(self) -> bytes:
-		'''Decodes the internal data and returns it as a byte string.'''
-		return base64.b85decode(self.data)
+		'''Returns the decoded data as a byte string. The data is only decoded the first time.'''
+		if self._raw is None:
+			self._raw = base64.b85decode(self._data)
+		return self._raw
+	
+	def raw_view(self) -> memoryview:
+		'''Returns a read-only memoryview of the decoded data, for passing it around without 
+		copying'''
+		return memoryview(self.raw_data())
 	
 	def is_valid(self) -> bool:
 		'''Returns false if the prefix and/or the data is missing'''
-		return self.prefix and self.data
+		return self.prefix and self._data
 	
 	def make_empty(self):
 		'''Makes the entry empty'''
 		self.prefix = ''
-		self.data = ''
+		self._data = ''
+		self._raw = None
@@ -0,0 +1,152 @@
+'''This module manages SQLite connections to a profile's database. Each thread gets its own
+connection, and every connection is set up for write-ahead logging so that readers don't block
+on writers. It also provides units of work, which let several database helpers share one
+transaction and commit once.'''
+
+import contextlib
+import sqlite3
+import threading
+
+# Settings applied to each new connection. Write-ahead logging with synchronous=NORMAL only syncs
+# at checkpoints instead of at every commit, which is still safe against corruption. A negative
+# cache_size is in KiB.
+DEFAULT_PRAGMAS = {
+	'journal_mode' : 'WAL',
+	'synchronous' : 'NORMAL',
+	'cache_size' : -8192,
+	'mmap_size' : 268435456,
+	'temp_store' : 'MEMORY',
+	'busy_timeout' : 5000,
+}
+
+class ConnectionManager:
+	'''Hands out one SQLite connection per thread for a database file. Connections are created
+	when a thread first asks for one and are all closed by close().'''
+	def __init__(self, path: str, pragmas=None):
+		self.path = path
+		self.pragmas = DEFAULT_PRAGMAS.copy()
+		if pragmas:
+			self.pragmas.update(pragmas)
+
+		self.__local = threading.local()
+		self.__lock = threading.Lock()
+		self.__connections = list()
+
+	def get(self) -> sqlite3.Connection:
+		'''Returns the calling thread's connection, opening it if needed'''
+		conn = getattr(self.__local, 'conn', None)
+		if conn is not None:
+			return conn
+
+		# Connections are only used by the thread that opened them, but close() may be called
+		# from any thread
+		conn = sqlite3.connect(self.path, check_same_thread=False)
+		for name, value in self.pragmas.items():
+			conn.execute(f"PRAGMA {name}={value}")
+
+		self.__local.conn = conn
+		with self.__lock:
+			self.__connections.append(conn)
+		return conn
+
+	def close_thread(self):
+		'''Closes the calling thread's connection, if it has one'''
+		conn = getattr(self.__local, 'conn', None)
+		if conn is None:
+			return
+
+		self.__local.conn = None
+		with self.__lock:
+			self.__connections.remove(conn)
+		conn.close()
+
+	def close(self):
+		'''Closes the connections of all threads'''
+		with self.__lock:
+			connections = self.__connections
+			self.__connections = list()
+
+		# Threads may still hold a closed connection in their local storage, so a new one is made
+		# for them on their next call to get()
+		self.__local = threading.local()
+		for conn in connections:
+			conn.close()
+
+	def connection_count(self) -> int:
+		'''Returns the number of open connections'''
+		with self.__lock:
+			return len(self.__connections)
+
+
+class UnitOfWork:
+	'''Tracks one transaction shared by the helpers called inside a transaction() block'''
+	def __init__(self, db: sqlite3.Connection):
+		self.db = db
+		self.depth = 0
+		self.aborted = False
+		self.thread = threading.get_ident()
+
+	def abort(self):
+		'''Marks the unit of work to be rolled back instead of committed when the outermost
+		transaction() block ends'''
+		self.aborted = True
+
+
+# Maps the id() of a connection to its open UnitOfWork. The unit keeps a reference to the
+# connection, so its id can't be reused by another connection while the unit is open.
+__units = dict()
+__units_lock = threading.Lock()
+
+def _get_unit(db: sqlite3.Connection):
+	'''Returns the open unit of work for a connection or None if it has none. A connection's
+	transaction is shared by every thread using it, so sqlite3.ProgrammingError is raised if
+	another thread has a unit of work open on it.'''
+	unit = __units.get(id(db))
+	if unit is None:
+		return None
+	if unit.thread != threading.get_ident():
+		raise sqlite3.ProgrammingError('connection has a unit of work open in another thread')
+	return unit
+
+
+@contextlib.contextmanager
+def transaction(db: sqlite3.Connection):
+	'''Context manager which groups the changes made by database helpers into one transaction.
+	Helpers which call commit() inside the block join the transaction instead of committing, and
+	blocks can be nested. Everything is committed at the end of the outermost block, or rolled
+	back if an exception escapes it or abort() was called on the yielded UnitOfWork. Units of 
+	work belong to the thread which opened them.'''
+	with __units_lock:
+		unit = _get_unit(db)
+		if unit is None:
+			unit = UnitOfWork(db)
+			__units[id(db)] = unit
+	
+	if unit.depth == 0 and not db.in_transaction:
+		db.execute('BEGIN')
+	unit.depth = unit.depth + 1
+	
+	try:
+		yield unit
+	except BaseException:
+		unit.aborted = True
+		raise
+	finally:
+		unit.depth = unit.depth - 1
+		if unit.depth == 0:
+			with __units_lock:
+				del __units[id(db)]
+			if unit.aborted:
+				db.rollback()
+			else:
+				db.commit()
+
+
+def commit(db: sqlite3.Connection):
+	'''Commits changes unless a transaction() block is open for the connection, in which case
+	they are committed along with the rest of its unit of work. sqlite3.ProgrammingError is raised 
+	if the block was opened by another thread.'''
+	with __units_lock:
+		if _get_unit(db) is not None:
+			return
+	db.commit()
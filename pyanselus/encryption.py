@@ -1,12 +1,17 @@
 '''Holds classes designed for working with encryption keys'''
+import asyncio
 import base64
+import concurrent.futures
 import json
 import os
 import re
+import struct
+import threading
 import uuid
 
 import jsonschema
 
+import nacl.exceptions
 import nacl.public
 import nacl.pwhash
 import nacl.secret
@@ -14,12 +19,34 @@ import nacl.signing
 import nacl.utils
 from pyanselus.cryptostring import CryptoString
 from pyanselus.hash import blake2hash
+import pyanselus.metrics as metrics
 from pyanselus.retval import RetVal, BadData, BadParameterValue, BadParameterType, \
 	ExceptionThrown, InternalError, ResourceExists, ResourceNotFound
+from pyanselus.validation import validate as validate_schema
 
 VerificationError = 'VerificationError'
 DecryptionFailure = 'DecryptionFailure'
 
+# Settings for the SecretKey streaming encryption format
+STREAM_MAGIC = b'ANSX'
+STREAM_VERSION = 1
+STREAM_CHUNK_SIZE = 65536
+STREAM_MAX_CHUNK_SIZE = 16 * 1024 * 1024
+STREAM_NONCE_PREFIX_SIZE = 16
+
+# Minimum number of recipients before encrypt_envelope() wraps keys on a thread pool
+PARALLEL_WRAP_THRESHOLD = 16
+
+# Argon2id cost settings for password hashing as (opslimit, memlimit) pairs. Higher profiles are
+# slower and use more memory, which also makes guessing attacks more expensive.
+PASSWORD_PROFILES = {
+	'interactive' : (nacl.pwhash.argon2id.OPSLIMIT_INTERACTIVE,
+		nacl.pwhash.argon2id.MEMLIMIT_INTERACTIVE),
+	'moderate' : (nacl.pwhash.argon2id.OPSLIMIT_MODERATE, nacl.pwhash.argon2id.MEMLIMIT_MODERATE),
+	'sensitive' : (nacl.pwhash.argon2id.OPSLIMIT_SENSITIVE,
+		nacl.pwhash.argon2id.MEMLIMIT_SENSITIVE),
+}
+
 # JSON schemas used to validate keyfile data
 __encryption_pair_schema = {
 	'type' : 'object',
@@ -74,7 +101,16 @@ class PublicKey (CryptoKey):
 		if not isinstance(public, CryptoString):
 			raise TypeError
 		self.public = public
+		self.__sealedbox = None
+
+	def __get_sealedbox(self) -> nacl.public.SealedBox:
+		'''Returns the SealedBox for the public key, which is created only when the key changes'''
+		if self.__sealedbox is None or self.__sealedbox[0] != self.public.data:
+			self.__sealedbox = (self.public.data,
+				nacl.public.SealedBox(nacl.public.PublicKey(self.public.raw_data())))
+		return self.__sealedbox[1]
 
+	@metrics.timed(metrics.CRYPTO)
 	def encrypt(self, data : bytes) -> RetVal:
 		'''Encrypt the passed data using the public key and return the Base85-encoded data in the 
 		field 'data'.'''
@@ -82,7 +118,7 @@ class PublicKey (CryptoKey):
 			return RetVal(BadParameterType, 'bytes expected')
 		
 		try:
-			sealedbox = nacl.public.SealedBox(nacl.public.PublicKey(self.public.raw_data()))
+			sealedbox = self.__get_sealedbox()
 			encrypted_data = sealedbox.encrypt(data, Base85Encoder).decode()
 		except Exception as e:
 			return RetVal(ExceptionThrown, str(e))
@@ -107,12 +143,12 @@ class EncryptionPair (CryptoKey):
 		else:
 			key = nacl.public.PrivateKey.generate()
 			self.enctype = 'CURVE25519'
-			self.public = CryptoString('CURVE25519:' + \
-					base64.b85encode(key.public_key.encode()).decode())
-			self.private = CryptoString('CURVE25519:' + \
-					base64.b85encode(key.encode()).decode())
+			self.public = _raw_cryptostring('CURVE25519', key.public_key.encode())
+			self.private = _raw_cryptostring('CURVE25519', key.encode())
 		self.pubhash = blake2hash(self.public.data.encode())
 		self.privhash = blake2hash(self.private.data.encode())
+		self.__public_box = None
+		self.__private_box = None
 
 	def __str__(self):
 		return '\n'.join([
@@ -120,6 +156,22 @@ class EncryptionPair (CryptoKey):
 			self.private.as_string()
 		])
 
+	def __get_public_box(self) -> nacl.public.SealedBox:
+		'''Returns the SealedBox used for encryption, which is created only when the public key 
+		changes'''
+		if self.__public_box is None or self.__public_box[0] != self.public.data:
+			self.__public_box = (self.public.data,
+				nacl.public.SealedBox(nacl.public.PublicKey(self.public.raw_data())))
+		return self.__public_box[1]
+
+	def __get_private_box(self) -> nacl.public.SealedBox:
+		'''Returns the SealedBox used for decryption, which is created only when the private key 
+		changes'''
+		if self.__private_box is None or self.__private_box[0] != self.private.data:
+			self.__private_box = (self.private.data,
+				nacl.public.SealedBox(nacl.public.PrivateKey(self.private.raw_data())))
+		return self.__private_box[1]
+
 	def get_public_key(self) -> str:
 		'''Returns the public key as a CryptoString string'''
 		return self.public.as_string()
@@ -161,6 +213,7 @@ class EncryptionPair (CryptoKey):
 
 		return RetVal()
 
+	@metrics.timed(metrics.CRYPTO)
 	def encrypt(self, data : bytes) -> RetVal:
 		'''Encrypt the passed data using the public key and return the Base85-encoded data in the 
 		field 'data'.'''
@@ -168,13 +221,14 @@ class EncryptionPair (CryptoKey):
 			return RetVal(BadParameterType, 'bytes expected')
 		
 		try:
-			sealedbox = nacl.public.SealedBox(nacl.public.PublicKey(self.public.raw_data()))
+			sealedbox = self.__get_public_box()
 			encrypted_data = sealedbox.encrypt(data, Base85Encoder).decode()
 		except Exception as e:
 			return RetVal(ExceptionThrown, str(e))
 		
 		return RetVal().set_value('data', encrypted_data)
 
+	@metrics.timed(metrics.CRYPTO)
 	def decrypt(self, data : str) -> RetVal:
 		'''Decrypt the passed data using the private key and return the raw data in the field 
 		'data'. Base85 decoding of the data is optional, but enabled by default.'''
@@ -182,7 +236,7 @@ class EncryptionPair (CryptoKey):
 			return RetVal(BadParameterType, 'string expected')
 		
 		try:
-			sealedbox = nacl.public.SealedBox(nacl.public.PrivateKey(self.private.raw_data()))
+			sealedbox = self.__get_private_box()
 			decrypted_data = sealedbox.decrypt(data.encode(), Base85Encoder)
 		except Exception as e:
 			return RetVal(ExceptionThrown, str(e))
@@ -210,7 +264,7 @@ def load_encryptionpair(path: str) -> RetVal:
 		return RetVal(BadData, 'File does not contain an Anselus JSON keypair')
 
 	try:
-		jsonschema.validate(indata, __encryption_pair_schema)
+		validate_schema(indata, __encryption_pair_schema)
 	except jsonschema.ValidationError:
 		return RetVal(BadData, "file data does not validate")
 	except jsonschema.SchemaError:
@@ -224,6 +278,97 @@ def load_encryptionpair(path: str) -> RetVal:
 	return RetVal().set_value('keypair', EncryptionPair(public_key, private_key))
 
 
+@metrics.timed(metrics.CRYPTO_OPERATION)
+def encrypt_envelope(data: bytes, recipients: list, max_workers=None) -> RetVal:
+	'''Encrypts data for multiple recipients, which are PublicKey or EncryptionPair objects. The 
+	data is encrypted only once, using a new SecretKey, and only that key is encrypted with each 
+	recipient's public key. Key wrapping is spread across a thread pool of up to max_workers 
+	threads when there are enough recipients to make it worthwhile.
+	
+	The envelope is returned in the field 'envelope' as a dictionary containing the 
+	Base85-encoded encrypted data in 'Payload' and the wrapped keys in 'Keys', indexed by the 
+	hash of the recipient's public key. If a recipient's key can't be used, the error is returned 
+	with the recipient's list index in the field 'index'.'''
+	if not isinstance(data, bytes):
+		return RetVal(BadParameterType, 'bytes expected')
+	
+	if not recipients:
+		return RetVal(BadParameterValue, 'recipients may not be empty')
+	
+	if max_workers is None:
+		max_workers = min(32, (os.cpu_count() or 1) + 4)
+	
+	if max_workers < 1:
+		return RetVal(BadParameterValue, 'max_workers must be positive')
+	
+	for recipient in recipients:
+		if not isinstance(recipient, (PublicKey, EncryptionPair)):
+			return RetVal(BadParameterType, 'PublicKey or EncryptionPair expected')
+	
+	secretkey = SecretKey()
+	keydata = secretkey.get_key().encode()
+	if max_workers == 1 or len(recipients) < PARALLEL_WRAP_THRESHOLD:
+		results = _wrap_keys(keydata, recipients)
+	else:
+		chunk_size = -(-len(recipients) // max_workers)
+		with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+			results = list()
+			for chunk in executor.map(_wrap_keys, [keydata] * max_workers,
+					[recipients[x:x + chunk_size] for x in range(0, len(recipients), chunk_size)]):
+				results.extend(chunk)
+	
+	keys = dict()
+	for i, (keyhash, status) in enumerate(results):
+		if status.error():
+			return status.set_value('index', i)
+		keys[keyhash] = status['data']
+	
+	return RetVal().set_value('envelope', {
+		'Payload' : secretkey.encrypt(data),
+		'Keys' : keys
+	})
+
+
+@metrics.timed(metrics.CRYPTO_OPERATION)
+def decrypt_envelope(envelope: dict, keypair: EncryptionPair) -> RetVal:
+	'''Decrypts an envelope created by encrypt_envelope() using a recipient's key pair and 
+	returns the data as bytes in the field 'data'. ResourceNotFound is returned if the envelope 
+	wasn't addressed to the key pair.'''
+	if not isinstance(keypair, EncryptionPair):
+		return RetVal(BadParameterType, 'EncryptionPair expected')
+	
+	if not isinstance(envelope, dict) or not isinstance(envelope.get('Payload'), str) \
+			or not isinstance(envelope.get('Keys'), dict):
+		return RetVal(BadData, 'bad envelope')
+	
+	wrapped = envelope['Keys'].get(keypair.get_public_hash())
+	if not wrapped:
+		return RetVal(ResourceNotFound, 'no key for recipient in envelope')
+	
+	status = keypair.decrypt(wrapped)
+	if status.error():
+		return status
+	
+	try:
+		secretkey = SecretKey(CryptoString(status['data']))
+		return RetVal().set_value('data', secretkey.decrypt(envelope['Payload']))
+	except Exception as e:
+		return RetVal(DecryptionFailure, str(e))
+
+
+def _wrap_keys(keydata: bytes, recipients: list) -> list:
+	'''Encrypts key data for a list of recipients, returning a list of (public key hash, RetVal) 
+	tuples'''
+	out = list()
+	for recipient in recipients:
+		if isinstance(recipient, EncryptionPair):
+			keyhash = recipient.get_public_hash()
+		else:
+			keyhash = blake2hash(recipient.public.data.encode())
+		out.append((keyhash, recipient.encrypt(keydata)))
+	return out
+
+
 class VerificationKey (CryptoKey):
 	'''Represents a public encryption key'''
 	def __init__(self, public):
@@ -232,6 +377,7 @@ class VerificationKey (CryptoKey):
 			raise TypeError
 		self.public = public
 
+	@metrics.timed(metrics.CRYPTO)
 	def verify(self, data : bytes, data_signature : CryptoString) -> RetVal:
 		'''Return a Base85-encoded signature for the supplied data in the field 'signature'.'''
 		
@@ -269,10 +415,8 @@ class SigningPair:
 		else:
 			key = nacl.signing.SigningKey.generate()
 			self.enctype = 'ED25519'
-			self.public = CryptoString('ED25519:' + \
-					base64.b85encode(key.verify_key.encode()).decode())
-			self.private = CryptoString('ED25519:' + \
-					base64.b85encode(key.encode()).decode())		
+			self.public = _raw_cryptostring('ED25519', key.verify_key.encode())
+			self.private = _raw_cryptostring('ED25519', key.encode())
 		self.pubhash = blake2hash(self.public.data.encode())
 		self.privhash = blake2hash(self.private.data.encode())
 		
@@ -323,6 +467,7 @@ class SigningPair:
 
 		return RetVal()
 	
+	@metrics.timed(metrics.CRYPTO)
 	def sign(self, data : bytes) -> RetVal:
 		'''Return a Base85-encoded signature for the supplied data in the field 'signature'.'''
 		if not isinstance(data, bytes):
@@ -337,6 +482,7 @@ class SigningPair:
 		
 		return RetVal().set_value('signature', 'ED25519:' + signed.signature.decode())
 	
+	@metrics.timed(metrics.CRYPTO)
 	def verify(self, data : bytes, data_signature : CryptoString) -> RetVal:
 		'''Return a Base85-encoded signature for the supplied data in the field 'signature'.'''
 		
@@ -360,8 +506,8 @@ def signingpair_from_string(keystr : str) -> SigningPair:
 	
 	key = nacl.signing.SigningKey(base64.b85decode(keystr))
 	return SigningPair(
-		CryptoString('ED25519:' + base64.b85encode(key.verify_key.encode()).decode()),
-		CryptoString('ED25519:' + base64.b85encode(key.encode()).decode())	
+		_raw_cryptostring('ED25519', key.verify_key.encode()),
+		_raw_cryptostring('ED25519', key.encode())
 	)
 
 
@@ -385,7 +531,7 @@ def load_signingpair(path: str) -> RetVal:
 		return RetVal(BadData, 'File does not contain an Anselus JSON signing pair')
 
 	try:
-		jsonschema.validate(indata, __signing_pair_schema)
+		validate_schema(indata, __signing_pair_schema)
 	except jsonschema.ValidationError:
 		return RetVal(BadData, "file data does not validate")
 	except jsonschema.SchemaError:
@@ -409,14 +555,21 @@ class SecretKey (CryptoKey):
 			self.key = key
 		else:
 			self.enctype = 'XSALSA20'
-			self.key = CryptoString('XSALSA20:' + \
-					base64.b85encode(nacl.utils.random(nacl.secret.SecretBox.KEY_SIZE)).decode())
+			self.key = _raw_cryptostring('XSALSA20',
+					nacl.utils.random(nacl.secret.SecretBox.KEY_SIZE))
 		
 		self.hash = blake2hash(self.key.data.encode())
+		self.__secretbox = None
 
 	def __str__(self):
 		return self.get_key()
 
+	def __get_secretbox(self) -> nacl.secret.SecretBox:
+		'''Returns the SecretBox for the key, which is created only when the key changes'''
+		if self.__secretbox is None or self.__secretbox[0] != self.key.data:
+			self.__secretbox = (self.key.data, nacl.secret.SecretBox(self.key.raw_data()))
+		return self.__secretbox[1]
+
 	def get_key(self) -> str:
 		'''Returns the key encoded in base85'''
 		return self.key.as_string()
@@ -443,6 +596,7 @@ class SecretKey (CryptoKey):
 
 		return RetVal()
 	
+	@metrics.timed(metrics.CRYPTO)
 	def decrypt(self, encdata : str) -> bytes:
 		'''Decrypts the Base85-encoded encrypted data and returns it as bytes. Returns None on 
 		failure'''
@@ -452,9 +606,10 @@ class SecretKey (CryptoKey):
 		if type(encdata).__name__ != 'str':
 			raise TypeError
 
-		secretbox = nacl.secret.SecretBox(self.key.raw_data())
+		secretbox = self.__get_secretbox()
 		return secretbox.decrypt(encdata, encoder=Base85Encoder)
 	
+	@metrics.timed(metrics.CRYPTO)
 	def encrypt(self, data : bytes) -> str:
 		'''Encrypts the passed data and returns it as a Base85-encoded string. Returns None on 
 		failure'''
@@ -464,10 +619,160 @@ class SecretKey (CryptoKey):
 		if type(data).__name__ != 'bytes':
 			raise TypeError
 		
-		secretbox = nacl.secret.SecretBox(self.key.raw_data())
+		secretbox = self.__get_secretbox()
 		mynonce = nacl.utils.random(nacl.secret.SecretBox.NONCE_SIZE)
 		return secretbox.encrypt(data,nonce=mynonce, encoder=Base85Encoder).decode()
+	
+	def iter_encrypt(self, instream, chunk_size=STREAM_CHUNK_SIZE):
+		'''Generator which encrypts a file-like object or an iterable of bytes objects in chunks of
+		chunk_size bytes and yields the encrypted stream in pieces, so memory use stays the same 
+		no matter how large the data is. The output is raw binary, not Base85.
+		
+		Each chunk is authenticated separately and its nonce is made from a random per-stream 
+		prefix, the chunk's position, and a flag marking the final chunk, so chunks which are 
+		reordered, dropped, or truncated fail to decrypt.'''
+		if chunk_size < 1 or chunk_size > STREAM_MAX_CHUNK_SIZE:
+			raise ValueError('bad chunk size')
+		
+		secretbox = self.__get_secretbox()
+		prefix = nacl.utils.random(STREAM_NONCE_PREFIX_SIZE)
+		yield STREAM_MAGIC + struct.pack('>BI', STREAM_VERSION, chunk_size) + prefix
+
+		counter = 0
+		chunks = _read_chunks(instream, chunk_size)
+		chunk = next(chunks, b'')
+		while True:
+			next_chunk = next(chunks, None)
+			final = int(next_chunk is None)
+			encrypted = secretbox.encrypt(chunk, _stream_nonce(prefix, counter, final)).ciphertext
+			yield struct.pack('>BI', final, len(encrypted)) + encrypted
+
+			if final:
+				break
+			chunk = next_chunk
+			counter = counter + 1
+
+	def iter_decrypt(self, instream):
+		'''Generator which decrypts a stream created by iter_encrypt(), reading from a file-like 
+		object or an iterable of bytes objects and yielding the plaintext one chunk at a time. 
+		nacl.exceptions.CryptoError is raised if any chunk fails authentication and ValueError is 
+		raised if the stream is malformed or truncated.'''
+		secretbox = self.__get_secretbox()
+		reader = _ExactReader(instream)
+
+		header = reader.read(len(STREAM_MAGIC) + 5 + STREAM_NONCE_PREFIX_SIZE)
+		if header[:len(STREAM_MAGIC)] != STREAM_MAGIC or len(header) != \
+				len(STREAM_MAGIC) + 5 + STREAM_NONCE_PREFIX_SIZE:
+			raise ValueError('not an encrypted stream')
+		
+		version, chunk_size = struct.unpack('>BI', header[len(STREAM_MAGIC):len(STREAM_MAGIC) + 5])
+		if version != STREAM_VERSION or chunk_size < 1 or chunk_size > STREAM_MAX_CHUNK_SIZE:
+			raise ValueError('unsupported stream format')
+		prefix = header[len(STREAM_MAGIC) + 5:]
 		
+		counter = 0
+		while True:
+			chunk_header = reader.read(5)
+			if len(chunk_header) != 5:
+				raise ValueError('encrypted stream is truncated')
+			
+			final, size = struct.unpack('>BI', chunk_header)
+			if final > 1 or size > chunk_size + nacl.secret.SecretBox.MACBYTES:
+				raise ValueError('bad chunk header')
+			
+			encrypted = reader.read(size)
+			if len(encrypted) != size:
+				raise ValueError('encrypted stream is truncated')
+			
+			yield secretbox.decrypt(encrypted, _stream_nonce(prefix, counter, final))
+			
+			if final:
+				break
+			counter = counter + 1
+		
+		if reader.read(1):
+			raise ValueError('unexpected data after end of encrypted stream')
+
+	@metrics.timed(metrics.CRYPTO)
+	def encrypt_stream(self, instream, outstream, chunk_size=STREAM_CHUNK_SIZE) -> RetVal:
+		'''Encrypts everything from instream, a file-like object or an iterable of bytes objects, 
+		and writes the encrypted stream to the file-like object outstream. The number of bytes 
+		written is returned in the field 'size'.'''
+		size = 0
+		try:
+			for data in self.iter_encrypt(instream, chunk_size):
+				outstream.write(data)
+				size = size + len(data)
+		except ValueError as e:
+			return RetVal(BadParameterValue, str(e))
+		except Exception as e:
+			return RetVal(ExceptionThrown, str(e))
+		
+		return RetVal().set_value('size', size)
+
+	@metrics.timed(metrics.CRYPTO)
+	def decrypt_stream(self, instream, outstream) -> RetVal:
+		'''Decrypts a stream created by encrypt_stream() or iter_encrypt() and writes the plaintext 
+		to the file-like object outstream. The number of bytes written is returned in the field 
+		'size'. Note that if decryption fails partway through, the data already written to 
+		outstream must be discarded.'''
+		size = 0
+		try:
+			for data in self.iter_decrypt(instream):
+				outstream.write(data)
+				size = size + len(data)
+		except (ValueError, nacl.exceptions.CryptoError) as e:
+			return RetVal(DecryptionFailure, str(e))
+		except Exception as e:
+			return RetVal(ExceptionThrown, str(e))
+		
+		return RetVal().set_value('size', size)
+		
+
+def _stream_nonce(prefix: bytes, counter: int, final: int) -> bytes:
+	'''Builds the nonce for a chunk of an encrypted stream'''
+	return prefix + counter.to_bytes(7, 'big') + bytes([final])
+
+
+def _read_chunks(instream, chunk_size: int):
+	'''Generator which yields data from a file-like object or an iterable of bytes objects in 
+	pieces of chunk_size bytes. Only the last one may be shorter.'''
+	reader = _ExactReader(instream)
+	while True:
+		chunk = reader.read(chunk_size)
+		if not chunk:
+			return
+		yield chunk
+		if len(chunk) < chunk_size:
+			return
+
+
+class _ExactReader:
+	'''Reads exact amounts of data from a file-like object or an iterable of bytes objects'''
+	def __init__(self, instream):
+		if hasattr(instream, 'read'):
+			self.__read = instream.read
+			self.__iterator = None
+		else:
+			self.__read = None
+			self.__iterator = iter(instream)
+		self.__buffer = bytearray()
+
+	def read(self, size: int) -> bytes:
+		'''Returns size bytes unless the end of the stream is reached first'''
+		while len(self.__buffer) < size:
+			if self.__read:
+				data = self.__read(size - len(self.__buffer))
+			else:
+				data = next(self.__iterator, b'')
+			if not data:
+				break
+			self.__buffer.extend(data)
+		
+		out = bytes(self.__buffer[:size])
+		del self.__buffer[:size]
+		return out
+
 
 def load_secretkey(path: str) -> RetVal:
 	'''Instantiates a secret key from a file'''
@@ -489,7 +794,7 @@ def load_secretkey(path: str) -> RetVal:
 		return RetVal(BadData, 'File does not contain an Anselus JSON secret key')
 
 	try:
-		jsonschema.validate(indata, __secret_key_schema)
+		validate_schema(indata, __secret_key_schema)
 	except jsonschema.ValidationError:
 		return RetVal(BadData, "file data does not validate")
 	except jsonschema.SchemaError:
@@ -523,6 +828,14 @@ class FolderMapping:
 		self.permissions = permissions
 
 
+def _raw_cryptostring(prefix: str, data: bytes) -> CryptoString:
+	'''Returns a CryptoString for newly generated key bytes, which keeps the bytes so that using 
+	the key doesn't require decoding it'''
+	out = CryptoString()
+	out.set_raw(prefix, data)
+	return out
+
+
 def check_password_complexity(indata: str) -> RetVal:
 	'''Checks the requested string as meeting the needed security standards.
 	
@@ -564,11 +877,13 @@ def check_password_complexity(indata: str) -> RetVal:
 
 
 class Password:
-	'''Encapsulates hashed password interactions. Uses the Argon2id hashing algorithm.'''
-	def __init__(self, text=''):
+	'''Encapsulates hashed password interactions. Uses the Argon2id hashing algorithm. The cost of 
+	hashing is set by profile, which is one of the keys of PASSWORD_PROFILES.'''
+	def __init__(self, text='', profile='interactive'):
 		self.hashtype = 'argon2id'
 		self.strength = ''
 		self.hashstring = ''
+		self.opslimit, self.memlimit = PASSWORD_PROFILES[profile]
 		if text:
 			self.Set(text)
 
@@ -582,7 +897,7 @@ class Password:
 		if status.error():
 			return status
 		self.strength = status['strength']
-		self.hashstring = nacl.pwhash.argon2id.str(text.encode()).decode('ascii')
+		self.hashstring = _hash_password(text, self.opslimit, self.memlimit)
 		
 		return status
 	
@@ -599,7 +914,87 @@ class Password:
 		'''
 		Checks the supplied password against the stored hash.
 		'''
-		return nacl.pwhash.verify(self.hashstring.encode(), text.encode())
+		return _check_password(self.hashstring, text)
+
+
+class PasswordHasher:
+	'''Runs Argon2id password hashing on a pool of worker threads or processes so that callers 
+	don't block on it and concurrent hashing can use all of the machine's cores. Threads are 
+	used by default because PyNaCl releases the GIL while hashing. Process workers are available 
+	for callers whose own threads hold the GIL a lot.'''
+	def __init__(self, max_workers=None, use_processes=False):
+		if use_processes:
+			self.executor = concurrent.futures.ProcessPoolExecutor(max_workers)
+		else:
+			self.executor = concurrent.futures.ThreadPoolExecutor(max_workers,
+				thread_name_prefix='PasswordHasher')
+
+	def set(self, pw: Password, text: str) -> concurrent.futures.Future:
+		'''Does the same work as Password.Set() in the background. The returned future resolves 
+		to the RetVal that Set() would return, after pw has been updated.'''
+		out = concurrent.futures.Future()
+		status = check_password_complexity(text)
+		if status.error():
+			out.set_result(status)
+			return out
+		
+		def finish(job: concurrent.futures.Future):
+			try:
+				pw.hashstring = job.result()
+			except Exception as e:
+				out.set_result(RetVal(ExceptionThrown, str(e)))
+				return
+			pw.strength = status['strength']
+			out.set_result(status)
+		
+		self.executor.submit(_hash_password, text, pw.opslimit, pw.memlimit) \
+			.add_done_callback(finish)
+		return out
+
+	def check(self, pw: Password, text: str) -> concurrent.futures.Future:
+		'''Does the same work as Password.Check() in the background. The returned future 
+		resolves to a bool.'''
+		return self.executor.submit(_check_password, pw.hashstring, text)
+
+	async def set_async(self, pw: Password, text: str) -> RetVal:
+		'''asyncio version of set()'''
+		return await asyncio.wrap_future(self.set(pw, text))
+
+	async def check_async(self, pw: Password, text: str) -> bool:
+		'''asyncio version of check()'''
+		return await asyncio.wrap_future(self.check(pw, text))
+
+	def shutdown(self, wait=True):
+		'''Stops the worker pool'''
+		self.executor.shutdown(wait)
+
+
+__default_hasher = None
+__default_hasher_lock = threading.Lock()
+
+def get_password_hasher() -> PasswordHasher:
+	'''Returns the PasswordHasher shared by the library, creating it on first use'''
+	global __default_hasher # pylint: disable=global-statement
+	with __default_hasher_lock:
+		if __default_hasher is None:
+			__default_hasher = PasswordHasher()
+		return __default_hasher
+
+
+@metrics.timed(metrics.CRYPTO, 'hash_password')
+def _hash_password(text: str, opslimit: int, memlimit: int) -> str:
+	'''Returns the Argon2id hash string for a password'''
+	return nacl.pwhash.argon2id.str(text.encode(), opslimit=opslimit, memlimit=memlimit) \
+		.decode('ascii')
+
+
+@metrics.timed(metrics.CRYPTO, 'check_password')
+def _check_password(hashstring: str, text: str) -> bool:
+	'''Checks a password against an Argon2id hash string'''
+	try:
+		return nacl.pwhash.verify(hashstring.encode(), text.encode())
+	except nacl.exceptions.InvalidkeyError:
+		return False
 
 
 class Base85Encoder:
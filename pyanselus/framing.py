@@ -0,0 +1,153 @@
+'''This module contains FrameBuffer, which turns the stream of bytes received from an Anselus
+server into individual messages. Messages are normally terminated with a CRLF, but a complete JSON
+document which has not (yet) been terminated is also accepted as a message so that servers which
+omit the terminator on the last message are still understood.'''
+
+import json
+import socket
+import struct
+
+from pyanselus.retval import RetVal, ExceptionThrown, NetworkError
+
+MessageTooLarge = 'MessageTooLarge'
+
+# Delimiter used between messages
+FRAME_DELIMITER = b'\r\n'
+
+# Size (in bytes) of the length field in front of each message in LengthPrefixedBuffer streams
+LENGTH_PREFIX_SIZE = 4
+
+# Size (in bytes) of the read buffer size for recv()
+READ_BUFFER_SIZE = 65536
+
+# Largest message (in bytes) which will be accepted from the other side before giving up. Large
+# keycards and bulk responses can easily run past the old 8K limit, so this is generous.
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+class FrameBuffer:
+	'''Accumulates data received from a socket and splits it into individual messages'''
+	def __init__(self, max_frame_size=MAX_FRAME_SIZE):
+		if max_frame_size < 1:
+			raise ValueError('max_frame_size must be positive')
+
+		self.buffer = bytearray()
+		self.max_frame_size = max_frame_size
+
+		# Total number of bytes read from sockets by read_frame()
+		self.bytes_received = 0
+
+		# Offset into the buffer which has already been searched for a delimiter. This keeps
+		# searches of large, slowly-arriving messages from being quadratic.
+		self.__scan_offset = 0
+		self.__decoder = json.JSONDecoder()
+
+	def __len__(self):
+		return len(self.buffer)
+
+	def clear(self):
+		'''Empties the buffer, discarding any partial messages'''
+		self.buffer = bytearray()
+		self.__scan_offset = 0
+
+	def feed(self, data: bytes) -> RetVal:
+		'''Appends received data to the buffer'''
+		self.buffer.extend(data)
+		return RetVal()
+
+	def next_frame(self) -> RetVal:
+		'''Removes the next complete message from the buffer. The message is returned in the field
+		'frame' as bytes without the delimiter. If no complete message is available, the field
+		will be None.'''
+		while True:
+			index = self.buffer.find(FRAME_DELIMITER, self.__scan_offset)
+			if index < 0:
+				break
+
+			frame = bytes(self.buffer[:index])
+			del self.buffer[:index + len(FRAME_DELIMITER)]
+			self.__scan_offset = 0
+
+			# Blank lines between messages are ignored
+			if not frame.strip():
+				continue
+
+			if len(frame) > self.max_frame_size:
+				return RetVal(MessageTooLarge, f'message is larger than {self.max_frame_size}')
+			return RetVal().set_value('frame', frame)
+
+		# The delimiter may be split across two reads, so the last byte must be searched again
+		self.__scan_offset = max(len(self.buffer) - len(FRAME_DELIMITER) + 1, 0)
+
+		if len(self.buffer) > self.max_frame_size:
+			return RetVal(MessageTooLarge, f'message is larger than {self.max_frame_size}')
+
+		# No delimiter. Accept the data anyway if it is a complete JSON document.
+		frame = self.__undelimited_frame()
+		return RetVal().set_value('frame', frame)
+
+	def __undelimited_frame(self) -> bytes:
+		'''Returns the leading JSON document in the buffer if there is a complete one and
+		removes it from the buffer. Returns None if there isn't.'''
+		stripped = self.buffer.lstrip()
+		if not stripped or stripped[:1] not in (b'{', b'['):
+			return None
+
+		# Don't bother parsing until the data could possibly be a complete document. Without
+		# this, a large message arriving in pieces would be reparsed after every read.
+		if stripped.rstrip()[-1:] not in (b'}', b']'):
+			return None
+
+		try:
+			text = stripped.decode()
+			_, end = self.__decoder.raw_decode(text)
+		except (UnicodeDecodeError, ValueError):
+			return None
+
+		frame = text[:end].encode()
+		del self.buffer[:len(self.buffer) - len(stripped) + len(frame)]
+		self.__scan_offset = 0
+		return frame
+
+	def read_frame(self, sock: socket.socket) -> RetVal:
+		'''Returns the next message from the socket in the field 'frame', reading from the socket
+		only as much as is needed to complete it.'''
+		if sock is None:
+			return RetVal(NetworkError, 'not connected')
+
+		while True:
+			status = self.next_frame()
+			if status.error() or status['frame'] is not None:
+				return status
+
+			try:
+				rawdata = sock.recv(READ_BUFFER_SIZE)
+			except Exception as e:
+				return RetVal(ExceptionThrown, e)
+
+			if not rawdata:
+				return RetVal(NetworkError, 'connection closed by peer')
+			self.bytes_received = self.bytes_received + len(rawdata)
+			self.feed(rawdata)
+
+
+
+class LengthPrefixedBuffer(FrameBuffer):
+	'''FrameBuffer for binary streams, where each message is preceded by its size as a 4-byte
+	big-endian integer instead of being terminated by a CRLF, which may appear in binary data'''
+	def next_frame(self) -> RetVal:
+		'''Removes the next complete message from the buffer. The message is returned in the field
+		'frame' as bytes without the length. If no complete message is available, the field
+		will be None.'''
+		if len(self.buffer) < LENGTH_PREFIX_SIZE:
+			return RetVal().set_value('frame', None)
+
+		size = struct.unpack('>I', self.buffer[:LENGTH_PREFIX_SIZE])[0]
+		if size > self.max_frame_size:
+			return RetVal(MessageTooLarge, f'message is larger than {self.max_frame_size}')
+
+		if len(self.buffer) < LENGTH_PREFIX_SIZE + size:
+			return RetVal().set_value('frame', None)
+
+		frame = bytes(self.buffer[LENGTH_PREFIX_SIZE:LENGTH_PREFIX_SIZE + size])
+		del self.buffer[:LENGTH_PREFIX_SIZE + size]
+		return RetVal().set_value('frame', frame)
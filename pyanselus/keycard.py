@@ -1,11 +1,13 @@
 '''This module contains the classes representing the entry blocks which are chained together in a 
 keycard.'''
 
-import base64
+import concurrent.futures
 import datetime
 import hashlib
+import json
 import os
 import re
+import sys
 import time
 
 # Temporarily disabled while building blake3 module on Windows is sorted out
@@ -16,6 +18,7 @@ import nacl.signing
 from pyanselus.cryptostring import CryptoString
 from pyanselus.encryption import EncryptionPair, SigningPair, Base85Encoder
 from pyanselus.hash import blake2hash
+import pyanselus.metrics as metrics
 from pyanselus.retval import RetVal, BadData, BadParameterValue, ExceptionThrown, ResourceExists, \
 		ResourceNotFound
 
@@ -37,6 +40,10 @@ SignatureMissing = 'SignatureMissing'
 SIGINFO_HASH = 1
 SIGINFO_SIGNATURE = 2
 
+# Batches of signatures smaller than this are checked serially because the thread pool costs more
+# than it saves
+PARALLEL_VERIFY_THRESHOLD = 16
+
 class ComplianceException(Exception):
 	'''Custom exception for spec compliance failures'''
 
@@ -62,18 +69,144 @@ def _is_valid_date(m : int, d : int, y : int, hours=-1, minutes=-1, seconds=-1)
 	return True
 
 
+class _WatchedDict(dict):
+	'''A dictionary which calls a function whenever its contents are changed'''
+	__slots__ = ('_on_change',)
+
+	def __init__(self, on_change, *args, **kwargs):
+		super().__init__(*args, **kwargs)
+		self._on_change = on_change
+
+	def __setitem__(self, key, value):
+		super().__setitem__(key, value)
+		self._on_change()
+
+	def __delitem__(self, key):
+		super().__delitem__(key)
+		self._on_change()
+
+	def clear(self):
+		super().clear()
+		self._on_change()
+
+	def pop(self, *args):
+		out = super().pop(*args)
+		self._on_change()
+		return out
+
+	def popitem(self):
+		out = super().popitem()
+		self._on_change()
+		return out
+
+	def setdefault(self, key, default=None):
+		out = super().setdefault(key, default)
+		self._on_change()
+		return out
+
+	def update(self, *args, **kwargs):
+		super().update(*args, **kwargs)
+		self._on_change()
+
+
 class EntryBase:
 	'''Base class for all code common to org and user cards'''
+
+	# Keycard caches can hold a great many entries, so entries have no __dict__. The field names, 
+	# required fields, and signature info are the same for every entry of a type, so subclasses 
+	# point them at tuples defined on the class instead of building new lists for each entry.
+	__slots__ = ('_bytestrings', '_fields', '_signatures', '_type', '_prev_hash', '_hash',
+		'_field_names', 'required_fields', '_signature_info')
+
 	def __init__(self):
+		# Serialized forms of the entry from make_bytestring(), keyed by signature level. Assigning 
+		# to any of the properties used by make_bytestring() or changing the entry's fields or 
+		# signatures empties it.
+		self._bytestrings = dict()
+
 		self.fields = dict()
-		self.field_names = list()
-		self.required_fields = list()
+		self.field_names = ()
+		self.required_fields = ()
 		self.type = ''
 		self.signatures = dict()
-		self.signature_info = list()
+		self.signature_info = ()
 		self.prev_hash = ''
 		self.hash = ''
 	
+	def _invalidate(self):
+		'''Discards cached serializations of the entry'''
+		self._bytestrings.clear()
+
+	@property
+	def fields(self) -> dict:
+		'''The entry's data fields'''
+		return self._fields
+
+	@fields.setter
+	def fields(self, value: dict):
+		self._fields = _WatchedDict(self._invalidate, value)
+		self._invalidate()
+
+	@property
+	def field_names(self):
+		'''The names of the fields included in the entry's byte string, in order'''
+		return self._field_names
+
+	@field_names.setter
+	def field_names(self, value):
+		self._field_names = value
+		self._invalidate()
+
+	@property
+	def signature_info(self):
+		'''Descriptions of the entry's signatures and hashes, in signing order'''
+		return self._signature_info
+
+	@signature_info.setter
+	def signature_info(self, value):
+		self._signature_info = value
+		self._invalidate()
+
+	@property
+	def signatures(self) -> dict:
+		'''The entry's signatures, keyed by signature type'''
+		return self._signatures
+
+	@signatures.setter
+	def signatures(self, value: dict):
+		self._signatures = _WatchedDict(self._invalidate, value)
+		self._invalidate()
+
+	@property
+	def type(self) -> str:
+		'''The entry type, such as User or Organization'''
+		return self._type
+
+	@type.setter
+	def type(self, value: str):
+		self._type = value
+		self._invalidate()
+
+	@property
+	def prev_hash(self) -> str:
+		'''The hash of the previous entry in the keycard'''
+		return self._prev_hash
+
+	@prev_hash.setter
+	def prev_hash(self, value: str):
+		self._prev_hash = value
+		self._invalidate()
+
+	@property
+	def hash(self) -> str:
+		'''The hash of the entry'''
+		return self._hash
+
+	@hash.setter
+	def hash(self, value: str):
+		self._hash = value
+		self._invalidate()
+	
 	def __contains__(self, key):
 		return key in self.fields
 
@@ -263,9 +396,7 @@ class EntryBase:
 		else:
 			hasher = hashlib.sha3_256()
 		hasher.update(self.make_bytestring(hash_level))
-		hash_string.data = base64.b85encode(hasher.digest()).decode()
-		
-		hash_string.prefix = algorithm
+		hash_string.set_raw(algorithm, hasher.digest())
 		return RetVal().set_value('hash', str(hash_string))
 	
 	def is_data_compliant(self) -> RetVal:
@@ -346,7 +477,7 @@ class EntryBase:
 		expire_time = datetime.datetime(int(m[1]), int(m[2]), int(m[3]),
 			tzinfo=datetime.timezone(datetime.timedelta(hours=0)))
 
-		if datetime.datetime.now() > expire_time:
+		if datetime.datetime.now(datetime.timezone.utc) > expire_time:
 			return RetVal(BadData, 'entry is expired')
 
 		return RetVal()
@@ -375,7 +506,15 @@ class EntryBase:
 		'''Creates a byte string from the fields in the keycard. Because this doesn't use join(), 
 		it is not affected by Python's line ending handling, which is critical in ensuring that 
 		signatures are not invalidated. The parameter, signature_level, specifies how many 
-		signatures to include. Passing a negative number specifies all signatures.'''
+		signatures to include. Passing a negative number specifies all signatures. The result is 
+		cached until the entry is changed.'''
+		if signature_level > len(self.signature_info) or signature_level < 0:
+			signature_level = self.signature_info[-1]['level']
+		
+		cached = self._bytestrings.get(signature_level)
+		if cached is not None:
+			return cached
+		
 		lines = list()
 		if self.type:
 			lines.append(b':'.join([b'Type', self.type.encode()]))
@@ -384,9 +523,6 @@ class EntryBase:
 			if field in self.fields and self.fields[field]:
 				lines.append(b':'.join([field.encode(), self.fields[field].encode()]))
 		
-		if signature_level > len(self.signature_info) or signature_level < 0:
-			signature_level = self.signature_info[-1]['level']
-		
 		sig_names = [x['name'] for x in self.signature_info]
 		for i in range(signature_level):
 			name = sig_names[i]
@@ -400,7 +536,9 @@ class EntryBase:
 								self.signatures[name].encode()]))
 
 		lines.append(b'')
-		return b'\r\n'.join(lines)
+		out = b'\r\n'.join(lines)
+		self._bytestrings[signature_level] = out
+		return out
 	
 	def save(self, path : str, clobber = False) -> RetVal:
 		'''Saves to the specified path, forcing CRLF line endings to prevent any weird behavior 
@@ -478,6 +616,12 @@ class EntryBase:
 					return RetVal(BadData, 'bad signature line %s' % sigparts[0])
 				self.signatures[sigparts[0]] = parts[1]
 			
+			elif parts[0] == 'Hash':
+				self.hash = parts[1]
+			
+			elif parts[0] == 'Previous-Hash':
+				self.prev_hash = parts[1]
+			
 			else:
 				self.fields[parts[0]] = parts[1]
 			
@@ -501,6 +645,7 @@ class EntryBase:
 		self.fields['Expires'] = expiration.strftime("%Y%m%d")
 		return RetVal()
 
+	@metrics.timed(metrics.CRYPTO)
 	def sign(self, signing_key: CryptoString, sigtype: str) -> RetVal:
 		'''Adds a signature to the  Note that for any change in the keycard fields, this 
 		call must be made afterward. Note that successive signatures are deleted, such that 
@@ -538,6 +683,7 @@ class EntryBase:
 		self.signatures[sigtype] = 'ED25519:' + signed.signature.decode()
 		return RetVal()
 
+	@metrics.timed(metrics.CRYPTO)
 	def generate_hash(self, algorithm: str) -> RetVal:
 		'''Populates the hash attribute based on the data in the entry. For supported algorithms,
 		see EntryBase.get_hash()'''  
@@ -548,6 +694,7 @@ class EntryBase:
 		self.hash = status['hash']
 		return status
 
+	@metrics.timed(metrics.CRYPTO)
 	def verify_hash(self) -> RetVal:
 		'''Checks that the entry's actual hash matches that in the hash field'''
 		current_hash = CryptoString(self.hash)
@@ -561,9 +708,25 @@ class EntryBase:
 		return RetVal()
 
 
+	@metrics.timed(metrics.CRYPTO)
 	def verify_signature(self, verify_key: CryptoString, sigtype: str) -> RetVal:
 		'''Verifies a signature, given a verification key'''
 	
+		status = self.get_signature_data(verify_key, sigtype)
+		if status.error():
+			return status
+
+		if not _check_signature((status['key'], status['data'], status['signature'])):
+			return RetVal(InvalidKeycard)
+		
+		return RetVal()
+
+	def get_signature_data(self, verify_key: CryptoString, sigtype: str) -> RetVal:
+		'''Performs all the checks of verify_signature() except the cryptographic one. The raw
+		verification key, the signed data, and the raw signature are returned in the fields 'key', 
+		'data', and 'signature' so that the signature can be checked later, such as in a batch 
+		with verify_signatures().'''
+	
 		if not verify_key.is_valid():
 			return RetVal(BadParameterValue, 'bad verify key')
 		
@@ -583,54 +746,58 @@ class EntryBase:
 			return status
 
 		try:
-			vkey = nacl.signing.VerifyKey(verify_key.raw_data())
+			key = verify_key.raw_data()
+			nacl.signing.VerifyKey(key)
 		except Exception as e:
 			return RetVal(ExceptionThrown, e)
 
-		try:
-			data = self.make_bytestring(sig_names.index(sigtype))
-			vkey.verify(data, sig.raw_data())
-		except nacl.exceptions.BadSignatureError:
-			return RetVal(InvalidKeycard)
-		
-		return RetVal()
+		return RetVal().set_values({
+			'key' : key,
+			'data' : self.make_bytestring(sig_names.index(sigtype)),
+			'signature' : sig.raw_data()
+		})
 
 
 class OrgEntry(EntryBase):
 	'''Class for managing organization keycard entries'''
+	__slots__ = ()
+
+	FIELD_NAMES = (
+		'Index',
+		'Name',
+		'Contact-Admin',
+		'Contact-Abuse',
+		'Contact-Support',
+		'Language',
+		'Primary-Verification-Key',
+		'Secondary-Verification-Key',
+		'Encryption-Key',
+		'Time-To-Live',
+		'Expires',
+		'Timestamp'
+	)
+	REQUIRED_FIELDS = (
+		'Index',
+		'Name',
+		'Contact-Admin',
+		'Primary-Verification-Key',
+		'Encryption-Key',
+		'Time-To-Live',
+		'Expires',
+		'Timestamp'
+	)
+	SIGNATURE_INFO = (
+		{ 'name' : 'Custody', 'level' : 1, 'optional' : True, 'type' : SIGINFO_SIGNATURE },
+		{ 'name' : 'Hashes', 'level' : 3, 'optional' : False, 'type' : SIGINFO_HASH },
+		{ 'name' : 'Organization', 'level' : 2, 'optional' : False, 'type' : SIGINFO_SIGNATURE }
+	)
 	
 	def __init__(self):
 		super().__init__()
 		self.type = 'Organization'
-		self.field_names = [
-			'Index',
-			'Name',
-			'Contact-Admin',
-			'Contact-Abuse',
-			'Contact-Support',
-			'Language',
-			'Primary-Verification-Key',
-			'Secondary-Verification-Key',
-			'Encryption-Key',
-			'Time-To-Live',
-			'Expires',
-			'Timestamp'
-		]
-		self.required_fields = [
-			'Index',
-			'Name',
-			'Contact-Admin',
-			'Primary-Verification-Key',
-			'Encryption-Key',
-			'Time-To-Live',
-			'Expires',
-			'Timestamp'
-		]
-		self.signature_info = [ 
-			{ 'name' : 'Custody', 'level' : 1, 'optional' : True, 'type' : SIGINFO_SIGNATURE },
-			{ 'name' : 'Hashes', 'level' : 3, 'optional' : False, 'type' : SIGINFO_HASH },
-			{ 'name' : 'Organization', 'level' : 2, 'optional' : False, 'type' : SIGINFO_SIGNATURE }
-		]
+		self.field_names = OrgEntry.FIELD_NAMES
+		self.required_fields = OrgEntry.REQUIRED_FIELDS
+		self.signature_info = OrgEntry.SIGNATURE_INFO
 		
 		self.fields['Index'] = '1'
 		self.fields['Time-To-Live'] = '30'
@@ -704,6 +871,11 @@ class OrgEntry(EntryBase):
 	
 	def verify_chain(self, previous: EntryBase) -> RetVal:
 		'''Verifies the chain of custody between the provided previous entry and the current one.'''
+		return _verify_chain_data(self.get_chain_data(previous))
+
+	def get_chain_data(self, previous: EntryBase) -> RetVal:
+		'''Performs the checks of verify_chain() except for the custody signature itself, which is 
+		returned in the same format as EntryBase.get_signature_data().'''
 
 		if previous.type != 'Organization':
 			return RetVal(BadParameterValue, 'entry type mismatch')
@@ -728,47 +900,52 @@ class OrgEntry(EntryBase):
 		if index != prev_index + 1:
 			return RetVal(InvalidKeycard, 'entry index compliance failure')
 
-		status = self.verify_signature(CryptoString(previous.fields['Primary-Verification-Key']),
-				'Custody')
-		return status
+		return self.get_signature_data(
+				CryptoString(previous.fields['Primary-Verification-Key']), 'Custody')
 
 
 class UserEntry(EntryBase):
 	'''Represents a user keycard entry'''
+	__slots__ = ()
+
+	FIELD_NAMES = (
+		'Index',
+		'Name',
+		'Workspace-ID',
+		'User-ID',
+		'Domain',
+		'Contact-Request-Verification-Key',
+		'Contact-Request-Encryption-Key',
+		'Public-Encryption-Key',
+		'Alternate-Encryption-Key',
+		'Time-To-Live',
+		'Expires',
+		'Timestamp'
+	)
+	REQUIRED_FIELDS = (
+		'Index',
+		'Workspace-ID',
+		'Domain',
+		'Contact-Request-Verification-Key',
+		'Contact-Request-Encryption-Key',
+		'Public-Encryption-Key',
+		'Time-To-Live',
+		'Expires',
+		'Timestamp'
+	)
+	SIGNATURE_INFO = (
+		{ 'name' : 'Custody', 'level' : 1, 'optional' : True, 'type' : SIGINFO_SIGNATURE },
+		{ 'name' : 'Organization', 'level' : 2, 'optional' : False, 'type' : SIGINFO_SIGNATURE },
+		{ 'name' : 'Hashes', 'level' : 3, 'optional' : False, 'type' : SIGINFO_HASH },
+		{ 'name' : 'User', 'level' : 4, 'optional' : False, 'type' : SIGINFO_SIGNATURE }
+	)
+
 	def __init__(self):
 		super().__init__()
 		self.type = 'User'
-		self.field_names = [
-			'Index',
-			'Name',
-			'Workspace-ID',
-			'User-ID',
-			'Domain',
-			'Contact-Request-Verification-Key',
-			'Contact-Request-Encryption-Key',
-			'Public-Encryption-Key',
-			'Alternate-Encryption-Key',
-			'Time-To-Live',
-			'Expires',
-			'Timestamp'
-		]
-		self.required_fields = [
-			'Index',
-			'Workspace-ID',
-			'Domain',
-			'Contact-Request-Verification-Key',
-			'Contact-Request-Encryption-Key',
-			'Public-Encryption-Key',
-			'Time-To-Live',
-			'Expires',
-			'Timestamp'
-		]
-		self.signature_info = [ 
-			{ 'name' : 'Custody', 'level' : 1, 'optional' : True, 'type' : SIGINFO_SIGNATURE },
-			{ 'name' : 'Organization', 'level' : 2, 'optional' : False, 'type' : SIGINFO_SIGNATURE },
-			{ 'name' : 'Hashes', 'level' : 3, 'optional' : False, 'type' : SIGINFO_HASH },
-			{ 'name' : 'User', 'level' : 4, 'optional' : False, 'type' : SIGINFO_SIGNATURE }
-		]
+		self.field_names = UserEntry.FIELD_NAMES
+		self.required_fields = UserEntry.REQUIRED_FIELDS
+		self.signature_info = UserEntry.SIGNATURE_INFO
 		
 		self.fields['Index'] = '1'
 		self.fields['Time-To-Live'] = '7'
@@ -848,6 +1025,11 @@ class UserEntry(EntryBase):
 		
 	def verify_chain(self, previous: EntryBase) -> RetVal:
 		'''Verifies the chain of custody between the provided previous entry and the current one.'''
+		return _verify_chain_data(self.get_chain_data(previous))
+
+	def get_chain_data(self, previous: EntryBase) -> RetVal:
+		'''Performs the checks of verify_chain() except for the custody signature itself, which is 
+		returned in the same format as EntryBase.get_signature_data().'''
 
 		if previous.type != 'User':
 			return RetVal(BadParameterValue, 'entry type mismatch')
@@ -859,9 +1041,8 @@ class UserEntry(EntryBase):
 				not previous.fields['Contact-Request-Verification-Key']:
 			return RetVal(ResourceNotFound, 'signing key missing')
 		
-		status = self.verify_signature(CryptoString(previous.fields['Contact-Request-Verification-Key']),
-				'Custody')
-		return status
+		return self.get_signature_data(
+				CryptoString(previous.fields['Contact-Request-Verification-Key']), 'Custody')
 
 
 class Keycard:
@@ -869,6 +1050,11 @@ class Keycard:
 	def __init__(self, cardtype = ''):
 		self.type = cardtype
 		self.entries = list()
+
+		# The verified-prefix checkpoint. When set, it is a dictionary containing the list index of 
+		# the last entry known to have been verified, 'Index', and the hash of that entry's full 
+		# text, 'Hash'. verify() skips the entries up to and including the checkpointed one.
+		self.checkpoint = None
 	
 	def chain(self, key: CryptoString, rotate_optional: bool) -> RetVal:
 		'''Appends a new entry to the chain, optionally rotating keys which aren't required to be 
@@ -912,68 +1098,82 @@ class Keycard:
 		if not os.path.exists(path):
 			return RetVal(ResourceNotFound)
 		
-		# Although we care very much about saving keycards with the Windows-style line endings,
-		# we actually want the line endings to get stripped on load because the fields aren't
-		# stored with line endings
 		try:
-			with open(path, 'r') as f:
-				card_type = ''
-				accumulator = list()
-				line_index = 1
-				entry_index = 1
-				rawline = f.readline()
-
-				while rawline:
-					line = rawline.strip()
-					if not line:
-						line_index = line_index + 1
-						continue
-					
-					if line == '----- BEGIN ENTRY -----':
-						accumulator.clear()
-					elif line == '----- END ENTRY -----':
-						
-						entry = None
-						if card_type == 'User':
-							entry = UserEntry()
-						elif card_type == 'Organization':
-							entry = OrgEntry()
-						else:
-							return RetVal(UnsupportedKeycardType,
-									f'entry {entry_index} has invalid type')
-
-						status = entry.set(b'\r\n'.join(accumulator))
-						if status.error():
-							status.info = f'keycard entry {entry_index}: {status.info}'
-							return status
-						self.entries.append(entry)
-						entry_index = entry_index + 1
-					else:
-						parts = line.split(':', 1)
-						if len(parts) != 2:
-							return RetVal(BadData, f'invalid line {line_index}')
-						
-						if parts[0] == 'Type':
-							if card_type:
-								if card_type != parts[1]:
-									return RetVal(BadData, 'entry type does not match keycard')
-							else:
-								card_type = parts[1]
-
-						accumulator.append(line.encode())
-					
-					line_index = line_index + 1
-					rawline = f.readline()
-
-		
+			with open(path, 'rb') as f:
+				data = f.read()
 		except Exception as e:
 			return RetVal(ExceptionThrown, str(e))
 
+		return self.set(data)
 
+	def set(self, data: bytes) -> RetVal:
+		'''Replaces the keycard's entries with those in a bytestring in the format written by 
+		save()'''
+		try:
+			rawstring = data.decode()
+		except Exception as e:
+			return RetVal(ExceptionThrown, e)
+		
+		# Although we care very much about saving keycards with the Windows-style line endings,
+		# we actually want the line endings to get stripped on load because the fields aren't
+		# stored with line endings
+		card_type = ''
+		accumulator = list()
+		entries = list()
+		entry_index = 1
+		for line_index, rawline in enumerate(rawstring.splitlines(), 1):
+			line = rawline.strip()
+			if not line:
+				continue
+			
+			if line == '----- BEGIN ENTRY -----':
+				accumulator.clear()
+			elif line == '----- END ENTRY -----':
+				
+				entry = None
+				if card_type == 'User':
+					entry = UserEntry()
+				elif card_type == 'Organization':
+					entry = OrgEntry()
+				else:
+					return RetVal(UnsupportedKeycardType,
+							f'entry {entry_index} has invalid type')
+
+				status = entry.set(b'\r\n'.join(accumulator))
+				if status.error():
+					status.set_info(f'keycard entry {entry_index}: {status.info()}')
+					return status
+				entries.append(entry)
+				entry_index = entry_index + 1
+			else:
+				parts = line.split(':', 1)
+				if len(parts) != 2:
+					return RetVal(BadData, f'invalid line {line_index}')
+				
+				if parts[0] == 'Type':
+					if card_type:
+						if card_type != parts[1]:
+							return RetVal(BadData, 'entry type does not match keycard')
+					else:
+						card_type = parts[1]
 
-
+				accumulator.append(line.encode())
+		
+		self.entries = entries
+		self.checkpoint = None
+		if card_type:
+			self.type = card_type
 		return RetVal()
 
+	def make_bytestring(self) -> bytes:
+		'''Returns the keycard in the format written by save()'''
+		out = list()
+		for entry in self.entries:
+			out.append(b'----- BEGIN ENTRY -----\r\n')
+			out.append(entry.make_bytestring(-1))
+			out.append(b'----- END ENTRY -----\r\n')
+		return b''.join(out)
+
 	def save(self, path: str, clobber: bool) -> RetVal:
 		'''Saves a keycard to a file'''
 		if not path:
@@ -984,28 +1184,211 @@ class Keycard:
 			
 		try:
 			with open(path, 'wb') as f:
-				for entry in self.entries:
-					f.write(b'----- BEGIN ENTRY -----\r\n')
-					f.write(entry.make_bytestring(-1))
-					f.write(b'----- END ENTRY -----\r\n')
+				f.write(self.make_bytestring())
 			
 		except Exception as e:
 			return RetVal(ExceptionThrown, str(e))
 
 		return RetVal()
 	
-	def verify(self) -> RetVal:
-		'''Verifies the card's entire chain of entries'''
+	@metrics.timed(metrics.CRYPTO_OPERATION)
+	def verify(self, max_workers=None) -> RetVal:
+		'''Verifies the card's chain of entries. If the card has a checkpoint which matches its 
+		entries, only the entries added after the checkpoint are verified. Long chains have their 
+		signatures checked in parallel using up to max_workers threads. On success, the checkpoint 
+		is moved to the last entry. On failure, the field 'index' contains the list index of the 
+		first entry which failed.'''
+		
+		status = self.get_chain_data()
+		if status.error():
+			return status
+		
+		status = _check_chain_items(status['items'], status['indices'], max_workers)
+		if not status.error():
+			self.set_checkpoint()
+		return status
+
+	def get_chain_data(self) -> RetVal:
+		'''Performs all the checks of verify() which don't involve cryptography. The signatures 
+		which must still be checked are returned in the field 'items' as a list of 
+		(key, data, signature) tuples. The field 'indices' holds the list index of the entry which 
+		each item belongs to.'''
 		
 		if len(self.entries) == 0:
 			return RetVal(ResourceNotFound, 'keycard contains no entries')
 		
-		if len(self.entries) == 1:
-			return RetVal()
-		
-		for i in range(len(self.entries) - 1):
-			status = self.entries[i + 1].verify_chain(self.entries[i])
+		items = list()
+		indices = list()
+		for i in range(self.verified_index(), len(self.entries) - 1):
+			status = self.entries[i + 1].get_chain_data(self.entries[i])
 			if status.error():
-				return status
+				return status.set_value('index', i + 1)
+			items.append((status['key'], status['data'], status['signature']))
+			indices.append(i + 1)
+
+		return RetVal().set_values({ 'items' : items, 'indices' : indices })
+
+	def verified_index(self) -> int:
+		'''Returns the list index of the last entry covered by the checkpoint. If the checkpoint 
+		is missing or doesn't match the entries, 0 is returned so that the whole chain is checked.
+		
+		NOTE: only the checkpointed entry itself is compared, so the checkpoint should only be 
+		trusted for cards loaded from local storage which are already trusted, not ones received 
+		from the network.'''
+		if not self.checkpoint:
+			return 0
+		
+		try:
+			index = int(self.checkpoint['Index'])
+			expected = self.checkpoint['Hash']
+		except (KeyError, TypeError, ValueError):
+			return 0
+		
+		if index < 0 or index >= len(self.entries):
+			return 0
+		
+		if blake2hash(self.entries[index].make_bytestring(-1)) != expected:
+			return 0
+		
+		return index
+
+	def set_checkpoint(self) -> RetVal:
+		'''Marks all entries in the card as verified'''
+		if len(self.entries) == 0:
+			return RetVal(ResourceNotFound, 'keycard contains no entries')
+		
+		self.checkpoint = {
+			'Index' : len(self.entries) - 1,
+			'Hash' : blake2hash(self.entries[-1].make_bytestring(-1))
+		}
+		return RetVal()
+
+	def save_checkpoint(self, path: str) -> RetVal:
+		'''Saves the checkpoint to the specified path, normally right next to the keycard file'''
+		if not path:
+			return RetVal(BadParameterValue, 'path may not be empty')
+		
+		if not self.checkpoint:
+			return RetVal(ResourceNotFound, 'keycard has no checkpoint')
+		
+		try:
+			with open(path, 'w') as f:
+				json.dump(self.checkpoint, f, ensure_ascii=False, indent=1)
+		except Exception as e:
+			return RetVal(ExceptionThrown, str(e))
+		
+		return RetVal()
 
+	def load_checkpoint(self, path: str) -> RetVal:
+		'''Loads a checkpoint saved by save_checkpoint()'''
+		if not path:
+			return RetVal(BadParameterValue, 'path may not be empty')
+		
+		if not os.path.exists(path):
+			return RetVal(ResourceNotFound)
+		
+		try:
+			with open(path, 'r') as f:
+				checkpoint = json.load(f)
+		except Exception as e:
+			return RetVal(ExceptionThrown, str(e))
+		
+		if not isinstance(checkpoint, dict) or 'Index' not in checkpoint or \
+				'Hash' not in checkpoint:
+			return RetVal(BadData, 'bad checkpoint data')
+		
+		self.checkpoint = checkpoint
 		return RetVal()
+
+
+@metrics.timed(metrics.CRYPTO_OPERATION)
+def verify_keycards(cards: list, max_workers=None) -> RetVal:
+	'''Verifies the chains of a list of keycards, checking all of their signatures as one parallel 
+	batch. This is much faster than calling verify() on each one when there are many cards to 
+	check. On failure, the field 'card' contains the list index of the first card which failed 
+	and the field 'index' contains the index of the entry in that card.'''
+	items = list()
+	indices = list()
+	for card_index, card in enumerate(cards):
+		status = card.get_chain_data()
+		if status.error():
+			return status.set_value('card', card_index)
+		items.extend(status['items'])
+		indices.extend([(card_index, x) for x in status['indices']])
+	
+	status = _check_chain_items(items, indices, max_workers)
+	if status.error():
+		card_index, entry_index = status['index']
+		status.set_values({ 'card' : card_index, 'index' : entry_index })
+		return status
+	
+	for card in cards:
+		card.set_checkpoint()
+	return status
+
+
+@metrics.timed(metrics.CRYPTO)
+def verify_signatures(items: list, max_workers=None) -> RetVal:
+	'''Checks a list of Ed25519 (key, data, signature) tuples of raw bytes, such as those returned 
+	by EntryBase.get_signature_data(). The work is spread across a thread pool of up to 
+	max_workers threads when there are enough items to make it worthwhile -- PyNaCl releases the 
+	GIL while it works. If a signature fails to verify, InvalidKeycard is returned with the list 
+	index of the first bad item in the field 'index'.'''
+	if max_workers is None:
+		max_workers = min(32, (os.cpu_count() or 1) + 4)
+	
+	if max_workers < 1:
+		return RetVal(BadParameterValue, 'max_workers must be positive')
+	
+	if max_workers == 1 or len(items) < PARALLEL_VERIFY_THRESHOLD:
+		bad_index = _first_bad_signature(items, 0)
+	else:
+		# Each worker gets one large slice instead of one item at a time to keep the overhead of 
+		# the pool itself from eating the gains
+		chunk_size = -(-len(items) // max_workers)
+		with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+			results = executor.map(_first_bad_signature,
+				[items[x:x + chunk_size] for x in range(0, len(items), chunk_size)],
+				range(0, len(items), chunk_size))
+			bad_index = min(results)
+	
+	if bad_index < len(items):
+		return RetVal(InvalidKeycard, 'signature verification failure') \
+				.set_value('index', bad_index)
+	return RetVal()
+
+
+def _check_chain_items(items: list, indices: list, max_workers) -> RetVal:
+	'''Runs verify_signatures() and translates the index of a bad item into its entry index'''
+	status = verify_signatures(items, max_workers)
+	if status.error() and 'index' in status:
+		status['index'] = indices[status['index']]
+	return status
+
+
+def _verify_chain_data(status: RetVal) -> RetVal:
+	'''Finishes a verify_chain() call using the results of get_chain_data()'''
+	if status.error():
+		return status
+
+	if not _check_signature((status['key'], status['data'], status['signature'])):
+		return RetVal(InvalidKeycard)
+	return RetVal()
+
+
+def _check_signature(item: tuple) -> bool:
+	'''Checks a single (key, data, signature) tuple'''
+	try:
+		nacl.signing.VerifyKey(item[0]).verify(item[1], item[2])
+	except (nacl.exceptions.BadSignatureError, ValueError, TypeError):
+		return False
+	return True
+
+
+def _first_bad_signature(items: list, offset: int) -> int:
+	'''Returns the index of the first item in the list which fails verification plus the offset. 
+	If all are good, the return value is sys.maxsize.'''
+	for i, item in enumerate(items):
+		if not _check_signature(item):
+			return i + offset
+	return sys.maxsize
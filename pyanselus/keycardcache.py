@@ -0,0 +1,171 @@
+'''This module implements a local cache of verified keycards stored in the profile database's
+keycards table. Lookups by identity or fingerprint are served without touching the network. Each
+cached card is revalidated with the server only after its newest entry's Time-To-Live has run out.'''
+
+import datetime
+import sqlite3
+
+import pyanselus.dbconn as dbconn
+from pyanselus.cryptostring import CryptoString
+from pyanselus.keycard import Keycard, UnsupportedKeycardType
+from pyanselus.retval import RetVal, BadData, BadParameterValue, ResourceNotFound
+import pyanselus.serverconn as serverconn
+
+# Format used for the revalidation time stored in the expires column
+TIMESTAMP_FORMAT = '%Y%m%dT%H%M%SZ'
+
+class KeycardCache:
+	'''Stores verified keycards in the keycards table of a profile database. The identity of a card
+	is the workspace address for user cards and the domain for organization cards. The expires
+	column holds the time at which the card must be checked against the server again, which is
+	based on the Time-To-Live field of the card's newest entry.'''
+	def __init__(self, db: sqlite3.Connection):
+		self.db = db
+
+	def add(self, card: Keycard, identity: str) -> RetVal:
+		'''Verifies a keycard and adds it to the cache, replacing any card already cached for the
+		identity. The card's fingerprint is returned in the field 'fingerprint'.'''
+		if not identity:
+			return RetVal(BadParameterValue, 'identity may not be empty')
+
+		status = card.verify()
+		if status.error():
+			return status
+
+		current = card.entries[-1]
+		if current.type not in ['User', 'Organization']:
+			return RetVal(UnsupportedKeycardType, current.type)
+
+		fingerprint = current.hash
+		if not fingerprint:
+			status = current.get_hash('BLAKE2B-256')
+			if status.error():
+				return status
+			fingerprint = status['hash']
+
+		status = _revalidation_time(card)
+		if status.error():
+			return status
+
+		cursor = self.db.cursor()
+		cursor.execute("DELETE FROM keycards WHERE identity=? OR fingerprint=?",
+			(identity, fingerprint))
+		cursor.execute('''INSERT INTO keycards(fingerprint,fptype,cardtype,carddata,identity,expires)
+			VALUES(?,?,?,?,?,?)''', (fingerprint,
+				CryptoString(fingerprint, lazy=True).prefix, current.type,
+				card.make_bytestring().decode(), identity, status['expires']))
+		dbconn.commit(self.db)
+		return RetVal().set_value('fingerprint', fingerprint)
+
+	def get(self, identity='', fingerprint='') -> RetVal:
+		'''Looks up a cached keycard by identity or by fingerprint. The card is returned in the
+		field 'card' along with 'identity', 'fingerprint', and 'stale'. A stale card is still
+		usable, but it should be checked with refresh() before being relied on.'''
+		cursor = self.db.cursor()
+		if identity:
+			cursor.execute('''SELECT fingerprint,carddata,identity,expires FROM keycards
+				WHERE identity=?''', (identity,))
+		elif fingerprint:
+			cursor.execute('''SELECT fingerprint,carddata,identity,expires FROM keycards
+				WHERE fingerprint=?''', (fingerprint,))
+		else:
+			return RetVal(BadParameterValue, 'identity or fingerprint required')
+
+		results = cursor.fetchone()
+		if not results:
+			return RetVal(ResourceNotFound)
+
+		card = Keycard()
+		status = card.set(results[1].encode())
+		if status.error():
+			return status
+
+		# Cards are verified before they are cached
+		card.set_checkpoint()
+
+		return RetVal().set_values({
+			'card' : card,
+			'fingerprint' : results[0],
+			'identity' : results[2],
+			'stale' : _now() >= results[3]
+		})
+
+	def refresh(self, conn: serverconn.ServerConnection, identity: str) -> RetVal:
+		'''Asks the server if the cached card for the identity is current, but only if its
+		Time-To-Live has run out. If it is, the revalidation time is pushed back. If it isn't, the
+		card is removed from the cache, and the field 'iscurrent' is False so the caller knows to
+		download the updated card.'''
+		status = self.get(identity)
+		if status.error():
+			return status
+
+		if not status['stale']:
+			return RetVal().set_value('iscurrent', True)
+
+		card = status['card']
+		current = card.entries[-1]
+		wid = current['Workspace-ID'] if current.type == 'User' else ''
+		status = serverconn.iscurrent(conn, current['Index'], wid)
+		if status.error():
+			return status
+
+		if not status['iscurrent']:
+			self.remove(identity)
+			return RetVal().set_value('iscurrent', False)
+
+		status = _revalidation_time(card)
+		if status.error():
+			return status
+
+		cursor = self.db.cursor()
+		cursor.execute("UPDATE keycards SET expires=? WHERE identity=?",
+			(status['expires'], identity))
+		dbconn.commit(self.db)
+		return RetVal().set_value('iscurrent', True)
+
+	def remove(self, identity: str) -> RetVal:
+		'''Removes the card for an identity from the cache'''
+		cursor = self.db.cursor()
+		cursor.execute("SELECT identity FROM keycards WHERE identity=?", (identity,))
+		results = cursor.fetchone()
+		if not results:
+			return RetVal(ResourceNotFound)
+
+		cursor.execute("DELETE FROM keycards WHERE identity=?", (identity,))
+		dbconn.commit(self.db)
+		return RetVal()
+
+	def evict_expired(self) -> RetVal:
+		'''Removes cards whose newest entry has expired. The number of cards removed is returned in
+		the field 'count'.'''
+		cursor = self.db.cursor()
+		cursor.execute("SELECT identity,carddata FROM keycards")
+
+		expired = list()
+		for identity, carddata in cursor.fetchall():
+			card = Keycard()
+			if card.set(carddata.encode()).error() or not card.entries or \
+					card.entries[-1].is_expired().error():
+				expired.append((identity,))
+
+		if expired:
+			cursor.executemany("DELETE FROM keycards WHERE identity=?", expired)
+			dbconn.commit(self.db)
+		return RetVal().set_value('count', len(expired))
+
+
+def _now() -> str:
+	'''Returns the current time in the format used in the expires column'''
+	return datetime.datetime.utcnow().strftime(TIMESTAMP_FORMAT)
+
+
+def _revalidation_time(card: Keycard) -> RetVal:
+	'''Returns in the field 'expires' the time at which a card must be checked with the server
+	again, based on the Time-To-Live field of its newest entry, which is in days'''
+	try:
+		ttl = int(card.entries[-1]['Time-To-Live'])
+	except (KeyError, ValueError):
+		return RetVal(BadData, 'bad Time-To-Live value')
+
+	expires = datetime.datetime.utcnow() + datetime.timedelta(days=ttl)
+	return RetVal().set_value('expires', expires.strftime(TIMESTAMP_FORMAT))
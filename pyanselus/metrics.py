@@ -0,0 +1,203 @@
+'''This module collects optional performance metrics: latency histograms for server commands,
+database helpers, and cryptography, and counters for the bytes sent to and received from servers.
+Collection is off until enable() is called. While it is off, an instrumented function costs one
+extra function call and a flag check. The collected data can be read as a dictionary with
+snapshot() or as Prometheus text with to_prometheus().
+
+Within a family, no timed function calls another, so the times in a family can be added up. 
+Cryptographic operations built from other timed ones, such as verifying a whole keycard, are kept 
+in their own family for this reason.'''
+
+import bisect
+import functools
+import inspect
+import threading
+import time
+
+# Histogram families
+COMMAND = 'command'
+SQL = 'sql'
+CRYPTO = 'crypto'
+CRYPTO_OPERATION = 'crypto_operation'
+
+# Counters
+BYTES_SENT = 'bytes_sent'
+BYTES_RECEIVED = 'bytes_received'
+
+# Prometheus names and help text for the histogram families and counters
+HISTOGRAMS = {
+	COMMAND : ('anselus_command_seconds', 'Time taken by server commands'),
+	SQL : ('anselus_sql_seconds', 'Time taken by database helpers'),
+	CRYPTO : ('anselus_crypto_seconds', 'Time taken by cryptographic primitives'),
+	CRYPTO_OPERATION : ('anselus_crypto_operation_seconds',
+		'Time taken by cryptographic operations made of several primitives'),
+}
+COUNTERS = {
+	BYTES_SENT : ('anselus_bytes_sent_total', 'Bytes sent to servers'),
+	BYTES_RECEIVED : ('anselus_bytes_received_total', 'Bytes received from servers'),
+}
+
+# Upper bounds of the histogram buckets in seconds. Crypto calls take microseconds and server
+# commands can take seconds, so the buckets cover both.
+DEFAULT_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0,
+	5.0, 10.0)
+
+__enabled = False
+__lock = threading.Lock()
+
+# Maps (family, name) tuples to Histograms
+__histograms = dict()
+__counters = dict()
+
+class Histogram:
+	'''Counts observations in buckets with fixed upper bounds'''
+	def __init__(self, buckets=DEFAULT_BUCKETS):
+		self.buckets = tuple(buckets)
+
+		# The last slot counts the observations larger than every bucket
+		self.counts = [0] * (len(self.buckets) + 1)
+		self.count = 0
+		self.sum = 0.0
+
+	def observe(self, value: float):
+		'''Adds an observation'''
+		self.counts[bisect.bisect_left(self.buckets, value)] += 1
+		self.count = self.count + 1
+		self.sum = self.sum + value
+
+	def cumulative(self) -> list:
+		'''Returns a list of (upper bound, count) tuples in which each count includes the
+		observations of the buckets before it, as Prometheus expects. The last upper bound is
+		float('inf').'''
+		out = list()
+		total = 0
+		for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+			total = total + count
+			out.append((bound, total))
+		return out
+
+
+def enable():
+	'''Starts collecting metrics'''
+	global __enabled
+	__enabled = True
+
+
+def disable():
+	'''Stops collecting metrics. Data collected so far is kept until reset() is called.'''
+	global __enabled
+	__enabled = False
+
+
+def is_enabled() -> bool:
+	'''Returns whether metrics are being collected'''
+	return __enabled
+
+
+def reset():
+	'''Discards all collected data'''
+	with __lock:
+		__histograms.clear()
+		__counters.clear()
+
+
+def observe(family: str, name: str, seconds: float):
+	'''Records how long an operation took, if metrics are enabled'''
+	if not __enabled:
+		return
+
+	with __lock:
+		histogram = __histograms.get((family, name))
+		if histogram is None:
+			histogram = Histogram()
+			__histograms[(family, name)] = histogram
+		histogram.observe(seconds)
+
+
+def count(counter: str, amount: int):
+	'''Adds to a counter, if metrics are enabled'''
+	if not __enabled:
+		return
+
+	with __lock:
+		__counters[counter] = __counters.get(counter, 0) + amount
+
+
+def timed(family: str, name=''):
+	'''Decorator which records the time taken by each call to a function in a histogram. name
+	defaults to the qualified name of the function, such as EncryptionPair.encrypt. Coroutine
+	functions are timed from the first call until they return, including time spent waiting.'''
+	def decorator(func):
+		label = name or func.__qualname__
+
+		if inspect.iscoroutinefunction(func):
+			@functools.wraps(func)
+			async def async_wrapper(*args, **kwargs):
+				if not __enabled:
+					return await func(*args, **kwargs)
+
+				start = time.perf_counter()
+				try:
+					return await func(*args, **kwargs)
+				finally:
+					observe(family, label, time.perf_counter() - start)
+			return async_wrapper
+
+		@functools.wraps(func)
+		def wrapper(*args, **kwargs):
+			if not __enabled:
+				return func(*args, **kwargs)
+
+			start = time.perf_counter()
+			try:
+				return func(*args, **kwargs)
+			finally:
+				observe(family, label, time.perf_counter() - start)
+		return wrapper
+	return decorator
+
+
+def snapshot() -> dict:
+	'''Returns a copy of the collected data. The histogram families are keyed by family, then by
+	name, and each histogram is a dictionary containing 'count', 'sum', and 'buckets', which is
+	the list returned by Histogram.cumulative(). The counters are keyed by counter name.'''
+	out = { family : dict() for family in HISTOGRAMS }
+	with __lock:
+		for (family, name), histogram in __histograms.items():
+			out.setdefault(family, dict())[name] = {
+				'count' : histogram.count,
+				'sum' : histogram.sum,
+				'buckets' : histogram.cumulative()
+			}
+		for counter in COUNTERS:
+			out[counter] = __counters.get(counter, 0)
+	return out
+
+
+def to_prometheus() -> str:
+	'''Returns the collected data in the Prometheus text exposition format'''
+	data = snapshot()
+	lines = list()
+	for family, (metric, helptext) in HISTOGRAMS.items():
+		lines.append(f"# HELP {metric} {helptext}")
+		lines.append(f"# TYPE {metric} histogram")
+		for name, histogram in sorted(data[family].items()):
+			label = _escape_label(name)
+			for bound, total in histogram['buckets']:
+				bound = '+Inf' if bound == float('inf') else repr(bound)
+				lines.append(f'{metric}_bucket{{name="{label}",le="{bound}"}} {total}')
+			lines.append(f'{metric}_sum{{name="{label}"}} {histogram["sum"]!r}')
+			lines.append(f'{metric}_count{{name="{label}"}} {histogram["count"]}')
+
+	for counter, (metric, helptext) in COUNTERS.items():
+		lines.append(f"# HELP {metric} {helptext}")
+		lines.append(f"# TYPE {metric} counter")
+		lines.append(f"{metric} {data[counter]}")
+
+	lines.append('')
+	return '\n'.join(lines)
+
+
+def _escape_label(value: str) -> str:
+	'''Escapes a Prometheus label value'''
+	return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
@@ -0,0 +1,218 @@
+'''This module creates and upgrades the schema of profile databases. The schema version is kept in
+the database's user_version pragma, and each migration step brings the database up by one
+version. Steps are written so that running them against a database which already has their
+changes does nothing, which is needed for profiles created before versioning was added.'''
+
+import sqlite3
+
+from pyanselus.retval import RetVal, ExceptionThrown
+
+UnsupportedSchema = 'UnsupportedSchema'
+TransactionOpen = 'TransactionOpen'
+
+# MIGRATIONS[n] holds the SQL statements which upgrade a database from version n to version n+1
+MIGRATIONS = [
+	[ '''
+		CREATE TABLE IF NOT EXISTS workspaces (
+			"wid" TEXT NOT NULL UNIQUE,
+			"userid" TEXT,
+			"domain" TEXT,
+			"password" TEXT,
+			"pwhashtype" TEXT,
+			"type" TEXT
+		);''', '''
+		CREATE TABLE IF NOT EXISTS "folders"(
+			"fid" TEXT NOT NULL UNIQUE,
+			"address" TEXT NOT NULL,
+			"keyid" TEXT NOT NULL,
+			"path" TEXT NOT NULL,
+			"permissions" TEXT NOT NULL
+		);''', '''
+		CREATE TABLE IF NOT EXISTS "sessions"(
+			"address" TEXT NOT NULL,
+			"devid" TEXT NOT NULL,
+			"devname" TEXT,
+			"enctype" TEXT NOT NULL,
+			"public_key" TEXT NOT NULL,
+			"private_key" TEXT NOT NULL
+		);''', '''
+		CREATE TABLE IF NOT EXISTS "keys"(
+			"keyid" TEXT NOT NULL UNIQUE,
+			"address" TEXT NOT NULL,
+			"type" TEXT NOT NULL,
+			"category" TEXT NOT NULL,
+			"private" TEXT NOT NULL,
+			"public" TEXT,
+			"algorithm" TEXT NOT NULL
+		);''', '''
+		CREATE TABLE IF NOT EXISTS "keycards"(
+			"fingerprint" TEXT NOT NULL UNIQUE,
+			"fptype" TEXT NOT NULL,
+			"cardtype" TEXT NOT NULL,
+			"carddata" TEXT NOT NULL,
+			"identity" TEXT NOT NULL,
+			"expires" TEXT NOT NULL
+		);''', '''
+		CREATE TABLE IF NOT EXISTS "messages"(
+			"id" TEXT NOT NULL UNIQUE,
+			"from"  TEXT NOT NULL,
+			"address" TEXT NOT NULL,
+			"cc"  TEXT,
+			"bcc" TEXT,
+			"date" TEXT NOT NULL,
+			"thread_id" TEXT NOT NULL,
+			"subject" TEXT,
+			"body" TEXT,
+			"attachments" TEXT
+		);''', '''
+		CREATE TABLE IF NOT EXISTS "contacts" (
+			"id"	TEXT NOT NULL,
+			"sensitivity"	TEXT NOT NULL,
+			"source"	TEXT NOT NULL,
+			"fieldname"	TEXT,
+			"fieldvalue"	TEXT
+		);''', '''
+		CREATE TABLE IF NOT EXISTS "notes" (
+			"id"	TEXT NOT NULL UNIQUE,
+			"address" TEXT,
+			"title"	TEXT,
+			"body"	TEXT,
+			"notebook"	TEXT,
+			"tags"	TEXT,
+			"created"	TEXT NOT NULL,
+			"updated"	TEXT,
+			"attachments"	TEXT
+		);''', '''
+		CREATE TABLE IF NOT EXISTS "files" (
+			"id"	TEXT NOT NULL UNIQUE,
+			"name"	TEXT NOT NULL,
+			"type"	TEXT NOT NULL,
+			"path"	TEXT NOT NULL
+		);'''
+	],
+
+	# Indexes for the columns used to look up and delete rows belonging to a workspace or device.
+	# Messages are also listed by mailbox or thread in date order, so date is part of those.
+	[
+		'CREATE INDEX IF NOT EXISTS "folders_address" ON "folders"("address");',
+		'CREATE INDEX IF NOT EXISTS "sessions_address" ON "sessions"("address");',
+		'CREATE INDEX IF NOT EXISTS "sessions_devid" ON "sessions"("devid");',
+		'CREATE INDEX IF NOT EXISTS "keys_address" ON "keys"("address");',
+		'CREATE INDEX IF NOT EXISTS "keycards_identity" ON "keycards"("identity");',
+		'CREATE INDEX IF NOT EXISTS "messages_address_date" ON "messages"("address","date");',
+		'CREATE INDEX IF NOT EXISTS "messages_thread_date" ON "messages"("thread_id","date");',
+		'CREATE INDEX IF NOT EXISTS "notes_address" ON "notes"("address");',
+	],
+
+	# Full-text indexes for messages and notes. They are external-content tables, so the text is
+	# stored only once, and triggers keep them in sync with the tables they index. Updates are
+	# only reindexed when an indexed column changes. See FTS_STEP.
+	[ '''
+		CREATE VIRTUAL TABLE IF NOT EXISTS "messages_fts" USING fts5(
+			"subject", "body", content="messages", content_rowid="rowid"
+		);''', '''
+		CREATE TRIGGER IF NOT EXISTS "messages_fts_insert" AFTER INSERT ON "messages" BEGIN
+			INSERT INTO "messages_fts"(rowid,"subject","body")
+				VALUES(new.rowid,new."subject",new."body");
+		END;''', '''
+		CREATE TRIGGER IF NOT EXISTS "messages_fts_delete" AFTER DELETE ON "messages" BEGIN
+			INSERT INTO "messages_fts"("messages_fts",rowid,"subject","body")
+				VALUES('delete',old.rowid,old."subject",old."body");
+		END;''', '''
+		CREATE TRIGGER IF NOT EXISTS "messages_fts_update"
+				AFTER UPDATE OF "subject","body" ON "messages" BEGIN
+			INSERT INTO "messages_fts"("messages_fts",rowid,"subject","body")
+				VALUES('delete',old.rowid,old."subject",old."body");
+			INSERT INTO "messages_fts"(rowid,"subject","body")
+				VALUES(new.rowid,new."subject",new."body");
+		END;''', '''
+		INSERT INTO "messages_fts"("messages_fts") VALUES('rebuild');''', '''
+		CREATE VIRTUAL TABLE IF NOT EXISTS "notes_fts" USING fts5(
+			"title", "body", content="notes", content_rowid="rowid"
+		);''', '''
+		CREATE TRIGGER IF NOT EXISTS "notes_fts_insert" AFTER INSERT ON "notes" BEGIN
+			INSERT INTO "notes_fts"(rowid,"title","body") VALUES(new.rowid,new."title",new."body");
+		END;''', '''
+		CREATE TRIGGER IF NOT EXISTS "notes_fts_delete" AFTER DELETE ON "notes" BEGIN
+			INSERT INTO "notes_fts"("notes_fts",rowid,"title","body")
+				VALUES('delete',old.rowid,old."title",old."body");
+		END;''', '''
+		CREATE TRIGGER IF NOT EXISTS "notes_fts_update"
+				AFTER UPDATE OF "title","body" ON "notes" BEGIN
+			INSERT INTO "notes_fts"("notes_fts",rowid,"title","body")
+				VALUES('delete',old.rowid,old."title",old."body");
+			INSERT INTO "notes_fts"(rowid,"title","body") VALUES(new.rowid,new."title",new."body");
+		END;''', '''
+		INSERT INTO "notes_fts"("notes_fts") VALUES('rebuild');'''
+	],
+]
+
+# The schema version of a fully-upgraded database
+SCHEMA_VERSION = len(MIGRATIONS)
+
+# The step which creates the full-text search indexes. It is skipped if the SQLite library was 
+# built without FTS5, so that profiles can still be used without search, and run by a later 
+# migrate() call made with a library which has it.
+FTS_STEP = 2
+
+def get_version(db: sqlite3.Connection) -> int:
+	'''Returns the schema version of a database'''
+	return db.execute('PRAGMA user_version').fetchone()[0]
+
+
+def has_fts5(db: sqlite3.Connection) -> bool:
+	'''Returns whether the SQLite library supports FTS5 full-text indexes'''
+	return ('ENABLE_FTS5',) in db.execute('PRAGMA compile_options').fetchall()
+
+
+def has_search_indexes(db: sqlite3.Connection) -> bool:
+	'''Returns whether the database has its full-text search indexes'''
+	return db.execute('''SELECT COUNT(*) FROM sqlite_master
+		WHERE type='table' AND name IN ('messages_fts','notes_fts')''').fetchone()[0] == 2
+
+
+def migrate(db: sqlite3.Connection) -> RetVal:
+	'''Upgrades a database to the current schema version. All steps are run in one transaction,
+	so if one fails, the database is left as it was. The resulting version is returned in the
+	field 'version'. UnsupportedSchema is returned for databases made by a newer version of the
+	library. The field 'search' is False if SQLite lacks FTS5, in which case the search indexes 
+	are left out. Migrating needs its own transaction, so TransactionOpen is returned if the 
+	connection already has one, such as inside a dbconn.transaction() block.'''
+	version = get_version(db)
+	fts = has_fts5(db)
+	if version == SCHEMA_VERSION and (not fts or has_search_indexes(db)):
+		return RetVal().set_values({ 'version' : version, 'search' : fts })
+
+	if version > SCHEMA_VERSION:
+		return RetVal(UnsupportedSchema, f"database schema version {version} is too new")
+
+	if db.in_transaction:
+		return RetVal(TransactionOpen, 'migrate() cannot run inside an open transaction')
+
+	try:
+		cursor = db.cursor()
+		cursor.execute('BEGIN IMMEDIATE')
+
+		# Another connection may have upgraded the database before the lock was taken
+		version = get_version(db)
+		if version > SCHEMA_VERSION:
+			db.rollback()
+			return RetVal(UnsupportedSchema, f"database schema version {version} is too new")
+
+		steps = list(range(version, SCHEMA_VERSION))
+		if not fts:
+			steps = [ x for x in steps if x != FTS_STEP ]
+		elif version > FTS_STEP and not has_search_indexes(db):
+			# The database was upgraded by a library without FTS5
+			steps.insert(0, FTS_STEP)
+		
+		for step in steps:
+			for sqlcmd in MIGRATIONS[step]:
+				cursor.execute(sqlcmd)
+		cursor.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+		db.commit()
+	except Exception as e:
+		db.rollback()
+		return RetVal(ExceptionThrown, str(e))
+
+	return RetVal().set_values({ 'version' : SCHEMA_VERSION, 'search' : fts })
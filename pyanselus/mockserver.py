@@ -0,0 +1,415 @@
+'''This module contains MockServer, a stand-in for anselusd which runs on localhost and speaks the
+same JSON-over-TCP protocol. It keeps all of its state in memory and needs no database, so client
+code can be tested and benchmarked without any external services. The delay before each response
+and the amount of padding added to it can be set to simulate slow or busy servers.'''
+
+import hashlib
+import json
+import secrets
+import socket
+import threading
+import time
+import uuid
+
+from pyanselus.encryption import EncryptionPair, PublicKey, SigningPair
+from pyanselus.cryptostring import CryptoString
+from pyanselus.framing import FrameBuffer, READ_BUFFER_SIZE
+from pyanselus.keycard import UserEntry
+
+class MockServer:
+	'''Minimal in-memory Anselus server. It handles LOGIN, PASSWORD, DEVICE, GETWID, ISCURRENT,
+	ADDENTRY, REGISTER, PREREG, UPLOAD, DOWNLOAD, and QUIT. The organization's keys are generated 
+	when the server is created and are available as org_signing and org_encryption for clients 
+	which need them.
+
+	latency is the number of seconds to wait before sending each response. payload_size is the
+	number of bytes of padding added to the Data of each response in the field 'Padding'. Both
+	can be changed while the server is running. Files are kept in the files dictionary, keyed by 
+	server path. To test resuming transfers, drop_after can be set to a number of bytes, and the 
+	next upload or download is cut off after that much of the file.'''
+	def __init__(self, domain='example.com', latency=0.0, payload_size=0):
+		self.domain = domain
+		self.latency = latency
+		self.payload_size = payload_size
+		self.org_signing = SigningPair()
+		self.org_encryption = EncryptionPair()
+		self.host = '127.0.0.1'
+		self.port = 0
+
+		# Maps workspace IDs to dictionaries holding 'uid', 'password', 'devices', and 'entries'
+		self.workspaces = dict()
+		self.users = dict()
+		self.regcodes = dict()
+
+		# Number of requests handled for each command
+		self.counts = dict()
+
+		# Maps server paths to file contents, and the resume IDs of unfinished uploads to the data 
+		# received so far
+		self.files = dict()
+		self.partial = dict()
+		self.drop_after = 0
+
+		self.__lock = threading.Lock()
+		self.__listener = None
+		self.__clients = list()
+		self.__thread = None
+		self.__handlers = {
+			'ADDENTRY' : self.__addentry,
+			'DEVICE' : self.__device,
+			'GETWID' : self.__getwid,
+			'ISCURRENT' : self.__iscurrent,
+			'LOGIN' : self.__login,
+			'PASSWORD' : self.__password,
+			'PREREG' : self.__prereg,
+			'REGISTER' : self.__register,
+		}
+
+		# Commands which send or receive raw file data after their first response. Their handlers 
+		# do their own responding and return False if the connection is to be dropped.
+		self.__transfers = {
+			'DOWNLOAD' : self.__download,
+			'UPLOAD' : self.__upload,
+		}
+
+	def __enter__(self):
+		self.start()
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.stop()
+
+	def start(self, port=0):
+		'''Starts listening on localhost. If port is 0, a free port is chosen, which can be read
+		from the port attribute afterward.'''
+		self.__listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		self.__listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		self.__listener.bind((self.host, port))
+		self.__listener.listen(64)
+		self.port = self.__listener.getsockname()[1]
+		self.__thread = threading.Thread(target=self.__accept, daemon=True)
+		self.__thread.start()
+
+	def stop(self):
+		'''Stops the server and disconnects all clients'''
+		if self.__listener:
+			# Closing a socket doesn't wake a thread blocked in accept(), but shutting it down does
+			try:
+				self.__listener.shutdown(socket.SHUT_RDWR)
+			except OSError:
+				pass
+			self.__listener.close()
+			self.__listener = None
+		with self.__lock:
+			clients = self.__clients
+			self.__clients = list()
+		for client in clients:
+			try:
+				client.shutdown(socket.SHUT_RDWR)
+			except OSError:
+				pass
+			client.close()
+		if self.__thread:
+			self.__thread.join()
+			self.__thread = None
+
+	def add_workspace(self, wid: str, uid='', password='') -> None:
+		'''Creates a workspace directly, without going through registration'''
+		with self.__lock:
+			self.workspaces[wid] = { 'uid':uid, 'password':password, 'devices':dict(),
+				'entries':list() }
+			if uid:
+				self.users[uid] = wid
+
+	def __accept(self):
+		'''Accepts clients until the server is stopped'''
+		while True:
+			try:
+				client, _ = self.__listener.accept()
+			except (OSError, AttributeError):
+				return
+			with self.__lock:
+				self.__clients.append(client)
+			threading.Thread(target=self.__serve, args=(client,), daemon=True).start()
+
+	def __serve(self, client: socket.socket):
+		'''Handles requests from one client until it quits or disconnects'''
+		session = { 'wid':'', 'stage':'', 'challenge':'', 'entry':None }
+		framer = FrameBuffer()
+		self.__send(client, { 'Name':'Anselus', 'Version':'0.1', 'Code':200, 'Status':'OK' })
+		try:
+			while True:
+				status = framer.read_frame(client)
+				if status.error():
+					break
+
+				try:
+					request = json.loads(status['frame'])
+					action = request['Action']
+					data = request['Data']
+				except (ValueError, KeyError, TypeError):
+					self.__respond(client, 400, 'BAD REQUEST')
+					continue
+
+				with self.__lock:
+					self.counts[action] = self.counts.get(action, 0) + 1
+
+				if action == 'QUIT':
+					break
+
+				transfer = self.__transfers.get(action)
+				if transfer:
+					if not transfer(client, framer, data):
+						break
+					continue
+
+				handler = self.__handlers.get(action)
+				if not handler:
+					self.__respond(client, 301, 'NOT IMPLEMENTED')
+					continue
+				code, text, outdata = handler(session, data)
+				self.__respond(client, code, text, outdata)
+		except OSError:
+			pass
+		finally:
+			with self.__lock:
+				if client in self.__clients:
+					self.__clients.remove(client)
+			client.close()
+
+	def __respond(self, client: socket.socket, code: int, text: str, data=None):
+		'''Sends a response after the configured delay and with the configured padding'''
+		if self.latency:
+			time.sleep(self.latency)
+
+		outdata = dict(data) if data else dict()
+		if self.payload_size:
+			outdata['Padding'] = 'x' * self.payload_size
+		self.__send(client, { 'Code':code, 'Status':text, 'Info':'', 'Data':outdata })
+
+	@staticmethod
+	def __send(client: socket.socket, msg: dict):
+		'''Sends a message'''
+		client.sendall(json.dumps(msg).encode() + b'\r\n')
+
+	def __addentry(self, session: dict, data: dict) -> tuple:
+		'''Handles both stages of ADDENTRY for a logged-in workspace'''
+		if not session['wid'] or session['stage'] not in ['logged-in', 'addentry']:
+			return (401, 'UNAUTHORIZED', None)
+
+		workspace = self.workspaces[session['wid']]
+		if session['stage'] == 'addentry':
+			entry = session['entry']
+			session['stage'] = 'logged-in'
+			session['entry'] = None
+			if 'User-Signature' not in data:
+				return (400, 'BAD REQUEST', None)
+			entry.signatures['User'] = data['User-Signature']
+			with self.__lock:
+				workspace['entries'].append(entry)
+			return (200, 'OK', None)
+
+		if 'Base-Entry' not in data:
+			return (400, 'BAD REQUEST', None)
+
+		entry = UserEntry()
+		status = entry.set(data['Base-Entry'].encode())
+		if status.error():
+			return (411, 'BAD KEYCARD DATA', None)
+
+		status = entry.sign(self.org_signing.private, 'Organization')
+		if status.error():
+			return (300, 'INTERNAL SERVER ERROR', None)
+		if workspace['entries']:
+			entry.prev_hash = workspace['entries'][-1].hash
+		status = entry.generate_hash('BLAKE2B-256')
+		if status.error():
+			return (300, 'INTERNAL SERVER ERROR', None)
+
+		session['stage'] = 'addentry'
+		session['entry'] = entry
+		return (100, 'CONTINUE', {
+			'Organization-Signature' : entry.signatures['Organization'],
+			'Hash' : entry.hash,
+			'Previous-Hash' : entry.prev_hash
+		})
+
+	def __device(self, session: dict, data: dict) -> tuple:
+		'''Handles both stages of DEVICE. Unknown devices are added to the workspace.'''
+		if not session['wid'] or session['stage'] not in ['password', 'device']:
+			return (401, 'UNAUTHORIZED', None)
+
+		if 'Device-ID' not in data or 'Device-Key' not in data:
+			return (400, 'BAD REQUEST', None)
+
+		if session['stage'] == 'device':
+			if data.get('Response') != session['challenge']:
+				session['stage'] = ''
+				return (401, 'UNAUTHORIZED', None)
+			with self.__lock:
+				self.workspaces[session['wid']]['devices'][data['Device-ID']] = data['Device-Key']
+			session['stage'] = 'logged-in'
+			return (200, 'OK', None)
+
+		session['challenge'] = secrets.token_hex(16)
+		status = PublicKey(CryptoString(data['Device-Key'])).encrypt(session['challenge'].encode())
+		if status.error():
+			return (400, 'BAD REQUEST', None)
+		session['stage'] = 'device'
+		return (100, 'CONTINUE', { 'Challenge' : status['data'] })
+
+	def __download(self, client: socket.socket, framer: FrameBuffer, data: dict) -> bool:
+		'''Sends a file. The resume ID is a hash of the file, so a download is only resumed if the 
+		file hasn't changed.'''
+		with self.__lock:
+			filedata = self.files.get(data.get('Path', ''))
+		if filedata is None:
+			self.__respond(client, 404, 'RESOURCE NOT FOUND')
+			return True
+
+		resume_id = hashlib.sha256(filedata).hexdigest()
+		offset = 0
+		if data.get('Resume-ID') == resume_id:
+			try:
+				offset = int(data.get('Offset', 0))
+			except ValueError:
+				offset = -1
+			if offset < 0 or offset > len(filedata):
+				self.__respond(client, 400, 'BAD REQUEST')
+				return True
+
+		self.__respond(client, 100, 'CONTINUE', { 'Size' : str(len(filedata)),
+			'Resume-ID' : resume_id, 'Offset' : str(offset) })
+		if self.drop_after:
+			client.sendall(filedata[offset:offset + self.drop_after])
+			self.drop_after = 0
+			return False
+		client.sendall(filedata[offset:])
+		return True
+
+	def __getwid(self, session: dict, data: dict) -> tuple: # pylint: disable=unused-argument
+		'''Looks up the workspace ID for a user ID'''
+		wid = self.users.get(data.get('User-ID', ''))
+		if not wid:
+			return (404, 'RESOURCE NOT FOUND', None)
+		return (200, 'OK', { 'Workspace-ID' : wid })
+
+	def __iscurrent(self, session: dict, data: dict) -> tuple: # pylint: disable=unused-argument
+		'''Checks whether an index is the newest entry of a workspace's keycard'''
+		try:
+			index = int(data['Index'])
+		except (KeyError, ValueError):
+			return (400, 'BAD REQUEST', None)
+
+		workspace = self.workspaces.get(data.get('Workspace-ID', ''))
+		if not workspace:
+			return (404, 'RESOURCE NOT FOUND', None)
+		return (200, 'OK', { 'Is-Current' : 'YES' if index == len(workspace['entries']) else 'NO' })
+
+	def __login(self, session: dict, data: dict) -> tuple:
+		'''Decrypts the client's challenge with the organization encryption key'''
+		if data.get('Workspace-ID') not in self.workspaces:
+			return (404, 'RESOURCE NOT FOUND', None)
+
+		status = self.org_encryption.decrypt(data.get('Challenge', ''))
+		if status.error():
+			return (306, 'KEY FAILURE', None)
+
+		session['wid'] = data['Workspace-ID']
+		session['stage'] = 'login'
+		return (100, 'CONTINUE', { 'Response' : status['data'] })
+
+	def __password(self, session: dict, data: dict) -> tuple:
+		'''Checks the password hash for the workspace being logged into'''
+		if not session['wid'] or session['stage'] != 'login':
+			return (401, 'UNAUTHORIZED', None)
+
+		if data.get('Password-Hash') != self.workspaces[session['wid']]['password']:
+			session['stage'] = ''
+			return (402, 'AUTHENTICATION FAILURE', None)
+
+		session['stage'] = 'password'
+		return (100, 'CONTINUE', None)
+
+	def __prereg(self, session: dict, data: dict) -> tuple: # pylint: disable=unused-argument
+		'''Creates a workspace and a registration code for it'''
+		wid = data.get('Workspace-ID') or str(uuid.uuid4())
+		uid = data.get('User-ID', '')
+		if wid in self.workspaces or (uid and uid in self.users):
+			return (408, 'RESOURCE EXISTS', None)
+
+		self.add_workspace(wid, uid)
+		regcode = secrets.token_hex(8)
+		self.regcodes[regcode] = wid
+		outdata = { 'Domain' : self.domain, 'Workspace-ID' : wid, 'Reg-Code' : regcode }
+		if uid:
+			outdata['User-ID'] = uid
+		return (200, 'OK', outdata)
+
+	def __register(self, session: dict, data: dict) -> tuple: # pylint: disable=unused-argument
+		'''Creates a workspace with one device'''
+		for field in ['Workspace-ID', 'Password-Hash', 'Device-ID', 'Device-Key']:
+			if field not in data:
+				return (400, 'BAD REQUEST', None)
+
+		uid = data.get('User-ID', '')
+		if uid and uid in self.users:
+			return (408, 'RESOURCE EXISTS', { 'Field' : 'User-ID' })
+		if data['Workspace-ID'] in self.workspaces:
+			return (408, 'RESOURCE EXISTS', { 'Field' : 'Workspace-ID' })
+
+		self.add_workspace(data['Workspace-ID'], uid, data['Password-Hash'])
+		self.workspaces[data['Workspace-ID']]['devices'][data['Device-ID']] = data['Device-Key']
+		return (201, 'REGISTERED', { 'Domain' : self.domain })
+
+
+	def __upload(self, client: socket.socket, framer: FrameBuffer, data: dict) -> bool:
+		'''Receives a file. An upload with a known resume ID continues from where it stopped.'''
+		try:
+			size = int(data['Size'])
+			path = data['Path']
+		except (KeyError, ValueError):
+			self.__respond(client, 400, 'BAD REQUEST')
+			return True
+
+		with self.__lock:
+			resume_id = data.get('Resume-ID', '')
+			if resume_id not in self.partial:
+				resume_id = str(uuid.uuid4())
+				self.partial[resume_id] = bytearray()
+			received = self.partial[resume_id]
+		if len(received) > size:
+			self.__respond(client, 400, 'BAD REQUEST')
+			return True
+
+		self.__respond(client, 100, 'CONTINUE', { 'Resume-ID' : resume_id,
+			'Offset' : str(len(received)) })
+
+		# Part of the file may already have been read into the framer along with the request
+		pending = bytes(framer.buffer)
+		framer.clear()
+		while len(received) < size:
+			wanted = size - len(received)
+			if self.drop_after:
+				wanted = min(wanted, self.drop_after)
+			if pending:
+				chunk = pending[:wanted]
+				pending = pending[len(chunk):]
+			else:
+				chunk = client.recv(min(wanted, READ_BUFFER_SIZE))
+			if not chunk:
+				return False
+
+			received.extend(chunk)
+			if self.drop_after:
+				self.drop_after = self.drop_after - len(chunk)
+				if not self.drop_after:
+					return False
+		framer.feed(pending)
+
+		with self.__lock:
+			self.files[path] = bytes(received)
+			del self.partial[resume_id]
+		self.__respond(client, 200, 'OK',
+			{ 'File-Name' : f"{int(time.time())}.{size}.{uuid.uuid4()}" })
+		return True
@@ -20,88 +20,128 @@ ServerError = 'ServerError'
 Unimplemented = 'Unimplemented'
 
 class RetVal:
-	'''The RetVal class enables better error checking and variable return values'''
+	'''The RetVal class enables better error checking and variable return values. Most functions 
+	return one, so it is kept small: the error and info are stored in slots and the dictionary 
+	for other values is only created when the first one is added.'''
+	__slots__ = ('_error', '_info', '_fields')
+
 	def __init__(self, value=OK, info=''):
-		self._fields = { '_error':value, '_info':info }
+		self._error = value
+		self._info = info
+		self._fields = None
 	
 	def __contains__(self, key):
-		return key in self._fields
+		if key in ('_error', '_info'):
+			return True
+		return self._fields is not None and key in self._fields
 
 	def __delitem__(self, key):
+		if self._fields is None:
+			raise KeyError(key)
 		del self._fields[key]
 
 	def __getitem__(self, key):
-		return self._fields[key]
+		# _error and _info are never stored in _fields, so the common case is checked first
+		try:
+			return self._fields[key]
+		except (KeyError, TypeError):
+			pass
+		
+		if key == '_error':
+			return self._error
+		if key == '_info':
+			return self._info
+		raise KeyError(key)
 	
 	def __iter__(self):
-		return self._fields.__iter__()
+		yield '_error'
+		yield '_info'
+		if self._fields is not None:
+			yield from self._fields
 	
 	def __setitem__(self, key, value):
-		self._fields[key] = value
+		if key == '_error':
+			self._error = value
+		elif key == '_info':
+			self._info = value
+		elif self._fields is None:
+			self._fields = { key:value }
+		else:
+			self._fields[key] = value
 	
 	def __str__(self):
 		out = list()
-		out.append('Error: ' + self._fields['_error'])
-		out.append('Info: ' + self._fields['_info'])
+		out.append('Error: ' + self._error)
+		out.append('Info: ' + self._info)
 
-		for k,v in self._fields.items():
-			if k in ['_error', '_info']:
-				continue
-			out.append('%s: %s' % (k,v))
+		if self._fields is not None:
+			for k,v in self._fields.items():
+				out.append('%s: %s' % (k,v))
 		return '\n'.join(out)
 
 	def set_error(self, value, info=''):
 		'''Sets the error value of the object'''
-		self._fields['_error'] = value
-		self._fields['_info'] = info
+		self._error = value
+		self._info = info
 		return self
 
 	def error(self) -> str:
 		'''Gets the error value of the object'''
-		return self._fields['_error']
+		return self._error
 
-	def fields(self) -> list:
-		'''Returns a list of the attached data fields in the object'''
-		out = self._fields
-		del out['_error']
-		del out['_info']
-		return out
+	def fields(self) -> dict:
+		'''Returns a dictionary of the attached data fields in the object'''
+		if self._fields is None:
+			return dict()
+		return self._fields.copy()
 
 	def set_info(self, value):
 		'''Sets the extra error information of the object.'''
-		self._fields['_info'] = value
+		self._info = value
 		return self
 
 	def info(self) -> str:
 		'''Gets the error value of the object'''
-		return self._fields['_info']
+		return self._info
 
 	def set_value(self, name: str, value):
 		'''Adds a field to the object'''
 		if name == '_error':
 			return False
 		
-		self._fields[name] = value
+		if name == '_info':
+			self._info = value
+		elif self._fields is None:
+			self._fields = { name:value }
+		else:
+			self._fields[name] = value
 		return self
 
 	def set_values(self, values: dict):
 		'''Adds multiple dictionary fields to the object.'''
-		for k,v in values.items():
+		for k in values:
 			if k in [ '_error', '_info' ]:
 				return False
-			self._fields[k] = v
+		
+		if self._fields is None:
+			self._fields = dict(values)
+		else:
+			self._fields.update(values)
 		return self
 	
 	def has_value(self, s: str) -> bool:
 		'''Tests if a specific value field has been returned'''
-		return s in self._fields
+		return s in self
 	
 	def empty(self):
 		'''Empties the object of all values and clears any errors'''
-		self._fields = { '_error':OK, '_info':'' }
+		self._error = OK
+		self._info = ''
+		self._fields = None
 		return self
 
 	def count(self) -> int:
 		'''Returns the number of values contained by the return value'''
-		return len(self._fields) - 2
-	
\ No newline at end of file
+		if self._fields is None:
+			return 0
+		return len(self._fields)
@@ -3,28 +3,27 @@
 import json
 import socket
 
-import jsonschema
-
-
+from pyanselus.framing import FrameBuffer, MessageTooLarge, MAX_FRAME_SIZE
 from pyanselus.retval import RetVal, ExceptionThrown, NetworkError, \
 	ResourceNotFound
 import pyanselus.rpc_schemas
+from pyanselus.validation import validate as validate_schema
 
 InvalidJSON = 'InvalidJSON'
 InvalidMessage = 'InvalidMessage'
-MessageTooLarge = 'MessageTooLarge'
 
 # Number of seconds to wait for a client before timing out
 CONN_TIMEOUT = 900.0
 
-# Size (in bytes) of the read buffer size for recv()
-READ_BUFFER_SIZE = 8192
-
 class ServerConnection:
 	'''Represents a connection to an Anselus server'''
 	
-	def __init__(self):
+	def __init__(self, max_frame_size=MAX_FRAME_SIZE, validate=True):
+		'''Messages are checked against their schemas unless validate is False, which 
+		saves the work for trusted, high-throughput connections.'''
 		self.__sock = None
+		self.__framer = FrameBuffer(max_frame_size)
+		self.validate = validate
 		self.ip = None
 		self.port = None
 		self.version = ''
@@ -48,6 +47,7 @@ class ServerConnection:
 			self.disconnect()
 			return RetVal(ResourceNotFound, "Couldn't locate host %s" % host)
 		
+		self.__framer.clear()
 		try:
 			self.__sock.connect((self.ip, port))
 			self.port = port
@@ -67,8 +67,10 @@ class ServerConnection:
 
 	def disconnect(self):
 		'''Disconnects from a server'''
-		self.__sock.close()
+		if self.__sock:
+			self.__sock.close()
 		self.__sock = None
+		self.__framer.clear()
 		self.ip = None
 		self.port = None
 
@@ -78,14 +80,15 @@ class ServerConnection:
 		if not self.__sock:
 			return RetVal(NetworkError, 'No connection')
 		
-		try:
-			rawdata = self.__sock.recv(READ_BUFFER_SIZE)
-		except Exception as exc:
-			self.__sock.close()
-			return RetVal(ExceptionThrown, exc.__str__())
+		# The rest of an oversized or partly-read message may still arrive and would be parsed as 
+		# garbage, so any framing error ends the connection
+		status = self.__framer.read_frame(self.__sock)
+		if status.error():
+			self.disconnect()
+			return RetVal(status.error(), str(status.info()))
 		
 		try:
-			rawstring = rawdata.decode()
+			rawstring = status['frame'].decode()
 		except Exception as exc:
 			return RetVal(ExceptionThrown, exc.__str__())
 		
@@ -94,9 +97,9 @@ class ServerConnection:
 		except Exception as exc:
 			return RetVal(InvalidJSON, exc.__str__())
 		
-		if schema:
+		if schema and self.validate:
 			try:
-				jsonschema.validate(msg, schema)
+				validate_schema(msg, schema)
 			except Exception as exc:
 				return RetVal(InvalidMessage, exc.__str__())
 		
@@ -115,11 +118,13 @@ class ServerConnection:
 			self.disconnect()
 			return RetVal(ExceptionThrown, exc.__str__())
 		
-		if len(jsonstr) > READ_BUFFER_SIZE:
-			return RetVal(MessageTooLarge, "Message is larger than 8K")
+		rawdata = jsonstr.encode()
+		if len(rawdata) > self.__framer.max_frame_size:
+			return RetVal(MessageTooLarge,
+				f"Message is larger than {self.__framer.max_frame_size} bytes")
 		
 		try:
-			self.__sock.send(jsonstr.encode())
+			self.__sock.sendall(rawdata)
 		except Exception as exc:
 			self.disconnect()
 			return RetVal(ExceptionThrown, exc.__str__())
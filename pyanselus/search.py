@@ -0,0 +1,134 @@
+'''This module provides full-text search of messages and notes in a profile database using the
+SQLite FTS5 indexes created by the schema migrations. The indexes are kept up to date by
+triggers, so searching needs nothing more than a query. If the SQLite library lacks FTS5, the
+indexes don't exist and the functions here return SearchUnavailable.'''
+
+import sqlite3
+
+from pyanselus.migrations import has_search_indexes
+from pyanselus.retval import RetVal, BadParameterValue, ExceptionThrown
+
+SearchUnavailable = 'SearchUnavailable'
+
+# Relative weights of the indexed columns used in ranking. A match in a subject or title counts
+# for more than one in a body.
+MESSAGE_WEIGHTS = (10.0, 1.0)
+NOTE_WEIGHTS = (10.0, 1.0)
+
+# Tables which can be searched, mapped to their index and indexed columns
+__search_tables = {
+	'messages' : ('messages_fts', ('subject', 'body')),
+	'notes' : ('notes_fts', ('title', 'body')),
+}
+
+def is_available(db: sqlite3.Connection) -> bool:
+	'''Returns whether the database can be searched'''
+	return has_search_indexes(db)
+
+
+def make_query(text: str) -> str:
+	'''Turns text typed by a user into an FTS5 query which matches items containing all of the
+	words in it, treating the last word as a prefix so that searches work while typing. Quotes
+	keep punctuation in the text from being read as query syntax.'''
+	words = [ '"' + x.replace('"', '""') + '"' for x in text.split() ]
+	if words:
+		words[-1] = words[-1] + '*'
+	return ' '.join(words)
+
+
+def search_messages(db: sqlite3.Connection, text: str, address='', limit=50, offset=0,
+	raw=False) -> RetVal:
+	'''Searches the subject and body of messages, optionally limited to one workspace address. By
+	default the text is treated as words to look for. If raw is True, it is passed to FTS5 as a
+	query. Results are returned best match first in the field 'results' as a list of
+	dictionaries containing 'id', 'subject', 'snippet', and 'rank'.'''
+	status = _search(db, 'messages', text, address, limit, offset, raw, MESSAGE_WEIGHTS)
+	if status.error():
+		return status
+
+	return RetVal().set_value('results', [
+		{ 'id' : x[0], 'subject' : x[1], 'snippet' : x[2], 'rank' : x[3] }
+		for x in status['rows']
+	])
+
+
+def search_notes(db: sqlite3.Connection, text: str, address='', limit=50, offset=0,
+	raw=False) -> RetVal:
+	'''Searches the title and body of notes in the same way as search_messages(). Results are
+	returned in the field 'results' as a list of dictionaries containing 'id', 'title',
+	'snippet', and 'rank'.'''
+	status = _search(db, 'notes', text, address, limit, offset, raw, NOTE_WEIGHTS)
+	if status.error():
+		return status
+
+	return RetVal().set_value('results', [
+		{ 'id' : x[0], 'title' : x[1], 'snippet' : x[2], 'rank' : x[3] }
+		for x in status['rows']
+	])
+
+
+def optimize(db: sqlite3.Connection, pages=0) -> RetVal:
+	'''Merges the segments of the search indexes, which makes queries faster after many changes.
+	If pages is 0, each index is fully optimized in one go. Otherwise, up to about that many
+	pages are merged per index, so the work can be spread out over idle time.'''
+	try:
+		for table, _ in __search_tables.values():
+			if pages:
+				db.execute(f"INSERT INTO {table}({table},rank) VALUES('merge',?)", (pages,))
+			else:
+				db.execute(f"INSERT INTO {table}({table}) VALUES('optimize')")
+		db.commit()
+	except sqlite3.Error as e:
+		return _search_error(db, ExceptionThrown, e)
+	return RetVal()
+
+
+def rebuild(db: sqlite3.Connection) -> RetVal:
+	'''Rebuilds the search indexes from scratch. This is only needed if the indexed tables have
+	been changed with the triggers disabled or their rowids have changed, as VACUUM may do.'''
+	try:
+		for table, _ in __search_tables.values():
+			db.execute(f"INSERT INTO {table}({table}) VALUES('rebuild')")
+		db.commit()
+	except sqlite3.Error as e:
+		return _search_error(db, ExceptionThrown, e)
+	return RetVal()
+
+
+def _search(db: sqlite3.Connection, source: str, text: str, address: str, limit: int,
+	offset: int, raw: bool, weights: tuple) -> RetVal:
+	'''Runs a ranked query against a search index and returns the rows in the field 'rows' as
+	tuples of (id, first indexed column, snippet, rank)'''
+	if not text or not text.strip():
+		return RetVal(BadParameterValue, 'search text may not be empty')
+
+	if limit < 1 or offset < 0:
+		return RetVal(BadParameterValue, 'bad limit or offset')
+
+	table, columns = __search_tables[source]
+	query = text if raw else make_query(text)
+	sqlcmd = f'''SELECT {source}.id, {source}."{columns[0]}",
+			snippet({table}, -1, '[', ']', '...', 12), bm25({table}, ?, ?) AS score
+		FROM {table} JOIN {source} ON {source}.rowid = {table}.rowid
+		WHERE {table} MATCH ?'''
+	params = list(weights) + [query]
+	if address:
+		sqlcmd = sqlcmd + f" AND {source}.address=?"
+		params.append(address)
+	sqlcmd = sqlcmd + " ORDER BY score LIMIT ? OFFSET ?"
+	params.extend([limit, offset])
+
+	try:
+		rows = db.execute(sqlcmd, params).fetchall()
+	except sqlite3.OperationalError as e:
+		return _search_error(db, BadParameterValue, e)
+
+	return RetVal().set_value('rows', rows)
+
+
+def _search_error(db: sqlite3.Connection, error: str, e: Exception) -> RetVal:
+	'''Returns SearchUnavailable if a query failed because the database has no search indexes and
+	the error given otherwise. Checking only after a failure keeps the check off the normal path.'''
+	if not has_search_indexes(db):
+		return RetVal(SearchUnavailable, 'full-text search is not available')
+	return RetVal(error, str(e))
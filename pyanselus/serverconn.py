@@ -2,55 +2,56 @@
 communications. Commands largely map 1-to-1 to the commands outlined in the 
 spec.'''
 
-from base64 import b85encode
 import json
-import re
-import secrets
+import os
+import select
 import socket
 import time
 import uuid
 
-import jsonschema
-
+import pyanselus.commands as commands
+# These were defined here before the commands module was split out and can still be used from here
+from pyanselus.commands import AnsBadRequest, server_response, wrap_server_error
 from pyanselus.cryptostring import CryptoString
-from pyanselus.encryption import DecryptionFailure, EncryptionPair, PublicKey, SigningPair
+from pyanselus.encryption import DecryptionFailure, EncryptionPair, SigningPair
+from pyanselus.framing import FrameBuffer, MAX_FRAME_SIZE
 from pyanselus.keycard import EntryBase
 from pyanselus.retval import RetVal, BadParameterValue, ExceptionThrown, NetworkError, \
-	ResourceExists, ServerError
-import pyanselus.utils as utils
-
-AnsBadRequest = '400-BadRequest'
-
-server_response = {
-	'title' : 'Anselus Server Response',
-	'type' : 'object',
-	'required' : [ 'Code', 'Status', 'Data' ],
-	'properties' : {
-		'Code' : {
-			'type' : 'integer'
-		},
-		'Status' : {
-			'type' : 'string'
-		},
-		'Data' : {
-			'type' : 'object'
-		}
-	}
-}
+	ServerError
+import pyanselus.metrics as metrics
+import pyanselus.wire as wire
 
 # Number of seconds to wait for a client before timing out
 CONN_TIMEOUT = 900.0
 
-# Size (in bytes) of the read buffer size for recv()
-READ_BUFFER_SIZE = 8192
+# Maximum number of requests sent by pipeline() before it stops to read the responses. Without a
+# limit, a big enough batch fills the socket buffers in both directions and deadlocks.
+PIPELINE_WINDOW = 100
+
+# Size of the pieces files are sent and received in by upload() and download(). Progress is
+# reported after each one.
+TRANSFER_CHUNK_SIZE = 1024 * 1024
 
 class ServerConnection:
 	'''Mini class to simplify network communications'''
-	def __init__(self):
+	def __init__(self, max_frame_size=MAX_FRAME_SIZE, validate=True):
+		'''Server responses are checked against their schemas unless validate is False, which 
+		saves the work for trusted, high-throughput connections.'''
 		self.socket = None
-	
-	def connect(self, address: str, port: int) -> RetVal:
-		'''Creates a connection to the server.'''
+		self.framer = FrameBuffer(max_frame_size)
+		self.validate = validate
+		self.codec = wire.JSONCodec
+
+		# Totals for the life of the object, including data sent and received by upload() and
+		# download()
+		self.bytes_sent = 0
+		self.bytes_received = 0
+	
+	def connect(self, address: str, port: int, encodings=None) -> RetVal:
+		'''Creates a connection to the server. If the server's greeting lists the encodings it 
+		supports, the first one in encodings which the server also supports is used for the rest 
+		of the session, unless the server refuses to switch, in which case JSON is kept. encodings 
+		defaults to wire.supported_encodings(). Pass [ 'json' ] to always use JSON.'''
 		try:
 			sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 			# Set a short timeout in case the server doesn't respond immediately,
@@ -59,11 +60,16 @@ class ServerConnection:
 		except Exception as e:
 			return RetVal(ExceptionThrown, e)
 		
+		self.framer = wire.JSONCodec.make_framer(self.framer.max_frame_size)
+		self.codec = wire.JSONCodec
 		try:
 			sock.connect((address, port))
 			
 			# absorb the hello string
-			_ = sock.recv(8192)
+			status = self.__read_frame(sock)
+			if status.error():
+				sock.close()
+				return status
 
 		except Exception as e:
 			sock.close()
@@ -73,64 +79,204 @@ class ServerConnection:
 		sock.settimeout(1800.0)
 		
 		self.socket = sock
+
+		try:
+			greeting = json.loads(status['frame'])
+		except ValueError:
+			greeting = dict()
+		
+		encoding = wire.choose_encoding(greeting.get('Encodings') if isinstance(greeting, dict) \
+			else None, encodings)
+		if encoding != wire.ENCODING_JSON:
+			# If the server refuses, both sides are still using JSON and the session can go on. 
+			# After any other failure, it isn't clear which encoding the server is using.
+			status = self.set_encoding(encoding)
+			if status.error() and status.error() != ServerError:
+				self.close()
+				return status
+		return RetVal()
+
+	def set_encoding(self, encoding: str) -> RetVal:
+		'''Asks the server to switch to another encoding and switches this side of the connection 
+		if it agrees. Both sides switch right after the server's response.'''
+		status = wire.get_codec(encoding)
+		if status.error():
+			return status
+		codec = status['codec']
+		
+		status = self.send_message({'Action':'ENCODING','Data':{'Encoding':encoding}})
+		if status.error():
+			return status
+		
+		status = self.read_response(server_response)
+		if status.error():
+			return status
+		
+		if status['Code'] != 200:
+			return wrap_server_error(status)
+		
+		# Anything already received after the response is in the new encoding
+		framer = codec.make_framer(self.framer.max_frame_size)
+		framer.feed(bytes(self.framer.buffer))
+		self.framer = framer
+		self.codec = codec
 		return RetVal()
 
 	def is_connected(self) -> bool:
 		'''Returns whether or not the instance is connected to a server'''
-		return bool(self.socket is None)
+		return self.socket is not None
+
+	def is_alive(self) -> bool:
+		'''Checks without blocking that the connection has not been closed by the server and that 
+		there is no unread data left over from a previous command'''
+		if not self.socket or len(self.framer):
+			return False
+		
+		# An idle connection should have nothing to read. If it does, either the server closed the 
+		# connection or it sent something nobody asked for.
+		try:
+			readable, _, _ = select.select([self.socket], [], [], 0)
+		except Exception:
+			return False
+		
+		return not readable
+
+	def close(self):
+		'''Closes the connection without notifying the server'''
+		if self.socket:
+			self.socket.close()
+			self.socket = None
+		self.framer.clear()
 
 	def disconnect(self) -> RetVal:
 		'''Disconnects by sending a QUIT command to the server'''
-		return self.send_message({'Action':'QUIT','Data':{}})
+		status = self.send_message({'Action':'QUIT','Data':{}})
+		self.close()
+		return status
 
 	def send_message(self, command : dict) -> RetVal:
-		'''Sends a message to the server with command sent as JSON data'''
-		cmdstr = json.dumps(command) + '\r\n'
+		'''Sends a message to the server in the connection's encoding'''
+		if not self.socket:
+			return RetVal(NetworkError, 'not connected')
 		
+		try:
+			data = self.codec.encode(command)
+			self.socket.sendall(data)
+		except Exception as e:
+			self.close()
+			return RetVal(ExceptionThrown, e)
+		
+		self.__count_sent(len(data))
+		return RetVal()
+
+	def send_messages(self, commands : list) -> RetVal:
+		'''Sends several messages to the server in a single write'''
 		if not self.socket:
 			return RetVal(NetworkError, 'not connected')
 		
 		try:
-			self.socket.send(cmdstr.encode())
+			data = b''.join([self.codec.encode(x) for x in commands])
+			self.socket.sendall(data)
 		except Exception as e:
-			self.socket.close()
+			self.close()
 			return RetVal(ExceptionThrown, e)
 		
+		self.__count_sent(len(data))
 		return RetVal()
 
 	def read_response(self, schema: dict) -> RetVal:
 		'''Reads a server response and returns a separated code and string'''
 		
 		if not self.socket:
-			return None
+			return RetVal(NetworkError, 'not connected')
 		
-		# We don't actually handle the possible exceptions because we *want* to have them crash --
-		# the test will fail and give us the cause of the exception. If we have a successful test, 
-		# exceptions weren't thrown
-		try:
-			rawdata = self.socket.recv(8192)
-			rawstring = rawdata.decode()
-			rawresponse = json.loads(rawstring)
-			if schema:
-				jsonschema.validate(rawresponse, schema)
-		except Exception as e:
-			return RetVal(ExceptionThrown, e)
+		# After a framing error, the rest of a partly-read message may still be on its way and 
+		# would be mistaken for the next response, so the connection can't be used any more
+		status = self.__read_frame(self.socket)
+		if status.error():
+			self.close()
+			return status
 
-		response = RetVal()
-		response['Code'] = rawresponse['Code']
-		response['Status'] = rawresponse['Status']
-		response['Info'] = rawresponse['Info']
-		response['Data'] = rawresponse['Data']
-		return response
+		return commands.parse_response(self.codec, status['frame'],
+			schema if self.validate else None)
 	
+	def send_file(self, fhandle, offset: int, count: int, progress=None) -> RetVal:
+		'''Sends count bytes of a file opened in binary mode, starting at offset, as raw data. 
+		socket.sendfile() is used, so the data is copied by the kernel where possible. 
+		progress(sent, count) is called after each chunk. The number of bytes sent is returned 
+		in the field 'sent', even on failure.'''
+		if not self.socket:
+			return RetVal(NetworkError, 'not connected').set_value('sent', 0)
+		
+		sent = 0
+		while sent < count:
+			try:
+				chunk = self.socket.sendfile(fhandle, offset + sent,
+					min(TRANSFER_CHUNK_SIZE, count - sent))
+			except Exception as e:
+				self.close()
+				return RetVal(NetworkError, str(e)).set_value('sent', sent)
+			
+			if not chunk:
+				self.close()
+				return RetVal(NetworkError, 'file ended early').set_value('sent', sent)
+			
+			sent = sent + chunk
+			self.__count_sent(chunk)
+			if progress:
+				progress(sent, count)
+		
+		return RetVal().set_value('sent', sent)
+
+	def recv_file(self, fhandle, count: int, progress=None) -> RetVal:
+		'''Receives count bytes of raw data and writes them to a file opened in binary mode. 
+		progress(received, count) is called after each chunk. The number of bytes received is 
+		returned in the field 'received', even on failure.'''
+		if not self.socket:
+			return RetVal(NetworkError, 'not connected').set_value('received', 0)
+		
+		# Data which arrived along with the last response is already in the frame buffer
+		received = min(len(self.framer.buffer), count)
+		if received:
+			fhandle.write(self.framer.buffer[:received])
+			del self.framer.buffer[:received]
+			if progress:
+				progress(received, count)
+		
+		buffer = bytearray(TRANSFER_CHUNK_SIZE)
+		view = memoryview(buffer)
+		while received < count:
+			try:
+				chunk = self.socket.recv_into(view, min(TRANSFER_CHUNK_SIZE, count - received))
+			except Exception as e:
+				self.close()
+				return RetVal(NetworkError, str(e)).set_value('received', received)
+			
+			if not chunk:
+				self.close()
+				return RetVal(NetworkError, 'connection closed by peer') \
+					.set_value('received', received)
+			
+			fhandle.write(view[:chunk])
+			received = received + chunk
+			self.__count_received(chunk)
+			if progress:
+				progress(received, count)
+		
+		return RetVal().set_value('received', received)
+
 	def read(self) -> str:
-		'''Reads a string from the network connection'''
+		'''Reads a string from the network connection. This is only meaningful while the 
+		connection uses JSON.'''
 		
 		if not self.socket:
 			return None
 		
-		rawdata = self.socket.recv(8192)
-		return rawdata.decode()
+		status = self.__read_frame(self.socket)
+		if status.error():
+			self.close()
+			return None
+		return status['frame'].decode()
 
 	def write(self, text: str) -> RetVal:
 		'''Sends a string over a socket'''
@@ -139,661 +285,454 @@ class ServerConnection:
 			return RetVal(NetworkError, 'Invalid connection')
 		
 		try:
-			self.socket.send(text.encode())
+			data = text.encode()
+			self.socket.sendall(data)
 		except Exception as exc:
-			self.socket.close()
+			self.close()
 			return RetVal(ExceptionThrown, exc.__str__())
 		
+		self.__count_sent(len(data))
 		return RetVal()
 
+	def __read_frame(self, sock: socket.socket) -> RetVal:
+		'''Reads the next message with the connection's framer and counts the bytes received'''
+		before = self.framer.bytes_received
+		status = self.framer.read_frame(sock)
+		self.__count_received(self.framer.bytes_received - before)
+		return status
 
-def wrap_server_error(response) -> RetVal:
-	'''Wraps a server response into a RetVal object'''
-	out = RetVal(ServerError, response['Status']).set_values({
-		'Code' : response['Code'],
-		'Status' : response['Status'],
-		'Info' : ''
-	})
-	
-	if 'Info' in response:
-		out['Info'] = response['Info']
-	
-	return out
+	def __count_sent(self, count: int):
+		'''Adds to the number of bytes sent'''
+		self.bytes_sent = self.bytes_sent + count
+		metrics.count(metrics.BYTES_SENT, count)
 
+	def __count_received(self, count: int):
+		'''Adds to the number of bytes received'''
+		self.bytes_received = self.bytes_received + count
+		metrics.count(metrics.BYTES_RECEIVED, count)
 
-def addentry(conn: ServerConnection, entry: EntryBase, ovkey: CryptoString,
-	spair: SigningPair) -> RetVal:
-	'''Handles the process to upload an entry to the server.'''
 
-	conn.send_message({
-		'Action' : "ADDENTRY",
-		'Data' : { 'Base-Entry' : entry.make_bytestring(0).decode() }
-	})
+def _exchange(conn: ServerConnection, command: dict, schema=server_response) -> RetVal:
+	'''Sends a message and returns the server's response. If sending fails, the error is returned 
+	instead.'''
+	status = conn.send_message(command)
+	if status.error():
+		return status
+	return conn.read_response(schema)
 
-	response = conn.read_response(server_response)
-	if response['Code'] != 100:
-		return wrap_server_error(response)
 
-	for field in ['Organization-Signature', 'Hash', 'Previous-Hash']	:
-		if field not in response['Data']:
-			return RetVal(ServerError, f"Server did not return required field {field}")
+@metrics.timed(metrics.COMMAND)
+def pipeline(conn: ServerConnection, requests: list, window=PIPELINE_WINDOW) -> RetVal:
+	'''Sends independent requests to the server back to back and then reads the responses, 
+	turning N round trips into about N / window. The requests must not depend on each other's 
+	results. On success, the field 'responses' contains the server responses in the same order as 
+	the requests. If a network error occurs partway through, the state of the session is unknown 
+	and the connection should be discarded.'''
+	return _pipeline(conn, requests, window)
 
-	entry.signatures['Organization'] =  response['Data']['Organization-Signature']
 
-	# A regular client will check the entry cache, pull updates to the org card, and get the 
-	# verification key. Because this is just an integration test, we skip all that and just use
-	# the known verification key from earlier in the test.
-	status = entry.verify_signature(ovkey, 'Organization')
-	if status.error():
-		return status
+def _pipeline(conn: ServerConnection, requests: list, window=PIPELINE_WINDOW) -> RetVal:
+	'''Untimed version of pipeline() for use by the timed commands built on it'''
+	if window < 1:
+		return RetVal(BadParameterValue, 'window must be positive')
 	
-	entry.prev_hash = response['Data']['Previous-Hash']
-	entry.hash = response['Data']['Hash']
-	status = entry.verify_hash()
-	if status.error():
-		return status
+	responses = list()
+	for start in range(0, len(requests), window):
+		batch = requests[start:start + window]
+		status = conn.send_messages(batch)
+		if status.error():
+			return status
+		
+		for _ in batch:
+			response = conn.read_response(server_response)
+			if response.error():
+				return response
+			responses.append(response)
 	
-	# User sign and verify
-	status = entry.sign(spair.private, 'User')
-	if status.error():
-		return status
+	return RetVal().set_value('responses', responses)
+
 
-	status = entry.verify_signature(spair.public, 'User')
+def _pipeline_results(conn: ServerConnection, requests: list, handler) -> RetVal:
+	'''Pipelines the requests which were built without error and returns the results of passing 
+	each response to handler. Requests which had errors keep their error in the results list.'''
+	status = _pipeline(conn, [x['request'] for x in requests if not x.error()])
 	if status.error():
 		return status
+	
+	responses = iter(status['responses'])
+	results = list()
+	for request in requests:
+		if request.error():
+			results.append(request)
+		else:
+			results.append(handler(next(responses)))
+	return RetVal().set_value('results', results)
+
 
-	status = entry.is_compliant()
+@metrics.timed(metrics.COMMAND)
+def addentry(conn: ServerConnection, entry: EntryBase, ovkey: CryptoString,
+	spair: SigningPair) -> RetVal:
+	'''Handles the process to upload an entry to the server.'''
+
+	response = _exchange(conn, commands.addentry_request(entry))
+	status = commands.addentry_sign(response, entry, ovkey, spair)
 	if status.error():
 		return status
 
-	conn.send_message({
-		'Action' : "ADDENTRY",
-		'Data' : { 'User-Signature' : entry.signatures['User'] }
-	})
-	
-	response = conn.read_response(server_response)
-	if response['Code'] != 200:
-		return wrap_server_error(response)
-
-	return RetVal()
+	return commands.check_response(_exchange(conn, status['request']), 200)
 
 
+@metrics.timed(metrics.COMMAND)
 def cancel(conn: ServerConnection):
 	'''Returns the session to a state where it is ready for the next command'''
-	conn.send_message({ 'Action' : "CANCEL", 'Data' : {}})
-	
-	response = conn.read_response(None)
-	if response.error():
-		return response
-	
-	if response['Code'] == 200:
-		return RetVal()
-	return wrap_server_error(response)
+	return commands.check_response(_exchange(conn, commands.cancel_request(), None), 200)
 
 
+@metrics.timed(metrics.COMMAND)
 def device(conn: ServerConnection, devid: str, devpair: EncryptionPair) -> RetVal:
 	'''Completes the login process by submitting device ID and its session string.'''
-	if not utils.validate_uuid(devid):
-		return RetVal(AnsBadRequest, 'Invalid device ID').set_value('status', 400)
-
-	conn.send_message({
-		'Action' : "DEVICE",
-		'Data' : { 
-			'Device-ID' : devid,
-			'Device-Key' : devpair.public.as_string()
-		}
-	})
+	status = commands.device_request(devid, devpair)
+	if status.error():
+		return status
 
 	# Receive, decrypt, and return the server challenge
-	response = conn.read_response(server_response)
-	if response.error():
-		return response
-	
-	if response['Code'] != 100:
-		return wrap_server_error(response)
-
-	if 'Challenge' not in response['Data']:
-		return RetVal(ServerError, 'server did not return a device challenge')
-	
-	status = devpair.decrypt(response['Data']['Challenge'])
+	status = commands.device_answer(_exchange(conn, status['request']), devid, devpair)
 	if status.error():
-		cancel(conn)
-		return RetVal(DecryptionFailure, 'failed to decrypt device challenge')
-
-	conn.send_message({
-		'Action' : "DEVICE",
-		'Data' : { 
-			'Device-ID' : devid,
-			'Device-Key' : devpair.public.as_string(),
-			'Response' : status['data']
-		}
-	})
+		if status.error() == DecryptionFailure:
+			_exchange(conn, commands.cancel_request(), None)
+		return status
 
-	response = conn.read_response(None)
-	if response.error():
-		return response
-	
-	if response['Code'] == 200:
-		return RetVal()
-	
-	return wrap_server_error(response)
+	return commands.check_response(_exchange(conn, status['request'], None), 200)
 
 
+@metrics.timed(metrics.COMMAND)
 def devkey(conn: ServerConnection, devid: str, oldpair: EncryptionPair, newpair: EncryptionPair):
 	'''Replaces the specified device's key stored on the server'''
-	if not utils.validate_uuid(devid):
-		return RetVal(AnsBadRequest, 'Invalid device ID').set_value('status', 400)
-
-	conn.send_message({
-		'Action' : "DEVKEY",
-		'Data' : { 
-			'Device-ID': devid,
-			'Old-Key': oldpair.public.as_string(),
-			'New-Key': newpair.public.as_string()
-		}
-	})
+	status = commands.devkey_request(devid, oldpair, newpair)
+	if status.error():
+		return status
 
 	# Receive, decrypt, and return the server challenge
-	response = conn.read_response(server_response)
-	if response.error():
-		return response
-	
-	if response['Code'] != 100:
-		return wrap_server_error(response)
-
-	if 'Challenge' not in response['Data'] or 'New-Challenge' not in response['Data']:
-		return RetVal(ServerError, 'server did not return both device challenges')
-	
-	status = oldpair.decrypt(response['Data']['Challenge'])
+	status = commands.devkey_answer(_exchange(conn, status['request']), oldpair, newpair)
 	if status.error():
-		cancel(conn)
-		return RetVal(DecryptionFailure, 'failed to decrypt device challenge for old key')
+		if status.error() == DecryptionFailure:
+			_exchange(conn, commands.cancel_request(), None)
+		return status
+
+	return commands.check_response(_exchange(conn, status['request'], None), 200)
+
 
+@metrics.timed(metrics.COMMAND)
+def download(conn: ServerConnection, serverpath: str, localpath: str, progress=None,
+	resume_id='') -> RetVal:
+	'''Downloads a file from the server, streaming it to localpath, which is overwritten. 
+	progress(received, total) is called as data arrives. On success, the size of the file is 
+	returned in the field 'size'.
+
+	The server hands out an ID for each download, which is returned in the field 'resume-id' 
+	even if the transfer fails. If the connection drops, NetworkError is returned and the partial 
+	file is kept. Calling download() again on a new connection with that ID requests only the rest 
+	of the file. The server only honors the ID if the file hasn't changed since, and otherwise 
+	sends the whole file again, so the local data is never mixed with another version.'''
+	if not serverpath or not localpath:
+		return RetVal(BadParameterValue, 'empty path')
+	
+	offset = 0
+	if resume_id and os.path.exists(localpath):
+		offset = os.path.getsize(localpath)
+	
 	request = {
-		'Action' : "DEVKEY",
-		'Data' : { 
-			'Response' : status['data']
+		'Action' : 'DOWNLOAD',
+		'Data' : {
+			'Path' : serverpath,
+			'Offset' : str(offset)
 		}
 	}
-
-	status = newpair.decrypt(response['Data']['New-Challenge'])
+	if offset:
+		request['Data']['Resume-ID'] = resume_id
+	
+	response = _exchange(conn, request)
+	status = commands.check_response(response, 100)
 	if status.error():
-		cancel(conn)
-		return RetVal(DecryptionFailure, 'failed to decrypt device challenge for new key')
-	request['Data']['New-Response'] = status['data']
-	conn.send_message(request)
-
-	response = conn.read_response(None)
-	if response.error():
-		return response
+		return status
 	
-	if response['Code'] == 200:
-		return RetVal()
+	resume_id = response['Data'].get('Resume-ID', '')
+	try:
+		size = int(response['Data']['Size'])
+		start = int(response['Data'].get('Offset', 0))
+	except (KeyError, ValueError):
+		conn.close()
+		return RetVal(ServerError, 'bad file size from server')
+	
+	# The server starts over from the beginning unless it accepted the resume ID
+	if start not in (0, offset) or start > size:
+		conn.close()
+		return RetVal(ServerError, 'bad download offset from server')
+	
+	try:
+		with open(localpath, 'ab' if start else 'wb') as fhandle:
+			status = conn.recv_file(fhandle, size - start,
+				(lambda done, _: progress(start + done, size)) if progress else None)
+	except Exception as e:
+		conn.close()
+		return RetVal(ExceptionThrown, str(e)).set_value('resume-id', resume_id)
 	
-	return wrap_server_error(response)
-
-
+	if status.error():
+		return status.set_value('resume-id', resume_id)
+	
+	return RetVal().set_values({
+		'size' : size,
+		'resume-id' : resume_id
+	})
 
 
+@metrics.timed(metrics.COMMAND)
 def exists(conn: ServerConnection, path: str) -> RetVal:
 	'''Checks to see if a path exists on the server side.'''
-	if not path: 
+	if not path:
 		return RetVal().set_value('exists', False)
-	
-	status = conn.send_message({
-		'Action' : 'EXISTS',
-		'Data' : {
-			'Path' : path
-		}})
+
+	return commands.exists_result(_exchange(conn, commands.exists_request(path)))
+
+
+@metrics.timed(metrics.COMMAND)
+def exists_many(conn: ServerConnection, paths: list) -> RetVal:
+	'''Pipelined version of exists() which checks a list of paths in roughly one round trip. The 
+	field 'results' contains a list of exists() return values in the same order as paths.'''
+	requests = [None if not x else commands.exists_request(x) for x in paths]
+	status = _pipeline(conn, [x for x in requests if x])
 	if status.error():
 		return status
 	
-	response = conn.read_response()
-	if response.error():
-		return response
-	
-	if response['Code'] == 200:
-		return RetVal().set_value('exists', True)
-	
-	return RetVal().set_value('exists', True)
+	responses = iter(status['responses'])
+	results = list()
+	for request in requests:
+		if request:
+			results.append(commands.exists_result(next(responses)))
+		else:
+			results.append(RetVal().set_value('exists', False))
+	return RetVal().set_value('results', results)
 
 
+@metrics.timed(metrics.COMMAND)
 def getwid(conn: ServerConnection, uid: str, domain: str) -> RetVal:
 	'''Looks up a wid based on the specified user ID and optional domain'''
 
-	if re.findall(r'[\\\/\s"]', uid) or len(uid) >= 64:
-		return RetVal(BadParameterValue, 'user id')
-	
-	if domain:
-		m = re.match(r'([a-zA-Z0-9]+\.)+[a-zA-Z0-9]+', domain)
-		if not m or len(domain) >= 64:
-			return RetVal(BadParameterValue, 'bad domain value')
-	
-	request = {
-		'Action' : 'GETWID',
-		'Data' : {
-			'User-ID': uid
-		}
-	}
-	if domain:
-		request['Data']['Domain'] = domain
-	
-	status = conn.send_message(request)
+	status = commands.getwid_request(uid, domain)
 	if status.error():
 		return status
-	
-	response = conn.read_response(server_response)
-	if response.error():
-		return response
-	
-	if response['Code'] != 200:
-		return wrap_server_error(response)
-	
-	return RetVal().set_value('Workspace-ID', response['Data']['Workspace-ID'])
 
+	return commands.getwid_result(_exchange(conn, status['request']))
+
+
+@metrics.timed(metrics.COMMAND)
+def getwid_many(conn: ServerConnection, uids: list, domain: str) -> RetVal:
+	'''Pipelined version of getwid() for resolving many user IDs in the same domain in roughly one 
+	round trip. The field 'results' contains a list of getwid() return values in the same order as 
+	uids. A user ID which fails validation gets an error in its slot and is not sent.'''
+	requests = [commands.getwid_request(x, domain) for x in uids]
+	return _pipeline_results(conn, requests, commands.getwid_result)
 
+
+@metrics.timed(metrics.COMMAND)
 def iscurrent(conn: ServerConnection, index: int, wid='') -> RetVal:
-	'''Finds out if an entry index is current. If wid is empty, the index is checked for the 
+	'''Finds out if an entry index is current. If wid is empty, the index is checked for the
 	organization.'''
-	if wid and not utils.validate_uuid(wid):
-		return RetVal(AnsBadRequest).set_value('status', 400)
-	
-	request = {
-		'Action' : 'ISCURRENT',
-		'Data' : {
-			'Index' : str(index)
-		}
-	}
-	if wid:
-		request['Data']['Workspace-ID'] = wid
-	conn.send_message(request)
+	status = commands.iscurrent_request(index, wid)
+	if status.error():
+		return status
 
-	response = conn.read_response(server_response)
-	if response.error():
-		return response
-	
-	if response['Code'] != 200:
-		return wrap_server_error(response)
-	
-	if 'Is-Current' not in response['Data']:
-		return RetVal(ServerError, 'server did not return an answer')
-	
-	return RetVal().set_value('iscurrent', bool(response['Data']['Is-Current'] == 'YES'))
+	return commands.iscurrent_result(_exchange(conn, status['request']))
+
+
+@metrics.timed(metrics.COMMAND)
+def iscurrent_many(conn: ServerConnection, entries: list) -> RetVal:
+	'''Pipelined version of iscurrent(). entries is a list of (index, wid) tuples, where wid may 
+	be empty to check the organization's card. The field 'results' contains a list of iscurrent() 
+	return values in the same order as entries.'''
+	requests = [commands.iscurrent_request(index, wid) for index, wid in entries]
+	return _pipeline_results(conn, requests, commands.iscurrent_result)
 
 
+@metrics.timed(metrics.COMMAND)
 def login(conn: ServerConnection, wid: str, serverkey: CryptoString) -> RetVal:
 	'''Starts the login process by sending the requested workspace ID.'''
-	if not utils.validate_uuid(wid):
-		return RetVal(BadParameterValue)
-
-	challenge = b85encode(secrets.token_bytes(32))
-	ekey = PublicKey(serverkey)
-	status = ekey.encrypt(challenge)
+	status = commands.login_request(wid, serverkey)
 	if status.error():
 		return status
 
-	conn.send_message({
-		'Action' : "LOGIN",
-		'Data' : {
-			'Workspace-ID' : wid,
-			'Login-Type' : 'PLAIN',
-			'Challenge' : status['data']
-		}
-	})
-
-	response = conn.read_response(server_response)
-	if response.error():
-		return response
-	
-	if response['Code'] != 100:
-		return wrap_server_error(response)
-	
-	if response['Data']['Response'] != challenge.decode():
-		return RetVal(ServerError, 'server failed to decrypt challenge')
-	
-	return RetVal()
+	return commands.login_result(_exchange(conn, status['request']), status['challenge'])
 
 
+@metrics.timed(metrics.COMMAND)
 def logout(conn: ServerConnection) -> RetVal:
 	'''Starts the login process by sending the requested workspace ID.'''
-	status = conn.send_message({'Action':'LOGOUT', 'Data':{}})
-	if status.error():
-		return wrap_server_error(status)
-	
-	response = conn.read_response(server_response)
-	if response['Code'] != 200:
-		return wrap_server_error(response)
-	
-	return RetVal()
+	return commands.check_response(_exchange(conn, commands.logout_request()), 200)
 
 
+@metrics.timed(metrics.COMMAND)
 def passcode(conn: ServerConnection, wid: str, reset_code: str, pwhash: str) -> RetVal:
 	'''Resets a workspace's password'''
-
-	conn.send_message({
-		'Action': 'PASSCODE',
-		'Data': {
-			'Workspace-ID': wid,
-			'Reset-Code': reset_code,
-			'Password-Hash': pwhash
-		}
-	})
-	response = conn.read_response(server_response)
-	if response['Code'] != 200:
-		return wrap_server_error(response)
-	
-	return RetVal()
+	request = commands.passcode_request(wid, reset_code, pwhash)
+	return commands.check_response(_exchange(conn, request), 200)
 
 
+@metrics.timed(metrics.COMMAND)
 def password(conn: ServerConnection, wid: str, pwhash: str) -> RetVal:
 	'''Continues the login process sending a password hash to the server.'''
-	if not password or not utils.validate_uuid(wid):
-		return RetVal(BadParameterValue)
-	
-	conn.send_message({
-		'Action' : "PASSWORD",
-		'Data' : { 'Password-Hash' : pwhash }
-	})
+	status = commands.password_request(wid, pwhash)
+	if status.error():
+		return status
 
-	response = conn.read_response(server_response)
-	if response.error():
-		return response
-	
-	if response['Code'] != 100:
-		return wrap_server_error(response)
-	
-	return RetVal()
+	return commands.check_response(_exchange(conn, status['request']), 100)
 
 
+@metrics.timed(metrics.COMMAND)
 def preregister(conn: ServerConnection, wid: str, uid: str, domain: str) -> RetVal:
 	'''Provisions a preregistered account on the server.'''
-	request = { 'Action':'PREREG', 'Data':{} }
-	if wid:
-		request['Data']['Workspace-ID'] = wid
-	if uid:
-		request['Data']['User-ID'] = uid
-	if domain:
-		request['Data']['Domain'] = domain
+	request = commands.preregister_request(wid, uid, domain)
+	return commands.preregister_result(_exchange(conn, request))
 
-	status = conn.send_message(request)
-	if status.error():
-		return status
-	
-	response = conn.read_response(server_response)
-	if response.error():
-		return response
-	
-	if response['Code'] != 200:
-		return wrap_server_error(response)
 
-	out = RetVal()
-	
-	# Validate response fields
-	fields = { 'Domain':'domain', 'Workspace-ID':'wid', 'Reg-Code':'regcode' }
-	for k,v in fields.items():
-		if k in response['Data']:
-			if isinstance(response['Data'][k], str):
-				out[v] = response['Data'][k]
-			else:
-				out.set_error(ServerError, 'server returned incorrect data')
-		else:
-			out.set_error(ServerError, 'server did not return all required fields')
-	
-	if 'User-ID' in response['Data']:
-		if isinstance(response['Data']['User-ID'], str):
-			out['uid'] = response['Data']['User-ID']
-		else:
-			out.set_error(ServerError, 'server returned incorrect data')
-	
-	return out
-
-
-def regcode(conn: ServerConnection, regid: str, code: str, pwhash: str, devid: str, 
+@metrics.timed(metrics.COMMAND)
+def regcode(conn: ServerConnection, regid: str, code: str, pwhash: str, devid: str,
 	devpair: EncryptionPair, domain: str) -> RetVal:
 	'''Finishes registration of a workspace'''
-	
-	request = {
-		'Action':'REGCODE',
-		'Data':{
-			'Reg-Code': code,
-			'Password-Hash':pwhash,
-			'Device-ID':devid,
-			'Device-Key':devpair.public.as_string()
-		}
-	}
+	request = commands.regcode_request(regid, code, pwhash, devid, devpair, domain)
+	return commands.check_response(_exchange(conn, request), 201)
 
-	if domain:
-		request['Data']['Domain'] = domain
-
-	if utils.validate_uuid(regid):
-		request['Data']['Workspace-ID'] = regid
-	else:
-		request['Data']['User-ID'] = regid
-	
-	status = conn.send_message(request)
-	if status.error():
-		return status
-	
-	response = conn.read_response(server_response)
-	if response.error():
-		return response
-	
-	if response['Code'] != 201:
-		return wrap_server_error(response)
-	
-	return RetVal()
-	
 
+@metrics.timed(metrics.COMMAND)
 def register(conn: ServerConnection, uid: str, pwhash: str, devicekey: CryptoString) -> RetVal:
 	'''Creates an account on the server.'''
-	
-	if uid and len(re.findall(r'[\/" \s]',uid)) > 0:
-		return RetVal(BadParameterValue, 'user id contains illegal characters')
-		
+
 	# This construct is a little strange, but it is to work around the minute possibility that
 	# there is a WID collision, i.e. the WID generated by the client already exists on the server.
-	# In such an event, it should try again. However, in the ridiculously small chance that the 
-	# client keeps generating collisions, it should wait 3 seconds after 10 collisions to reduce 
+	# In such an event, it should try again. However, in the ridiculously small chance that the
+	# client keeps generating collisions, it should wait 3 seconds after 10 collisions to reduce
 	# server load.
-	out = RetVal()
 	devid = str(uuid.uuid4())
-	wid = ''
-	response = dict()
 	tries = 1
-	while not wid:
+	while True:
 		if not tries % 10:
 			time.sleep(3.0)
-		
-		# Technically, the active profile already has a WID, but it is not attached to a domain and
-		# doesn't matter as a result. Rather than adding complexity, we just generate a new UUID
-		# and always return the replacement value
-		wid = str(uuid.uuid4())
-		request = {
-			'Action' : 'REGISTER',
-			'Data' : {
-				'Workspace-ID' : wid,
-				'Password-Hash' : pwhash,
-				'Device-ID' : devid,
-				'Device-Key' : devicekey.as_string()
-			}
-		}
-		if uid:
-			request['Data']['User-ID'] = uid
 
-		status = conn.send_message(request)
+		status = commands.register_request(uid, pwhash, devid, devicekey)
 		if status.error():
 			return status
 
-		response = conn.read_response(server_response)
-		if response.error():
-			return response
-		
-		if response['Code'] in [ 101, 201]:		# Pending, Success
-			out.set_values({
-				'devid' : devid,
-				'wid' : wid,
-				'domain' : response['Data']['Domain'],
-				'uid' : uid
-			})
-			break
-		
-		if response['Code'] == 408:	# WID or UID exists
-			if 'Field' not in response['Data']:
-				return RetVal(ServerError, 'server sent 408 without telling what existed')
-			
-			if response['Data']['Field'] not in ['User-ID', 'Workspace-ID']:
-				return RetVal(ServerError, 'server sent bad 408 response').set_value( \
-					'Field', response['Data']['Field'])
-
-			if response['Data']['Field'] == 'User-ID':
-				return RetVal(ResourceExists, 'user id')
-			
-			tries = tries + 1
-			wid = ''
-		else:
-			# Something we didn't expect -- reg closed, payment req'd, etc.
-			return wrap_server_error(response)
-	
-	return out
+		status = commands.register_result(_exchange(conn, status['request']), status['request'])
+		if status.error() or not status.has_value('retry'):
+			return status
+		tries = tries + 1
 
 
+@metrics.timed(metrics.COMMAND)
 def reset_password(conn: ServerConnection, wid: str, reset_code='', expires='') -> RetVal:
 	'''Resets a workspace's password'''
-
-	conn.send_message({
-		'Action': 'RESETPASSWORD',
-		'Data': {
-			'Workspace-ID': wid,
-			'Reset-Code': reset_code,
-			'Expires': expires
-		}
-	})
-	response = conn.read_response(server_response)
-	if response['Code'] != 200:
-		return wrap_server_error(response)
-	
-	out = RetVal()
-	out['resetcode'] = response['Data']['Reset-Code']
-	out['expires'] = response['Data']['Expires']
-	return out
+	response = _exchange(conn, commands.reset_password_request(wid, reset_code, expires))
+	return commands.reset_password_result(response)
 
 
+@metrics.timed(metrics.COMMAND)
 def setpassword(conn: ServerConnection, pwhash: str, newpwhash: str) -> RetVal:
 	'''Changes the password for the workspace'''
-	
-	conn.send_message({
-		'Action' : 'SETPASSWORD',
-		'Data' : {
-			'Password-Hash': pwhash,
-			'NewPassword-Hash': newpwhash
-		}
-	})
-	response = conn.read_response(server_response)
-	if response['Code'] != 200:
-		return wrap_server_error(response)
-	
-	return RetVal()
+	request = commands.setpassword_request(pwhash, newpwhash)
+	return commands.check_response(_exchange(conn, request), 200)
 
 
+@metrics.timed(metrics.COMMAND)
 def setstatus(conn: ServerConnection, wid: str, status: str):
 	'''Sets the activity status of the workspace specified. Requires admin privileges'''
-	if status not in ['active', 'disabled', 'approved']:
-		return RetVal(BadParameterValue, "status must be 'active','disabled', or 'approved'")
-	
-	if not utils.validate_uuid(wid):
-		return RetVal(BadParameterValue, 'bad wid')
+	out = commands.setstatus_request(wid, status)
+	if out.error():
+		return out
 
-	conn.send_message({
-		'Action' : 'SETSTATUS',
-		'Data' : {
-			'Workspace-ID': wid,
-			'Status': status
-		}
-	})
-	response = conn.read_response(server_response)
-	if response['Code'] != 200:
-		return wrap_server_error(response)
-
-	return RetVal()
+	return commands.check_response(_exchange(conn, out['request']), 200)
 
 
+@metrics.timed(metrics.COMMAND)
 def unregister(conn: ServerConnection, pwhash: str, wid: str) -> RetVal:
 	'''Deletes the online account at the specified server.'''
+	status = commands.unregister_request(pwhash, wid)
+	if status.error():
+		return status
+
+	# This particular command is very simple: make a request, because the server will return
+	# one of three possible types of responses: success, pending (for private/moderated
+	# registration modes), or an error. In all of those cases there isn't anything else to do.
+	return commands.check_response(_exchange(conn, status['request']), 202)
+
 
-	if wid and not utils.validate_uuid(wid):
-		return RetVal(BadParameterValue, 'bad workspace id')
+@metrics.timed(metrics.COMMAND)
+def upload(conn: ServerConnection, path: str, serverpath: str, progress=None,
+	resume_id='') -> RetVal:
+	'''Uploads a file to the server path serverpath. The file is sent as raw data with 
+	socket.sendfile() in large chunks, so it is never read into memory as a whole, and 
+	progress(sent, total) is called after each chunk.
+
+	The server hands out an ID for each upload, which is returned in the field 'resume-id' even 
+	if the transfer fails. If the connection drops, calling upload() again on a new connection 
+	with that ID sends only the part of the file the server doesn't have yet. On success, the 
+	name the server gave the file is returned in the field 'name'.'''
+	if not path or not serverpath:
+		return RetVal(BadParameterValue, 'empty path')
+	
+	try:
+		size = os.path.getsize(path)
+	except Exception as e:
+		return RetVal(ExceptionThrown, str(e))
 	
 	request = {
-		'Action' : 'UNREGISTER',
+		'Action' : 'UPLOAD',
 		'Data' : {
-			'Password-Hash' : pwhash
+			'Size' : str(size),
+			'Path' : serverpath
 		}
 	}
-	if wid:
-		request['Data']['Workspace-ID'] = wid
+	if resume_id:
+		request['Data']['Resume-ID'] = resume_id
 	
 	status = conn.send_message(request)
 	if status.error():
 		return status
 	
 	response = conn.read_response(server_response)
-
-	if response['Code'] == 202:
-		return RetVal()
-
-	# This particular command is very simple: make a request, because the server will return
-	# one of three possible types of responses: success, pending (for private/moderated 
-	# registration modes), or an error. In all of those cases there isn't anything else to do.
-	return wrap_server_error(response)
-
-
-# pylint: disable=fixme
-# Disable the TODO listings embedded in the disabled code until it is properly rewritten
-
-# TODO: Refactor/update to match current spec
-# Upload
-#	Requires:	valid socket
-#				local path to file
-#				size of file to upload
-#				server path to requested destination
-#	Optional:	callback function for progress display
-#
-#	Returns: [dict] error code
-#				error string
-
-# def upload(conn: ServerConnection, path, serverpath, progress):
-# 	'''Upload a local file to the server.'''
-# 	chunk_size = 128
-
-# 	# Check to see if we're allowed to upload
-# 	filesize = os.path.getsize(path)
-# 	write_text(sock, "UPLOAD %s %s\r\n" % (filesize, serverpath))
-# 	response = read_text(sock)
-# 	if not response['string']:
-# 		# TODO: Properly handle no server response
-# 		raise "No response from server"
+	if response.error():
+		return response
 	
-# 	if response['string'].strip().split()[0] != 'PROCEED':
-# 		# TODO: Properly handle not being allowed
-# 		print("Unable to upload file. Server response: %s" % response)
-# 		return
-
-# 	try:
-# 		totalsent = 0
-# 		handle = open(path,'rb')
-# 		data = handle.read(chunk_size)
-# 		while data:
-# 			write_text(sock, "BINARY [%s/%s]\r\n" % (totalsent, filesize))
-# 			sent_size = sock.send(data)
-# 			totalsent = totalsent + sent_size
-
-# 			if progress:
-# 				progress(float(totalsent / filesize) * 100.0)
-
-# 			if sent_size < chunk_size:
-# 				break
-			
-# 			data = handle.read(chunk_size)
-# 		data.close()
-# 	except Exception as exc:
-# 		print("Failure uploading %s: %s" % (path, exc))
+	if response['Code'] != 100:
+		return wrap_server_error(response)
+	
+	resume_id = response['Data'].get('Resume-ID', '')
+	try:
+		offset = int(response['Data'].get('Offset', 0))
+	except ValueError:
+		offset = -1
+	if offset < 0 or offset > size:
+		conn.close()
+		return RetVal(ServerError, 'bad upload offset from server') \
+			.set_value('resume-id', resume_id)
+	
+	try:
+		with open(path, 'rb') as fhandle:
+			status = conn.send_file(fhandle, offset, size - offset,
+				(lambda done, _: progress(offset + done, size)) if progress else None)
+	except Exception as e:
+		conn.close()
+		return RetVal(ExceptionThrown, str(e)).set_value('resume-id', resume_id)
+	
+	if status.error():
+		return status.set_value('resume-id', resume_id)
+	
+	response = conn.read_response(server_response)
+	if response.error():
+		return response.set_value('resume-id', resume_id)
+	
+	if response['Code'] != 200:
+		return wrap_server_error(response).set_value('resume-id', resume_id)
+	
+	return RetVal().set_values({
+		'name' : response['Data'].get('File-Name', ''),
+		'resume-id' : resume_id
+	})
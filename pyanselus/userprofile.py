@@ -7,6 +7,8 @@ import shutil
 import sqlite3
 import uuid
 
+from pyanselus.dbconn import ConnectionManager
+from pyanselus.migrations import migrate
 from pyanselus.retval import RetVal, ResourceExists, ExceptionThrown, BadParameterValue, \
 		ResourceNotFound
 import pyanselus.utils as utils
@@ -28,6 +30,7 @@ class Profile:
 		self.domain = ''
 		self.port = 2001
 		self.db = None
+		self.dbman = None
 
 	def __str__(self):
 		return str(self.as_dict())
@@ -44,19 +47,29 @@ class Profile:
 		'''Returns the identity workspace address for the profile including port'''
 		return ':'.join([self.address(),self.port])
 	
-	def activate(self):
-		'''Connects the profile to its associated database'''
+	def activate(self) -> RetVal:
+		'''Connects the profile to its associated database, creating the database or upgrading its 
+		schema as needed'''
 		dbpath = os.path.join(self.path, 'storage.db')
-		if os.path.exists(dbpath):
-			self.db = sqlite3.connect(dbpath)
-		else:
-			self.reset_db()
+		if not os.path.exists(dbpath):
+			return self.reset_db()
+		
+		return self._open_db(dbpath)
 	
 	def deactivate(self):
 		'''Disconnects the profile from its associated database'''
-		if self.db:
-			self.db.close()
-			self.db = None
+		if self.dbman:
+			self.dbman.close()
+			self.dbman = None
+		self.db = None
+	
+	def get_db(self) -> sqlite3.Connection:
+		'''Returns the calling thread's connection to the profile database. The db property holds 
+		the connection of the thread which activated the profile, and other threads must use this 
+		method instead of sharing it.'''
+		if not self.dbman:
+			return None
+		return self.dbman.get()
 	
 	def as_dict(self) -> dict:
 		'''Returns the state of the profile as a dictionary'''
@@ -83,107 +96,40 @@ class Profile:
 		
 		return False
 
-	def reset_db(self) -> sqlite3.Connection:
-		'''This function reinitializes the database to empty, taking a path to the file used by the 
-		SQLite database. Returns a handle to an open SQLite3 connection.
+	def reset_db(self) -> RetVal:
+		'''This function reinitializes the database to empty, deleting all of its data. Use 
+		activate() to open an existing database, which upgrades its schema in place. On success, 
+		the open SQLite3 connection is returned in the field 'db'.
 		'''
 		if not os.path.exists(self.path):
 			os.mkdir(self.path)
 		
+		self.deactivate()
 		dbpath = os.path.join(self.path, 'storage.db')
-		if os.path.exists(dbpath):
-			try:
-				os.remove(dbpath)
-			except Exception as e:
-				print('Unable to delete old database %s: %s' % (dbpath, e))
-		
-		self.db = sqlite3.connect(dbpath)
-		cursor = self.db.cursor()
-
-		sqlcmds = [ '''
-			CREATE TABLE workspaces (
-				"wid" TEXT NOT NULL UNIQUE,
-				"userid" TEXT,
-				"domain" TEXT,
-				"password" TEXT,
-				"pwhashtype" TEXT,
-				"type" TEXT
-			);''', '''
-			CREATE table "folders"(
-				"fid" TEXT NOT NULL UNIQUE,
-				"address" TEXT NOT NULL,
-				"keyid" TEXT NOT NULL,
-				"path" TEXT NOT NULL,
-				"permissions" TEXT NOT NULL
-			);''', '''
-			CREATE table "sessions"(
-				"address" TEXT NOT NULL,
-				"devid" TEXT NOT NULL,
-				"devname" TEXT,
-				"enctype" TEXT NOT NULL,
-				"public_key" TEXT NOT NULL,
-				"private_key" TEXT NOT NULL
-			);''', '''
-			CREATE table "keys"(
-				"keyid" TEXT NOT NULL UNIQUE,
-				"address" TEXT NOT NULL,
-				"type" TEXT NOT NULL,
-				"category" TEXT NOT NULL,
-				"private" TEXT NOT NULL,
-				"public" TEXT,
-				"algorithm" TEXT NOT NULL
-			);''', '''
-			CREATE table "keycards"(
-				"fingerprint" TEXT NOT NULL UNIQUE,
-				"fptype" TEXT NOT NULL,
-				"cardtype" TEXT NOT NULL,
-				"carddata" TEXT NOT NULL,
-				"identity" TEXT NOT NULL,
-				"expires" TEXT NOT NULL
-			);''', '''
-			CREATE table "messages"(
-				"id" TEXT NOT NULL UNIQUE,
-				"from"  TEXT NOT NULL,
-				"address" TEXT NOT NULL,
-				"cc"  TEXT,
-				"bcc" TEXT,
-				"date" TEXT NOT NULL,
-				"thread_id" TEXT NOT NULL,
-				"subject" TEXT,
-				"body" TEXT,
-				"attachments" TEXT
-			);''', '''
-			CREATE TABLE "contacts" (
-				"id"	TEXT NOT NULL,
-				"sensitivity"	TEXT NOT NULL,
-				"source"	TEXT NOT NULL,
-				"fieldname"	TEXT,
-				"fieldvalue"	TEXT
-			);''', '''
-			CREATE TABLE "notes" (
-				"id"	TEXT NOT NULL UNIQUE,
-				"address" TEXT,
-				"title"	TEXT,
-				"body"	TEXT,
-				"notebook"	TEXT,
-				"tags"	TEXT,
-				"created"	TEXT NOT NULL,
-				"updated"	TEXT,
-				"attachments"	TEXT
-			);''', '''
-			CREATE TABLE "files" (
-				"id"	TEXT NOT NULL UNIQUE,
-				"name"	TEXT NOT NULL,
-				"type"	TEXT NOT NULL,
-				"path"	TEXT NOT NULL
-			);'''
-		]
-
-		for sqlcmd in sqlcmds:
-			cursor = self.db.cursor()
-			cursor.execute(sqlcmd)
-		self.db.commit()
-		return self.db
+		for path in [dbpath, dbpath + '-wal', dbpath + '-shm']:
+			if os.path.exists(path):
+				try:
+					os.remove(path)
+				except Exception as e:
+					return RetVal(ExceptionThrown, f"unable to delete old database {path}: {e}")
+		
+		return self._open_db(dbpath)
+
+	def _open_db(self, dbpath: str) -> RetVal:
+		'''Connects to the database at dbpath and brings its schema up to date. If either fails, 
+		the profile is left without a database. The connection is returned in the field 'db'.'''
+		self.dbman = ConnectionManager(dbpath)
+		try:
+			self.db = self.dbman.get()
+		except Exception as e:
+			self.deactivate()
+			return RetVal(ExceptionThrown, f"unable to open database {dbpath}: {e}")
+
+		status = migrate(self.db)
+		if status.error():
+			self.deactivate()
+			return status
+		return status.set_value('db', self.db)
 
 	def get_workspaces(self) -> list:
 		'''Returns a list containing all subscribed workspaces in the profile'''
@@ -395,7 +341,10 @@ class ProfileManager:
 		self.profiles[index].path = newpath
 		
 		if index == self.active_index:
-			self.profiles[index].activate()
+			status = self.profiles[index].activate()
+			if status.error():
+				self.active_index = -1
+				return status
 		
 		return self.save_profiles()
 	
@@ -469,8 +418,10 @@ class ProfileManager:
 		
 		self.profile_id = name_squashed
 
+		status = self.profiles[active_index].activate()
+		if status.error():
+			return status
 		self.active_index = active_index
-		self.profiles[self.active_index].activate()
 		
 		out = RetVal()
 		out.set_values({
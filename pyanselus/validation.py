@@ -0,0 +1,88 @@
+'''This module validates JSON data against schemas without the overhead of jsonschema.validate(),
+which checks the schema itself and builds a new validator on every call. Validators are built
+once per schema and cached. Schemas which describe a flat object, like the ones used for server
+responses and key files, get a hand-written check which is much faster than a full validator.'''
+
+import threading
+
+import jsonschema
+
+# Maps the id() of a schema to a (schema, validator, fast check) tuple. The schema itself is kept
+# so that its id can't be reused by another object while it is in the cache.
+__validators = dict()
+__validators_lock = threading.Lock()
+
+# Python types matching the JSON Schema types handled by the fast check
+__fast_types = {
+	'string' : str,
+	'integer' : int,
+	'number' : (int, float),
+	'object' : dict,
+	'array' : list,
+	'boolean' : bool,
+}
+
+# Keywords which the fast check handles or which don't affect validation
+__fast_keywords = set([ 'title', 'description', 'type', 'required', 'properties' ])
+
+def validate(instance, schema: dict):
+	'''Drop-in replacement for jsonschema.validate(). Raises jsonschema.ValidationError if the
+	instance doesn't match and jsonschema.SchemaError if the schema is invalid.'''
+	_, validator, fast_check = get_validator(schema)
+	if fast_check is not None and fast_check(instance):
+		return
+
+	# The full validator has the final word and produces a proper error message
+	validator.validate(instance)
+
+
+def get_validator(schema: dict) -> tuple:
+	'''Returns the cached (schema, validator, fast check) tuple for a schema, creating it if
+	needed. The fast check is None if the schema is too complex for one.'''
+	entry = __validators.get(id(schema))
+	if entry is not None and entry[0] is schema:
+		return entry
+
+	cls = jsonschema.validators.validator_for(schema)
+	cls.check_schema(schema)
+	entry = (schema, cls(schema), _make_fast_check(schema))
+	with __validators_lock:
+		__validators[id(schema)] = entry
+	return entry
+
+
+def _make_fast_check(schema: dict):
+	'''Returns a function which quickly checks an instance against an object schema with only
+	required and simply-typed properties, or None if the schema has anything else in it. The
+	function returns True only if the instance definitely matches. False means that the full
+	validator has to decide.'''
+	if set(schema.keys()) - __fast_keywords or schema.get('type') != 'object':
+		return None
+
+	required = tuple(schema.get('required', []))
+	types = list()
+	for name, prop in schema.get('properties', {}).items():
+		if not isinstance(prop, dict) or set(prop.keys()) - set([ 'type', 'title', 'description' ]):
+			return None
+		if 'type' not in prop:
+			continue
+		# Lists of types, such as [ 'string', 'null' ], are left to the full validator
+		if not isinstance(prop['type'], str) or prop['type'] not in __fast_types:
+			return None
+		types.append((name, __fast_types[prop['type']], prop['type'] in ['integer', 'number']))
+
+	def fast_check(instance) -> bool:
+		if not isinstance(instance, dict):
+			return False
+		for name in required:
+			if name not in instance:
+				return False
+		for name, pytype, is_numeric in types:
+			if name in instance:
+				value = instance[name]
+				# bool is a subclass of int in Python, but not a number in JSON
+				if not isinstance(value, pytype) or (is_numeric and isinstance(value, bool)):
+					return False
+		return True
+
+	return fast_check
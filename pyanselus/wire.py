@@ -0,0 +1,126 @@
+'''This module contains the codecs used to turn messages into bytes on the wire. JSON is always
+available and is what every connection starts with. If the msgpack package is installed and the
+server offers it in its greeting, a connection can switch to MessagePack, which carries keys,
+signatures, and other binary data as raw bytes instead of Base85 text.'''
+
+import base64
+import json
+import struct
+
+from pyanselus.cryptostring import CryptoString
+from pyanselus.framing import FrameBuffer, LengthPrefixedBuffer, MAX_FRAME_SIZE
+from pyanselus.retval import RetVal, BadParameterValue
+
+try:
+	import msgpack
+except ImportError:
+	msgpack = None
+
+UnsupportedEncoding = 'UnsupportedEncoding'
+
+ENCODING_JSON = 'json'
+ENCODING_MSGPACK = 'msgpack'
+
+# MessagePack extension type used for CryptoStrings. The data is the prefix, a colon, and the
+# raw, undecoded key or hash bytes.
+CRYPTOSTRING_EXT = 1
+
+class JSONCodec:
+	'''The standard encoding: JSON text terminated by a CRLF. CryptoStrings are sent in their
+	string form and bytes are Base85-encoded.'''
+	name = ENCODING_JSON
+
+	@staticmethod
+	def make_framer(max_frame_size=MAX_FRAME_SIZE) -> FrameBuffer:
+		'''Returns a buffer which splits a stream in this encoding into messages'''
+		return FrameBuffer(max_frame_size)
+
+	@staticmethod
+	def encode(msg) -> bytes:
+		'''Returns a message as a complete frame'''
+		return json.dumps(msg, default=_json_default).encode() + b'\r\n'
+
+	@staticmethod
+	def decode(frame: bytes):
+		'''Returns the message in a frame'''
+		return json.loads(frame)
+
+
+class MsgPackCodec:
+	'''MessagePack encoding with length-prefixed frames. CryptoStrings are sent as raw bytes with
+	their prefix and received in their string form, so that code handling responses works with
+	either encoding. Other bytes values are passed through as bytes.'''
+	name = ENCODING_MSGPACK
+
+	@staticmethod
+	def make_framer(max_frame_size=MAX_FRAME_SIZE) -> FrameBuffer:
+		'''Returns a buffer which splits a stream in this encoding into messages'''
+		return LengthPrefixedBuffer(max_frame_size)
+
+	@staticmethod
+	def encode(msg) -> bytes:
+		'''Returns a message as a complete frame'''
+		data = msgpack.packb(msg, default=_msgpack_default, use_bin_type=True)
+		return struct.pack('>I', len(data)) + data
+
+	@staticmethod
+	def decode(frame: bytes):
+		'''Returns the message in a frame'''
+		return msgpack.unpackb(frame, ext_hook=_msgpack_ext_hook, raw=False)
+
+
+def supported_encodings() -> list:
+	'''Returns the names of the encodings available, most preferred first'''
+	if msgpack is None:
+		return [ ENCODING_JSON ]
+	return [ ENCODING_MSGPACK, ENCODING_JSON ]
+
+
+def get_codec(name: str) -> RetVal:
+	'''Returns the codec for an encoding in the field 'codec' '''
+	if name == ENCODING_JSON:
+		return RetVal().set_value('codec', JSONCodec)
+
+	if name == ENCODING_MSGPACK:
+		if msgpack is None:
+			return RetVal(UnsupportedEncoding, 'msgpack package is not installed')
+		return RetVal().set_value('codec', MsgPackCodec)
+
+	return RetVal(BadParameterValue, f"unknown encoding {name}")
+
+
+def choose_encoding(offered: list, wanted=None) -> str:
+	'''Returns the first encoding in wanted, which defaults to supported_encodings(), which is
+	also in the list offered by the server. JSON is returned if there is no other match.'''
+	if wanted is None:
+		wanted = supported_encodings()
+
+	if isinstance(offered, list):
+		for name in wanted:
+			if name in offered and not get_codec(name).error():
+				return name
+	return ENCODING_JSON
+
+
+def _json_default(obj):
+	'''Converts objects which the json module can't handle'''
+	if isinstance(obj, CryptoString):
+		return obj.as_string()
+	if isinstance(obj, (bytes, bytearray)):
+		return base64.b85encode(obj).decode()
+	raise TypeError(f"{type(obj).__name__} can't be sent as JSON")
+
+
+def _msgpack_default(obj):
+	'''Converts objects which msgpack can't handle'''
+	if isinstance(obj, CryptoString):
+		return msgpack.ExtType(CRYPTOSTRING_EXT, obj.prefix.encode() + b':' + obj.raw_data())
+	raise TypeError(f"{type(obj).__name__} can't be sent as MessagePack")
+
+
+def _msgpack_ext_hook(code: int, data: bytes):
+	'''Decodes MessagePack extension types'''
+	if code == CRYPTOSTRING_EXT:
+		prefix, raw = data.split(b':', 1)
+		return prefix.decode() + ':' + base64.b85encode(raw).decode()
+	return msgpack.ExtType(code, data)
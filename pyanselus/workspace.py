@@ -5,7 +5,9 @@ import pathlib
 import sqlite3
 
 import pyanselus.auth as auth
+import pyanselus.dbconn as dbconn
 import pyanselus.encryption as encryption
+import pyanselus.metrics as metrics
 from pyanselus.retval import RetVal, ResourceExists, ResourceNotFound, ExceptionThrown, \
 		BadParameterValue
 
@@ -21,18 +23,40 @@ class Workspace:
 		self.type = 'single'
 
 	def generate(self, userid: str, server: str, wid: str, pw: encryption.Password) -> RetVal:
-		'''Creates all the data needed for an individual workspace account'''
+		'''Creates all the data needed for an individual workspace account. All of the database 
+		changes are made in one transaction, so if a step fails, none of them are kept.'''
 		
 		self.uid = userid
 		self.wid = wid
 		self.domain = server
 
+		with dbconn.transaction(self.db) as unit:
+			status = self.__generate_entries(pw)
+			if not status.error():
+				status = self.set_userid(userid)
+			if status.error():
+				unit.abort()
+				return status
+
+			# Create the folders themselves
+			try:
+				self.path.mkdir(parents=True, exist_ok=True)
+				self.path.joinpath('files').mkdir(exist_ok=True)
+				self.path.joinpath('files','attachments').mkdir(exist_ok=True)
+			except Exception as e:
+				unit.abort()
+				return RetVal(ExceptionThrown, e.__str__())
+		
+		return RetVal()
+
+	def __generate_entries(self, pw: encryption.Password) -> RetVal:
+		'''Adds the workspace, its keys, and its folder mappings to the database'''
 		# Add workspace
 		status = self.add_to_db(pw)
 		if status.error():
 			return status
 		
-		address = '/'.join([wid,server])
+		address = '/'.join([self.wid,self.domain])
 
 		# Generate user's encryption keys
 		keys = {
@@ -44,11 +68,9 @@ class Workspace:
 		
 		# Add encryption keys
 		for key in keys.values():
-			out = auth.add_key(self.db, key, address)
-			if out.error():
-				status = self.remove_workspace_entry(wid, server)
-				if status.error():
-					return status
+			status = auth.add_key(self.db, key, address)
+			if status.error():
+				return status
 		
 		# Add folder mappings
 		foldermap = encryption.FolderMapping()
@@ -66,21 +88,13 @@ class Workspace:
 		for folder in folderlist:
 			foldermap.MakeID()
 			foldermap.Set(address, keys['folder'].get_id(), folder, 'root')
-			self.add_folder(foldermap)
-
-		# Create the folders themselves
-		try:
-			self.path.mkdir(parents=True, exist_ok=True)
-		except Exception as e:
-			self.remove_from_db()
-			return RetVal(ExceptionThrown, e.__str__())
+			status = self.add_folder(foldermap)
+			if status.error():
+				return status
 		
-		self.path.joinpath('files').mkdir(exist_ok=True)
-		self.path.joinpath('files','attachments').mkdir(exist_ok=True)
-
-		self.set_userid(userid)
 		return RetVal()
 
+	@metrics.timed(metrics.SQL)
 	def add_to_db(self, pw: encryption.Password) -> RetVal:
 		'''Adds a workspace to the storage database'''
 
@@ -92,9 +106,10 @@ class Workspace:
 		
 		cursor.execute('''INSERT INTO workspaces(wid,domain,password,pwhashtype,type)
 			VALUES(?,?,?,?,?)''', (self.wid, self.domain, pw.hashstring, pw.hashtype, self.type))
-		self.db.commit()
+		dbconn.commit(self.db)
 		return RetVal()
 
+	@metrics.timed(metrics.SQL)
 	def remove_from_db(self) -> RetVal:
 		'''
 		Removes ALL DATA associated with a workspace. Don't call this unless you mean to erase
@@ -113,9 +128,10 @@ class Workspace:
 		cursor.execute("DELETE FROM keys WHERE address=?", (address,))
 		cursor.execute("DELETE FROM messages WHERE address=?", (address,))
 		cursor.execute("DELETE FROM notes WHERE address=?", (address,))
-		self.db.commit()
+		dbconn.commit(self.db)
 		return RetVal()
 	
+	@metrics.timed(metrics.SQL)
 	def remove_workspace_entry(self, wid: str, domain: str) -> RetVal:
 		'''
 		Removes a workspace from the storage database.
@@ -129,9 +145,10 @@ class Workspace:
 			return RetVal(ResourceNotFound, "%s/%s not found" % (wid,domain))
 		
 		cursor.execute("DELETE FROM workspaces WHERE wid=? AND domain=?", (wid,domain))
-		self.db.commit()
+		dbconn.commit(self.db)
 		return RetVal()
 		
+	@metrics.timed(metrics.SQL)
 	def add_folder(self, folder: encryption.FolderMapping) -> RetVal:
 		'''
 		Adds a mapping of a folder ID to a specific path in the workspace.
@@ -147,9 +164,10 @@ class Workspace:
 		cursor.execute('''INSERT INTO folders(fid,address,keyid,path,permissions)
 			VALUES(?,?,?,?,?)''', (folder.fid, folder.address, folder.keyid, folder.path,
 				folder.permissions))
-		self.db.commit()
+		dbconn.commit(self.db)
 		return RetVal()
 
+	@metrics.timed(metrics.SQL)
 	def remove_folder(self, fid: encryption.FolderMapping) -> RetVal:
 		'''Deletes a folder mapping.
 		Parameters:
@@ -165,9 +183,10 @@ class Workspace:
 			return RetVal(ResourceNotFound, fid)
 
 		cursor.execute("DELETE FROM folders WHERE fid=?", (fid,))
-		self.db.commit()
+		dbconn.commit(self.db)
 		return RetVal()
 	
+	@metrics.timed(metrics.SQL)
 	def get_folder(self, fid: encryption.FolderMapping) -> RetVal:
 		'''Gets the specified folder.
 		Parameters:
@@ -191,10 +210,11 @@ class Workspace:
 		
 		return RetVal().set_value('folder', folder)
 
+	@metrics.timed(metrics.SQL)
 	def set_userid(self, userid: str) -> RetVal:
 		'''set_userid() sets the human-friendly name for the workspace'''
 		
-		if ' ' or '"' in userid:
+		if ' ' in userid or '"' in userid:
 			return RetVal(BadParameterValue, '" and space not permitted')
 		
 		cursor = self.db.cursor()
@@ -204,7 +224,7 @@ class Workspace:
 		WHERE wid=? and domain=?
 		'''
 		cursor.execute(sqlcmd, (userid, self.wid, self.domain))
-		self.db.commit()
+		dbconn.commit(self.db)
 		self.uid = userid
 
 		return RetVal()
@@ -22,5 +22,9 @@ setup(
 		# 'blake3>=0.1.7',
 		'PyNaCl>=1.3.0',
 		'jsonschema>=3.2.0'
-	]
+	],
+	extras_require={
+		'msgpack': ['msgpack>=1.0.0'],
+		'benchmark': ['pytest-benchmark>=3.2.0']
+	}
 )
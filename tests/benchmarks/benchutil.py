@@ -0,0 +1,34 @@
+'''Constants and helpers shared by the benchmarks. Fixtures are in conftest.py.'''
+
+# pylint: disable=import-error
+from pyanselus.encryption import EncryptionPair, SigningPair
+from pyanselus.keycard import UserEntry
+
+# Chain lengths used by the keycard benchmarks
+CHAIN_LENGTHS = [1, 100, 1000]
+
+# Number of rows of each kind put into the profile database used by the storage benchmarks
+ROW_COUNT = 1000
+
+WID = 'b5a9367e-680d-46c0-bb2c-73932a6d4007'
+DOMAIN = 'example.com'
+ADDRESS = f"{WID}/{DOMAIN}"
+
+def make_root_entry(orgpair: SigningPair) -> tuple:
+	'''Returns a compliant root user entry and its contact request signing key'''
+	userpair = SigningPair()
+	crpair = SigningPair()
+	entry = UserEntry()
+	entry.set_fields({
+		'Name':'Corbin Simons',
+		'Workspace-ID':WID,
+		'User-ID':'csimons',
+		'Domain':DOMAIN,
+		'Contact-Request-Verification-Key':crpair.get_public_key(),
+		'Contact-Request-Encryption-Key':EncryptionPair().get_public_key(),
+		'Public-Encryption-Key':EncryptionPair().get_public_key()
+	})
+	entry.sign(orgpair.private, 'Organization')
+	entry.generate_hash('BLAKE2B-256')
+	entry.sign(userpair.private, 'User')
+	return entry, crpair.private
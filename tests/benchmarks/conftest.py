@@ -0,0 +1,68 @@
+'''Fixtures shared by the benchmarks. Building a long keycard chain takes a few seconds, so it is
+made once per session and sliced for the shorter chain lengths.'''
+import os
+import uuid
+
+import pytest
+
+# pylint: disable=import-error
+from pyanselus.cryptostring import CryptoString
+from pyanselus.encryption import EncryptionPair, FolderMapping, SecretKey, SigningPair
+from pyanselus.keycard import Keycard
+from pyanselus.userprofile import Profile
+import pyanselus.auth as auth
+import pyanselus.dbconn as dbconn
+from benchutil import ADDRESS, CHAIN_LENGTHS, DOMAIN, ROW_COUNT, WID, make_root_entry
+
+@pytest.fixture(scope='session')
+def chain_entries() -> list:
+	'''A list of max(CHAIN_LENGTHS) entries forming a valid user keycard chain'''
+	orgpair = SigningPair()
+	entry, crkey = make_root_entry(orgpair)
+	card = Keycard()
+	card.entries.append(entry)
+	for _ in range(max(CHAIN_LENGTHS) - 1):
+		chaindata = card.chain(crkey, False)
+		assert not chaindata.error(), f"keycard chain failed: {chaindata.info()}"
+		new_entry = chaindata['entry']
+		new_entry.sign(orgpair.private, 'Organization')
+		new_entry.prev_hash = card.entries[-2].hash
+		new_entry.generate_hash('BLAKE2B-256')
+		new_entry.sign(CryptoString(chaindata['sign.private']), 'User')
+		crkey = CryptoString(chaindata['crsign.private'])
+	return card.entries
+
+
+@pytest.fixture(scope='session')
+def profile_db(tmp_path_factory):
+	'''A profile database holding ROW_COUNT keys, folders, and device sessions. The fields 'keyids'
+	and 'fids' of the returned dictionary list the IDs of the keys and folders added.'''
+	profile = Profile(str(tmp_path_factory.mktemp('profile')))
+	profile.activate()
+	db = profile.db
+	db.execute('INSERT INTO workspaces(wid,domain,password,pwhashtype,type) VALUES(?,?,?,?,?)',
+		(WID, DOMAIN, '', '', 'single'))
+
+	keyids = list()
+	fids = list()
+	with dbconn.transaction(db):
+		for i in range(ROW_COUNT):
+			key = SecretKey()
+			auth.add_key(db, key, ADDRESS)
+			keyids.append(key.get_id())
+
+			folder = FolderMapping()
+			folder.MakeID()
+			folder.Set(ADDRESS, key.get_id(), os.path.join('files', str(i)), 'admin')
+			db.execute('''INSERT INTO folders(fid,address,keyid,path,permissions)
+				VALUES(?,?,?,?,?)''', (folder.fid, folder.address, folder.keyid, folder.path,
+					folder.permissions))
+			fids.append(folder.fid)
+
+			devpair = EncryptionPair()
+			db.execute('''INSERT INTO sessions(address,devid,enctype,public_key,private_key)
+				VALUES(?,?,?,?,?)''', (f"{uuid.uuid4()}/{DOMAIN}", str(uuid.uuid4()),
+					'curve25519', devpair.get_public_key(), devpair.get_private_key()))
+
+	yield { 'profile':profile, 'db':db, 'keyids':keyids, 'fids':fids }
+	profile.deactivate()
@@ -0,0 +1,63 @@
+'''Benchmarks for encryption and CryptoString handling'''
+import os
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+# pylint: disable=import-error,wrong-import-position
+from pyanselus.cryptostring import CryptoString
+from pyanselus.encryption import EncryptionPair, SecretKey, SigningPair
+
+# Payload sizes in bytes. Public-key encryption is only used for small items like keys and
+# challenges, so it isn't run with the largest size. EncryptionPair.decrypt() returns a string, so
+# its payloads are text.
+PAYLOAD_SIZES = [64, 1024, 65536, 1048576]
+PUBLIC_PAYLOAD_SIZES = PAYLOAD_SIZES[:-1]
+
+@pytest.mark.parametrize('size', PAYLOAD_SIZES)
+def test_secretkey_encrypt(benchmark, size):
+	'''Encrypts a payload with a symmetric key'''
+	key = SecretKey()
+	data = os.urandom(size)
+	benchmark.extra_info['bytes'] = size
+	assert benchmark(key.encrypt, data), 'encrypt() failed'
+
+
+@pytest.mark.parametrize('size', PAYLOAD_SIZES)
+def test_secretkey_decrypt(benchmark, size):
+	'''Decrypts a payload with a symmetric key'''
+	key = SecretKey()
+	data = os.urandom(size)
+	encdata = key.encrypt(data)
+	benchmark.extra_info['bytes'] = size
+	assert benchmark(key.decrypt, encdata) == data, 'decrypt() failed'
+
+
+@pytest.mark.parametrize('size', PUBLIC_PAYLOAD_SIZES)
+def test_encryptionpair_encrypt(benchmark, size):
+	'''Encrypts a payload with a public key'''
+	keypair = EncryptionPair()
+	data = b'x' * size
+	benchmark.extra_info['bytes'] = size
+	status = benchmark(keypair.encrypt, data)
+	assert not status.error(), f"encrypt() failed: {status.info()}"
+
+
+@pytest.mark.parametrize('size', PUBLIC_PAYLOAD_SIZES)
+def test_encryptionpair_decrypt(benchmark, size):
+	'''Decrypts a payload with a private key'''
+	keypair = EncryptionPair()
+	data = b'x' * size
+	encdata = keypair.encrypt(data)['data']
+	benchmark.extra_info['bytes'] = size
+	status = benchmark(keypair.decrypt, encdata)
+	assert not status.error() and status['data'] == data.decode(), 'decrypt() failed'
+
+
+def test_cryptostring_set(benchmark):
+	'''Parses a key in CryptoString format'''
+	keystring = SigningPair().get_public_key()
+	cstring = CryptoString()
+	status = benchmark(cstring.set, keystring)
+	assert not status.error(), f"set() failed: {status.info()}"
@@ -0,0 +1,95 @@
+'''Benchmarks for keycard entries and chains'''
+import os
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+# pylint: disable=import-error,wrong-import-position
+from pyanselus.encryption import SigningPair
+from pyanselus.keycard import Keycard
+from benchutil import CHAIN_LENGTHS, make_root_entry
+
+@pytest.fixture(name='entry')
+def fixture_entry():
+	'''A single compliant user entry'''
+	entry, _ = make_root_entry(SigningPair())
+	return entry
+
+
+def make_card(entries: list, length: int) -> Keycard:
+	'''Returns a keycard holding the first length entries of a chain'''
+	card = Keycard('User')
+	card.entries = entries[:length]
+	return card
+
+
+def test_make_bytestring(benchmark, entry):
+	'''Serializes an entry from scratch'''
+	def make_bytestring():
+		# Assigning the hash discards the cached serialization
+		entry.hash = entry.hash
+		return entry.make_bytestring(-1)
+	benchmark(make_bytestring)
+
+
+def test_make_bytestring_cached(benchmark, entry):
+	'''Serializes an entry which hasn't changed since the last call'''
+	entry.make_bytestring(-1)
+	benchmark(entry.make_bytestring, -1)
+
+
+def test_sign(benchmark, entry):
+	'''User-signs an entry'''
+	skey = SigningPair().private
+	status = benchmark(entry.sign, skey, 'User')
+	assert not status.error(), f"sign() failed: {status.info()}"
+
+
+def test_verify_signature(benchmark, entry):
+	'''Verifies the user signature of an entry'''
+	spair = SigningPair()
+	entry.sign(spair.private, 'User')
+	status = benchmark(entry.verify_signature, spair.public, 'User')
+	assert not status.error(), f"verify_signature() failed: {status.info()}"
+
+
+@pytest.mark.parametrize('length', CHAIN_LENGTHS)
+def test_keycard_load(benchmark, chain_entries, tmp_path, length):
+	'''Loads a keycard file'''
+	path = os.path.join(str(tmp_path), 'user.kc')
+	status = make_card(chain_entries, length).save(path, True)
+	assert not status.error(), f"save() failed: {status.info()}"
+
+	card = Keycard()
+	status = benchmark(card.load, path)
+	assert not status.error(), f"load() failed: {status.info()}"
+	assert len(card.entries) == length, 'wrong number of entries loaded'
+
+
+@pytest.mark.parametrize('length', CHAIN_LENGTHS)
+def test_keycard_make_bytestring(benchmark, chain_entries, length):
+	'''Serializes a keycard whose entries haven't changed'''
+	card = make_card(chain_entries, length)
+	benchmark(card.make_bytestring)
+
+
+@pytest.mark.parametrize('length', CHAIN_LENGTHS)
+def test_keycard_verify(benchmark, chain_entries, length):
+	'''Verifies a whole keycard chain without the help of a checkpoint'''
+	card = make_card(chain_entries, length)
+	def verify():
+		card.checkpoint = None
+		return card.verify()
+	status = benchmark(verify)
+	assert not status.error(), f"verify() failed: {status.info()}"
+
+
+@pytest.mark.parametrize('length', CHAIN_LENGTHS)
+def test_keycard_verify_checkpoint(benchmark, chain_entries, length):
+	'''Verifies a keycard chain which was verified before'''
+	card = make_card(chain_entries, length)
+	card.verify()
+	status = benchmark(card.verify)
+	assert not status.error(), f"verify() failed: {status.info()}"
+
@@ -0,0 +1,80 @@
+'''Benchmarks for the auth and workspace database helpers'''
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+# pylint: disable=import-error,wrong-import-position
+import pyanselus.auth as auth
+import pyanselus.dbconn as dbconn
+from pyanselus.encryption import FolderMapping, Password, SecretKey
+from pyanselus.workspace import Workspace
+from benchutil import ADDRESS, DOMAIN, ROW_COUNT, WID
+
+def test_get_key(benchmark, profile_db):
+	'''Looks up one key among many'''
+	keyid = profile_db['keyids'][ROW_COUNT // 2]
+	status = benchmark(auth.get_key, profile_db['db'], keyid)
+	assert not status.error(), f"get_key() failed: {status.info()}"
+
+
+def test_add_remove_key(benchmark, profile_db):
+	'''Adds a key to a full table and removes it again'''
+	db = profile_db['db']
+	key = SecretKey()
+	def add_remove():
+		auth.add_key(db, key, ADDRESS)
+		return auth.remove_key(db, key.get_id())
+	status = benchmark(add_remove)
+	assert not status.error(), f"remove_key() failed: {status.info()}"
+
+
+def test_add_remove_key_transaction(benchmark, profile_db):
+	'''Same as test_add_remove_key, but with both changes committed together'''
+	db = profile_db['db']
+	key = SecretKey()
+	def add_remove():
+		with dbconn.transaction(db):
+			auth.add_key(db, key, ADDRESS)
+			return auth.remove_key(db, key.get_id())
+	status = benchmark(add_remove)
+	assert not status.error(), f"remove_key() failed: {status.info()}"
+
+
+def test_get_session_public_key(benchmark, profile_db):
+	'''Looks up the device key of a session that doesn't exist, which has to search the whole
+	table if it isn't indexed'''
+	status = benchmark(auth.get_session_public_key, profile_db['db'], ADDRESS)
+	assert status.error() == auth.ResourceNotFound, 'unexpected session found'
+
+
+def test_credentials(benchmark, profile_db):
+	'''Stores and reads back a workspace's password hash'''
+	db = profile_db['db']
+	pw = Password()
+	pw.Assign('$argon2id$v=19$m=65536,t=2,p=1$c2FsdHNhbHQ$aGFzaGhhc2g')
+	def credentials():
+		auth.set_credentials(db, WID, DOMAIN, pw)
+		return auth.get_credentials(db, WID, DOMAIN)
+	status = benchmark(credentials)
+	assert not status.error(), f"get_credentials() failed: {status.info()}"
+
+
+def test_get_folder(benchmark, profile_db):
+	'''Looks up one folder mapping among many'''
+	workspace = Workspace(profile_db['db'], profile_db['profile'].path)
+	fid = profile_db['fids'][ROW_COUNT // 2]
+	status = benchmark(workspace.get_folder, fid)
+	assert not status.error(), f"get_folder() failed: {status.info()}"
+
+
+def test_add_remove_folder(benchmark, profile_db):
+	'''Adds a folder mapping to a full table and removes it again'''
+	workspace = Workspace(profile_db['db'], profile_db['profile'].path)
+	folder = FolderMapping()
+	folder.MakeID()
+	folder.Set(ADDRESS, profile_db['keyids'][0], 'files/new', 'admin')
+	def add_remove():
+		workspace.add_folder(folder)
+		return workspace.remove_folder(folder.fid)
+	status = benchmark(add_remove)
+	assert not status.error(), f"remove_folder() failed: {status.info()}"
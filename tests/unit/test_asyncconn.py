@@ -0,0 +1,105 @@
+'''This module tests the asyncio connection class and command functions'''
+import asyncio
+import json
+
+# pylint: disable=import-error
+import pyanselus.asyncconn as asyncconn
+from pyanselus.encryption import EncryptionPair
+from pyanselus.mockserver import MockServer
+from pyanselus.retval import BadParameterValue, NetworkError, ServerError
+
+ADMIN_WID = 'ae406c5e-2673-4d3e-af20-91325d9623ca'
+
+async def handle_client(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+	'''Minimal server which answers GETWID and QUIT'''
+	writer.write(json.dumps({ 'Name':'Anselus', 'Version':'0.1', 'Code':200,
+		'Status':'OK' }).encode() + b'\r\n')
+	await writer.drain()
+
+	while True:
+		line = await reader.readline()
+		if not line:
+			break
+
+		request = json.loads(line)
+		if request['Action'] == 'QUIT':
+			break
+
+		if request['Action'] == 'GETWID' and request['Data']['User-ID'] == 'admin':
+			response = { 'Code':200, 'Status':'OK', 'Info':'',
+				'Data':{ 'Workspace-ID':ADMIN_WID } }
+		else:
+			response = { 'Code':404, 'Status':'NOT FOUND', 'Info':'', 'Data':{} }
+
+		# Send the response in two pieces to exercise the framing code
+		rawdata = json.dumps(response).encode() + b'\r\n'
+		writer.write(rawdata[:10])
+		await writer.drain()
+		writer.write(rawdata[10:])
+		await writer.drain()
+
+	writer.close()
+
+
+def test_async_getwid():
+	'''Tests several concurrent sessions driven from a single event loop'''
+
+	async def run_test():
+		server = await asyncio.start_server(handle_client, '127.0.0.1', 0)
+		port = server.sockets[0].getsockname()[1]
+
+		async def session(uid: str):
+			conn = asyncconn.AsyncServerConnection()
+			status = await conn.connect('127.0.0.1', port)
+			assert not status.error(), f"connect() failed: {status.info()}"
+			status = await asyncconn.getwid(conn, uid, 'example.com')
+			await conn.disconnect()
+			return status
+
+		results = await asyncio.gather(*[session('admin') for _ in range(20)], session('nobody'))
+		server.close()
+		await server.wait_closed()
+		return results
+
+	results = asyncio.run(run_test())
+	for status in results[:-1]:
+		assert not status.error(), f"getwid() failed: {status.info()}"
+		assert status['Workspace-ID'] == ADMIN_WID, 'getwid() returned the wrong wid'
+
+	assert results[-1].error(), 'getwid() did not return an error for an unknown user'
+
+
+def test_async_session():
+	'''Runs registration and login against the mock server with the async commands'''
+
+	async def run_test(server: MockServer):
+		conn = asyncconn.AsyncServerConnection()
+		status = await conn.connect('127.0.0.1', server.port)
+		assert not status.error(), f"connect() failed: {status.info()}"
+
+		devpair = EncryptionPair()
+		status = await asyncconn.register(conn, 'csimons', 'pwhash', devpair.public)
+		assert not status.error(), f"register() failed: {status.info()}"
+		wid = status['wid']
+		devid = status['devid']
+
+		status = await asyncconn.password(conn, wid, '')
+		assert status.error() == BadParameterValue, 'empty password hash not rejected'
+
+		status = await asyncconn.login(conn, wid, server.org_encryption.public)
+		assert not status.error(), f"login() failed: {status.info()}"
+		status = await asyncconn.password(conn, wid, 'pwhash')
+		assert not status.error(), f"password() failed: {status.info()}"
+		status = await asyncconn.device(conn, devid, devpair)
+		assert not status.error(), f"device() failed: {status.info()}"
+
+		status = await asyncconn.iscurrent(conn, 1, ADMIN_WID)
+		assert status.error() == ServerError, 'unknown workspace not reported'
+		await conn.disconnect()
+
+		# Commands on a dropped connection return an error instead of raising
+		status = await asyncconn.setpassword(conn, 'pwhash', 'newhash')
+		assert status.error() == NetworkError, 'dropped connection not reported'
+
+	with MockServer() as server:
+		asyncio.run(run_test(server))
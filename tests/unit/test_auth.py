@@ -0,0 +1,59 @@
+'''This module tests the auth module'''
+import os
+import shutil
+import time
+
+# pylint: disable=import-error
+import pyanselus.auth as auth
+from pyanselus.encryption import EncryptionPair, SecretKey
+from pyanselus.retval import ResourceNotFound
+from pyanselus.userprofile import Profile
+
+def setup_test(name):
+	'''Creates a new test folder hierarchy'''
+	test_folder = os.path.join(os.path.dirname(os.path.realpath(__file__)),'testfiles')
+	if not os.path.exists(test_folder):
+		os.mkdir(test_folder)
+
+	unittest_folder = os.path.join(test_folder, name)
+	while os.path.exists(unittest_folder):
+		try:
+			shutil.rmtree(unittest_folder)
+		except:
+			print("Waiting a second for test folder to unlock")
+			time.sleep(1.0)
+	os.mkdir(unittest_folder)
+	return unittest_folder
+
+
+def test_add_get_key():
+	'''Tests that keys stored with add_key() can be loaded with get_key() and still work'''
+	profile = Profile(setup_test('auth_add_get_key'))
+	profile.activate()
+	address = 'b5a9367e-680d-46c0-bb2c-73932a6d4007/example.com'
+
+	secretkey = SecretKey()
+	status = auth.add_key(profile.db, secretkey, address)
+	assert not status.error(), f"add_key() failed for a secret key: {status.info()}"
+	status = auth.get_key(profile.db, secretkey.get_id())
+	assert not status.error(), f"get_key() failed for a secret key: {status.info()}"
+	key = status['key']
+	assert isinstance(key, SecretKey) and key.get_id() == secretkey.get_id(), \
+		'get_key() returned the wrong secret key'
+	assert key.decrypt(secretkey.encrypt(b'data')) == b'data', 'loaded secret key unusable'
+
+	keypair = EncryptionPair()
+	status = auth.add_key(profile.db, keypair, address)
+	assert not status.error(), f"add_key() failed for a key pair: {status.info()}"
+	status = auth.get_key(profile.db, keypair.get_id())
+	assert not status.error(), f"get_key() failed for a key pair: {status.info()}"
+	key = status['key']
+	assert isinstance(key, EncryptionPair) and key.get_id() == keypair.get_id(), \
+		'get_key() returned the wrong key pair'
+	assert key.get_public_key() == keypair.get_public_key(), 'public key changed'
+	status = key.decrypt(keypair.encrypt(b'data')['data'])
+	assert not status.error() and status['data'] == 'data', 'loaded key pair unusable'
+
+	assert auth.get_key(profile.db, '00000000-0000-0000-0000-000000000000').error() == \
+		ResourceNotFound, 'missing key not reported'
+	profile.deactivate()
@@ -0,0 +1,98 @@
+'''This module tests the ConnectionPool class'''
+import json
+import socket
+import threading
+
+# pylint: disable=import-error
+from pyanselus.connpool import ConnectionPool
+from pyanselus.retval import RetVal
+
+class GreetingServer:
+	'''Tiny server which sends a greeting to each client and counts connections'''
+	def __init__(self):
+		self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		self.listener.bind(('127.0.0.1', 0))
+		self.listener.listen(8)
+		self.port = self.listener.getsockname()[1]
+		self.clients = list()
+		self.thread = threading.Thread(target=self.run, daemon=True)
+		self.thread.start()
+
+	def run(self):
+		'''Accepts connections until the listener is closed'''
+		while True:
+			try:
+				client, _ = self.listener.accept()
+			except OSError:
+				return
+			client.sendall(json.dumps({ 'Name':'Anselus', 'Version':'0.1', 'Code':200,
+				'Status':'OK' }).encode() + b'\r\n')
+			self.clients.append(client)
+
+	def close(self):
+		'''Shuts down the server and all client connections'''
+		self.listener.close()
+		for client in self.clients:
+			client.close()
+
+
+def test_connpool_reuse():
+	'''Tests that released connections are reused and that dead ones are replaced'''
+	server = GreetingServer()
+	pool = ConnectionPool()
+
+	status = pool.acquire('127.0.0.1', server.port)
+	assert not status.error(), f"acquire() failed: {status.info()}"
+	conn = status['conn']
+	assert not pool.release(conn).error(), 'release() failed'
+	assert pool.idle_count() == 1, 'released connection not kept'
+
+	status = pool.acquire('127.0.0.1', server.port)
+	assert status['conn'] is conn, 'idle connection not reused'
+	assert len(server.clients) == 1, 'pool made an extra connection'
+	pool.release(status['conn'])
+
+	# Connections which the server has closed fail the health check and get replaced
+	server.clients[0].close()
+	status = pool.acquire('127.0.0.1', server.port)
+	assert not status.error(), f"acquire() failed: {status.info()}"
+	assert status['conn'] is not conn, 'dead connection reused'
+	pool.release(status['conn'])
+
+	# Connections in use during close() are closed when released, but the pool can be reused
+	status = pool.acquire('127.0.0.1', server.port)
+	conn = status['conn']
+	pool.close()
+	assert pool.idle_count() == 0, 'close() left idle connections'
+	pool.release(conn)
+	assert pool.idle_count() == 0 and not conn.is_connected(), 'connection kept after close()'
+
+	status = pool.acquire('127.0.0.1', server.port)
+	assert not status.error(), f"acquire() after close() failed: {status.info()}"
+	pool.release(status['conn'])
+	assert pool.idle_count() == 1, 'pool stopped keeping connections after close()'
+
+	pool.close()
+	server.close()
+
+
+def test_connpool_login_and_evict():
+	'''Tests keying by workspace ID and idle eviction'''
+	server = GreetingServer()
+	pool = ConnectionPool(idle_timeout=0.0)
+	logins = list()
+
+	def login(conn):
+		logins.append(conn)
+		return RetVal()
+
+	wid = '11111111-1111-1111-1111-111111111111'
+	with pool.connection('127.0.0.1', server.port, wid, login) as status:
+		assert not status.error(), f"connection() failed: {status.info()}"
+	assert len(logins) == 1, 'login callback not called for new connection'
+
+	assert pool.evict_idle() == 1, 'idle connection not evicted'
+	assert pool.idle_count() == 0, 'evicted connection still in pool'
+
+	pool.close()
+	server.close()
@@ -0,0 +1,47 @@
+'''This module tests the CryptoString class'''
+import base64
+
+# pylint: disable=import-error
+from pyanselus.cryptostring import CryptoString
+
+def test_set():
+	'''Tests set() and validation'''
+	raw = bytes(range(32))
+	text = 'ED25519:' + base64.b85encode(raw).decode()
+
+	cstring = CryptoString()
+	assert not cstring.set(text).error(), 'valid string rejected'
+	assert cstring.prefix == 'ED25519' and cstring.as_string() == text, 'string not parsed'
+	assert cstring.raw_data() == raw, 'wrong raw data'
+	assert cstring.raw_data() is cstring.raw_data(), 'raw data decoded twice'
+	assert cstring.as_bytes() == text.encode(), 'as_bytes() failed'
+
+	for bad in ['ed25519:abc', 'ED25519', 'ABCDEFGHIJKLMNOP:abc', 'ED25519:abc,"']:
+		assert cstring.set(bad).error(), f"invalid string {bad} accepted"
+		assert not cstring.is_valid(), 'failed set() left data behind'
+
+
+def test_lazy_and_raw():
+	'''Tests lazy decoding, set_raw(), and that changing data drops the decoded bytes'''
+	raw = bytes(range(32))
+	text = 'ED25519:' + base64.b85encode(raw).decode()
+
+	cstring = CryptoString(text, lazy=True)
+	assert cstring.prefix == 'ED25519', 'lazy set() failed'
+	assert bytes(cstring.raw_view()) == raw, 'lazy decoding failed'
+
+	cstring = CryptoString('ED25519:abc,"', lazy=True)
+	assert cstring.is_valid(), 'lazy set() checked the data'
+	try:
+		cstring.raw_data()
+		assert False, 'invalid data decoded'
+	except ValueError:
+		pass
+
+	cstring = CryptoString()
+	assert not cstring.set_raw('ED25519', raw).error(), 'set_raw() failed'
+	assert cstring == CryptoString(text), 'set_raw() encoded the data incorrectly'
+	assert cstring.set_raw('ed25519', raw).error(), 'set_raw() accepted a bad prefix'
+
+	cstring.data = base64.b85encode(b'other').decode()
+	assert cstring.raw_data() == b'other', 'stale raw data returned after data changed'
@@ -0,0 +1,143 @@
+'''This module tests the dbconn module'''
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+# pylint: disable=import-error
+import pyanselus.dbconn as dbconn
+from pyanselus.dbconn import ConnectionManager
+from pyanselus.userprofile import Profile
+
+def setup_test(name):
+	'''Creates a new test folder hierarchy'''
+	test_folder = os.path.join(os.path.dirname(os.path.realpath(__file__)),'testfiles')
+	if not os.path.exists(test_folder):
+		os.mkdir(test_folder)
+
+	unittest_folder = os.path.join(test_folder, name)
+	while os.path.exists(unittest_folder):
+		try:
+			shutil.rmtree(unittest_folder)
+		except:
+			print("Waiting a second for test folder to unlock")
+			time.sleep(1.0)
+	os.mkdir(unittest_folder)
+	return unittest_folder
+
+
+def test_connection_manager():
+	'''Tests per-thread connections and that readers aren't blocked by a writer'''
+	test_folder = setup_test('dbconn')
+	dbman = ConnectionManager(os.path.join(test_folder, 'test.db'))
+
+	conn = dbman.get()
+	assert dbman.get() is conn, 'thread did not get the same connection twice'
+	assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal', 'WAL not enabled'
+	assert conn.execute('PRAGMA synchronous').fetchone()[0] == 1, 'synchronous not NORMAL'
+
+	conn.execute('CREATE TABLE test(value TEXT)')
+	conn.execute("INSERT INTO test VALUES('committed')")
+	conn.commit()
+
+	# Leave a write transaction open while another thread reads
+	conn.execute("INSERT INTO test VALUES('uncommitted')")
+	results = list()
+	def reader():
+		other = dbman.get()
+		results.append(other is not conn)
+		results.append(other.execute('SELECT value FROM test').fetchall())
+
+	thread = threading.Thread(target=reader)
+	thread.start()
+	thread.join()
+	assert results[0], 'threads shared a connection'
+	assert results[1] == [('committed',)], 'reader saw the wrong data'
+	conn.commit()
+
+	assert dbman.connection_count() == 2, 'wrong connection count'
+	dbman.close()
+	assert dbman.connection_count() == 0, 'connections not closed'
+	assert dbman.get().execute('SELECT COUNT(*) FROM test').fetchone()[0] == 2, \
+		'reconnect after close() failed'
+	dbman.close()
+
+
+def test_profile_get_db():
+	'''Tests that a profile hands out per-thread database connections'''
+	test_folder = setup_test('dbconn_profile')
+	profile = Profile(test_folder)
+	profile.activate()
+	assert profile.get_db() is profile.db, 'activating thread got a different connection'
+
+	results = list()
+	thread = threading.Thread(target=lambda: results.append(profile.get_db()))
+	thread.start()
+	thread.join()
+	assert results[0] is not profile.db, 'other thread got the activating thread\'s connection'
+
+	profile.deactivate()
+	assert profile.db is None and profile.get_db() is None, 'deactivate() left a connection'
+
+
+def test_transaction():
+	'''Tests that helpers join a unit of work and that it commits or rolls back as a whole'''
+	test_folder = setup_test('dbconn_transaction')
+	dbman = ConnectionManager(os.path.join(test_folder, 'test.db'))
+	db = dbman.get()
+	db.execute('CREATE TABLE test(value TEXT)')
+	db.commit()
+
+	def count_from_other_thread() -> int:
+		results = list()
+		def reader():
+			results.append(dbman.get().execute('SELECT COUNT(*) FROM test').fetchone()[0])
+		thread = threading.Thread(target=reader)
+		thread.start()
+		thread.join()
+		return results[0]
+
+	with dbconn.transaction(db):
+		db.execute("INSERT INTO test VALUES('1')")
+		dbconn.commit(db)
+		with dbconn.transaction(db):
+			db.execute("INSERT INTO test VALUES('2')")
+			dbconn.commit(db)
+		assert count_from_other_thread() == 0, 'changes committed inside a unit of work'
+	assert count_from_other_thread() == 2, 'unit of work not committed'
+
+	with dbconn.transaction(db) as unit:
+		db.execute("INSERT INTO test VALUES('3')")
+		unit.abort()
+	assert count_from_other_thread() == 2, 'aborted unit of work committed'
+
+	try:
+		with dbconn.transaction(db):
+			db.execute("INSERT INTO test VALUES('4')")
+			raise ValueError
+	except ValueError:
+		pass
+	assert count_from_other_thread() == 2, 'unit of work committed after exception'
+
+	db.execute("INSERT INTO test VALUES('5')")
+	dbconn.commit(db)
+	assert count_from_other_thread() == 3, 'commit() outside a unit of work failed'
+
+	# A unit of work can't be joined or committed early by another thread sharing the connection
+	errors = list()
+	def shared_commit():
+		for func in [ lambda: dbconn.commit(db), lambda: dbconn.transaction(db).__enter__() ]:
+			try:
+				func()
+			except sqlite3.ProgrammingError:
+				errors.append(func)
+	with dbconn.transaction(db) as unit:
+		db.execute("INSERT INTO test VALUES('6')")
+		thread = threading.Thread(target=shared_commit)
+		thread.start()
+		thread.join()
+		unit.abort()
+	assert len(errors) == 2, 'shared connection used by another thread inside a unit of work'
+	assert count_from_other_thread() == 3, 'unit of work committed by another thread'
+	dbman.close()
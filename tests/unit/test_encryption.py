@@ -1,4 +1,6 @@
 '''This module tests the various classes and functions in the encryption module'''
+import asyncio
+import io
 import json
 import os
 import shutil
@@ -195,6 +197,114 @@ def test_secretkey_encrypt_decrypt():
 	newdata = sk.decrypt(encdata)
 	assert testdata == newdata, "Decrypted data didn't match"
 
+def test_cipher_cache():
+	'''Tests that cached cipher objects follow key changes'''
+	pair1 = encryption.EncryptionPair()
+	pair2 = encryption.EncryptionPair()
+	status = pair1.encrypt(b'1234567890')
+	assert pair1.decrypt(status['data'])['data'] == '1234567890', 'cached decryption failed'
+
+	pair1.public = pair2.public
+	pair1.private = pair2.private
+	status = pair1.encrypt(b'1234567890')
+	assert pair2.decrypt(status['data'])['data'] == '1234567890', 'stale public key used'
+	assert not pair1.decrypt(status['data']).error(), 'stale private key used'
+
+	pubkey = encryption.PublicKey(pair2.public)
+	status = pubkey.encrypt(b'1234567890')
+	assert pair2.decrypt(status['data'])['data'] == '1234567890', 'PublicKey encryption failed'
+
+	sk1 = encryption.SecretKey()
+	sk2 = encryption.SecretKey()
+	encdata = sk1.encrypt(b'1234567890')
+	assert sk1.decrypt(encdata) == b'1234567890', 'cached decryption failed'
+	sk1.key = sk2.key
+	assert sk2.decrypt(sk1.encrypt(b'1234567890')) == b'1234567890', 'stale secret key used'
+
+def test_envelope():
+	'''Tests multiple-recipient encryption'''
+	pairs = [encryption.EncryptionPair() for _ in range(20)]
+	recipients = [encryption.PublicKey(x.public) for x in pairs[:19]]
+	recipients.append(pairs[19])
+
+	for max_workers in [1, 4]:
+		status = encryption.encrypt_envelope(b'1234567890', recipients, max_workers)
+		assert not status.error(), f"encrypt_envelope() failed: {status.info()}"
+		envelope = status['envelope']
+		assert len(envelope['Keys']) == len(pairs), 'wrong number of wrapped keys'
+
+		for pair in pairs:
+			status = encryption.decrypt_envelope(envelope, pair)
+			assert not status.error(), f"decrypt_envelope() failed: {status.info()}"
+			assert status['data'] == b'1234567890', "Decrypted data didn't match"
+
+	status = encryption.decrypt_envelope(envelope, encryption.EncryptionPair())
+	assert status.error() == encryption.ResourceNotFound, 'envelope opened by non-recipient'
+
+	status = encryption.encrypt_envelope(b'1234567890', recipients + ['bad'])
+	assert status.error() == encryption.BadParameterType, 'bad recipient accepted'
+
+def test_password_hasher():
+	'''Tests background password hashing'''
+	hasher = encryption.PasswordHasher(max_workers=2)
+	pws = [encryption.Password() for _ in range(4)]
+	futures = [hasher.set(pw, f"MyS3cretPassw*rd{i}") for i, pw in enumerate(pws)]
+	for future in futures:
+		status = future.result()
+		assert not status.error(), f"set() failed: {status.info()}"
+	
+	for i, pw in enumerate(pws):
+		assert pw.strength == 'strong', 'strength not set'
+		assert pw.Check(f"MyS3cretPassw*rd{i}"), 'hash does not match password'
+		assert not hasher.check(pw, 'wrong password').result(), 'wrong password accepted'
+
+	assert hasher.set(pws[0], 'abc').result().error(), 'weak password accepted'
+
+	async def run_async():
+		pw = encryption.Password(profile='moderate')
+		status = await hasher.set_async(pw, 'MyS3cretPassw*rd')
+		assert not status.error(), f"set_async() failed: {status.info()}"
+		return await hasher.check_async(pw, 'MyS3cretPassw*rd')
+	assert asyncio.run(run_async()), 'check_async() failed'
+	
+	hasher.shutdown()
+
+def test_secretkey_stream():
+	'''Tests SecretKey streaming encryption/decryption'''
+	sk = encryption.SecretKey()
+	testdata = os.urandom(10000)
+
+	for size in [0, 1, 999, 1000, 10000]:
+		outstream = io.BytesIO()
+		status = sk.encrypt_stream(io.BytesIO(testdata[:size]), outstream, 1000)
+		assert not status.error(), f"encrypt_stream() failed: {status.info()}"
+		encdata = outstream.getvalue()
+		assert status['size'] == len(encdata), 'wrong encrypted size returned'
+
+		outstream = io.BytesIO()
+		status = sk.decrypt_stream(io.BytesIO(encdata), outstream)
+		assert not status.error(), f"decrypt_stream() failed: {status.info()}"
+		assert outstream.getvalue() == testdata[:size], "Decrypted data didn't match"
+
+	# Iterators work on both ends, regardless of how the input is split up
+	pieces = [testdata[i:i+333] for i in range(0, len(testdata), 333)]
+	encdata = b''.join(sk.iter_encrypt(pieces, 1000))
+	chunks = list(sk.iter_decrypt(encdata[i:i+77] for i in range(0, len(encdata), 77)))
+	assert all(len(x) == 1000 for x in chunks), 'plaintext chunk size mismatch'
+	assert b''.join(chunks) == testdata, "Decrypted data didn't match"
+
+	# Tampering, truncation, and dropping the final chunk are all caught
+	chunk_size = 5 + 1000 + 16
+	header_size = len(encryption.STREAM_MAGIC) + 5 + encryption.STREAM_NONCE_PREFIX_SIZE
+	tampered = bytearray(encdata)
+	tampered[header_size + 100] ^= 1
+	for baddata in [bytes(tampered), encdata[:-1], encdata[:header_size + chunk_size * 9],
+			encdata + b'\0', encryption.SecretKey().iter_encrypt([b'x'])]:
+		if not isinstance(baddata, bytes):
+			baddata = b''.join(baddata)
+		status = sk.decrypt_stream(io.BytesIO(baddata), io.BytesIO())
+		assert status.error() == encryption.DecryptionFailure, 'bad stream was accepted'
+
 if __name__ == '__main__':
 	test_encryptionpair_encrypt_decrypt()
 	test_signpair_sign_verify()
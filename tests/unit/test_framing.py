@@ -0,0 +1,78 @@
+'''This module tests the FrameBuffer class'''
+import json
+import socket
+import struct
+import threading
+
+# pylint: disable=import-error
+from pyanselus.framing import FrameBuffer, LengthPrefixedBuffer, MessageTooLarge
+from pyanselus.retval import NetworkError
+
+def test_delimited_frames():
+	'''Tests splitting of coalesced and partial CRLF-delimited messages'''
+	buffer = FrameBuffer()
+
+	buffer.feed(b'{"Code":200}\r\n{"Code":')
+	status = buffer.next_frame()
+	assert not status.error(), f"next_frame() error: {status.info()}"
+	assert status['frame'] == b'{"Code":200}', 'first frame mismatch'
+
+	status = buffer.next_frame()
+	assert not status.error() and status['frame'] is None, 'partial frame returned early'
+
+	buffer.feed(b'100}\r')
+	status = buffer.next_frame()
+	assert status['frame'] == b'{"Code":100}', 'complete JSON without delimiter not returned'
+
+	buffer.feed(b'\n\r\n')
+	status = buffer.next_frame()
+	assert status['frame'] is None, 'blank line returned as a frame'
+	assert len(buffer) == 0, 'buffer not empty after all frames were read'
+
+
+def test_max_frame_size():
+	'''Tests rejection of oversized messages'''
+	buffer = FrameBuffer(16)
+	buffer.feed(b'"' + b'a' * 32)
+	status = buffer.next_frame()
+	assert status.error() == MessageTooLarge, 'oversized message not rejected'
+
+
+def test_length_prefixed_frames():
+	'''Tests splitting binary messages which contain CRLFs'''
+	buffer = LengthPrefixedBuffer(16)
+	buffer.feed(struct.pack('>I', 4) + b'\r\n\r\n' + struct.pack('>I', 6) + b'ab')
+	assert buffer.next_frame()['frame'] == b'\r\n\r\n', 'first frame mismatch'
+	assert buffer.next_frame()['frame'] is None, 'partial frame returned'
+
+	buffer.feed(b'cdef' + struct.pack('>I', 0))
+	assert buffer.next_frame()['frame'] == b'abcdef', 'second frame mismatch'
+	assert buffer.next_frame()['frame'] == b'', 'empty frame mismatch'
+	assert len(buffer) == 0, 'buffer not empty'
+
+	buffer.feed(struct.pack('>I', 17))
+	assert buffer.next_frame().error() == MessageTooLarge, 'oversized message not rejected'
+
+
+def test_read_frame():
+	'''Tests reading a large message which arrives in pieces over a socket'''
+	left, right = socket.socketpair()
+	msg = json.dumps({'Code':200, 'Status':'OK', 'Data':{'Keycard':'x' * 200000}}).encode()
+
+	def sender():
+		right.sendall(msg[:1000])
+		right.sendall(msg[1000:] + b'\r\n' + msg + b'\r\n')
+		right.close()
+	thread = threading.Thread(target=sender)
+	thread.start()
+
+	buffer = FrameBuffer()
+	for _ in range(2):
+		status = buffer.read_frame(left)
+		assert not status.error(), f"read_frame() error: {status.info()}"
+		assert status['frame'] == msg, 'frame mismatch'
+
+	thread.join()
+	status = buffer.read_frame(left)
+	assert status.error() == NetworkError, 'closed connection not detected'
+	left.close()
@@ -203,6 +203,17 @@ def test_set():
 			"set() didn't handle the signature correctly"
 
 
+def test_shared_schema():
+	'''Tests that entries of a type share their schema data and have no per-instance dictionary'''
+	first = keycard.UserEntry()
+	second = keycard.UserEntry()
+	assert first.field_names is second.field_names, 'field names not shared'
+	assert first.signature_info is keycard.UserEntry.SIGNATURE_INFO, 'signature info not shared'
+	assert not hasattr(first, '__dict__'), 'entry has a per-instance dictionary'
+	assert not hasattr(first.fields, '__dict__'), 'field dictionary has a per-instance dictionary'
+	assert not hasattr(CryptoString(), '__dict__'), 'CryptoString has a per-instance dictionary'
+
+
 def test_make_bytestring():
 	'''Tests make_bytestring()'''
 
@@ -243,6 +254,34 @@ def test_make_bytestring():
 	actual_out = basecard.make_bytestring(-1)
 	assert actual_out == expected_out, "user byte string didn't match"
 
+	# Repeat calls are served from the cache until the entry changes
+	assert basecard.make_bytestring(-1) is actual_out, "byte string was not cached"
+
+	basecard.signatures['User'] = '3333333333'
+	assert basecard.make_bytestring(-1).endswith(b'User-Signature:3333333333\r\n'), \
+		"signature change did not update byte string"
+	
+	basecard.hash = 'BLAKE2B-256:4444444444'
+	assert b'Hash:BLAKE2B-256:4444444444\r\n' in basecard.make_bytestring(-1), \
+		"hash change did not update byte string"
+	
+	basecard.set_field('Name', 'Corbin Simons')
+	assert basecard.make_bytestring(-1) == expected_out.replace(b'Smith', b'Simons') \
+		.replace(b'Custody-Signature:0000000000\r\n', b'') \
+		.replace(b'Organization-Signature:2222222222\r\n', b'') \
+		.replace(b'User-Signature:1111111111\r\n', b''), "field change did not update byte string"
+
+	# Replacing the schema data also has to discard the cached byte string
+	basecard.signatures['Organization'] = '2222222222'
+	assert b'Organization-Signature:2222222222\r\n' in basecard.make_bytestring(-1), \
+		"signature not in byte string"
+	basecard.signature_info = basecard.signature_info[:1]
+	assert b'Organization-Signature' not in basecard.make_bytestring(-1), \
+		"signature info change did not update byte string"
+	basecard.field_names = [ 'Name' ]
+	assert basecard.make_bytestring(-1) == b'Type:Test\r\nName:Corbin Simons\r\n', \
+		"field name change did not update byte string"
+
 
 
 def test_set_expiration():
@@ -780,6 +819,95 @@ def test_keycard_chain_verify_load_save():
 	assert not status.error(), f'keycard failed to load: {status}'
 
 
+def test_keycard_verify_batch():
+	'''Tests parallel verification of a long keycard chain and of several keycards at once'''
+	card = keycard.Keycard()
+	card.entries.append(make_test_userentry())
+
+	# User contact request signing key and organization signing key
+	crskeystring = CryptoString('ED25519:ip52{ps^jH)t$k-9bc_RzkegpIW?}FFe~BX&<V}9')
+	oskeystring = CryptoString('ED25519:msvXw(nII<Qm6oBHc+92xwRI3>VFF-RcZ=7DEu3|')
+	for _ in range(40):
+		chaindata = card.chain(crskeystring, False)
+		assert not chaindata.error(), f'keycard chain failed: {chaindata}'
+
+		new_entry = chaindata['entry']
+		status = new_entry.sign(oskeystring, 'Organization')
+		assert not status.error(), f'chained entry failed to org sign: {status}'
+
+		new_entry.prev_hash = card.entries[-2].hash
+		status = new_entry.generate_hash('BLAKE2B-256')
+		assert not status.error(), f'chained entry failed to hash: {status}'
+
+		status = new_entry.sign(CryptoString(chaindata['sign.private']), 'User')
+		assert not status.error(), f'chained entry failed to user sign: {status}'
+		crskeystring = CryptoString(chaindata['crsign.private'])
+
+	status = card.verify()
+	assert not status.error(), f'keycard failed to verify: {status}'
+
+	status = card.verify(1)
+	assert not status.error(), f'keycard failed to verify serially: {status}'
+
+	status = keycard.verify_keycards([card, card, card])
+	assert not status.error(), f'keycard batch failed to verify: {status}'
+
+	# Swap in a signature which is valid but belongs to a different entry. The checkpoint set by 
+	# the successful verification has to go, too, or the tampered entry won't be checked again.
+	card.checkpoint = None
+	card.entries[27].signatures['Custody'] = card.entries[26].signatures['Custody']
+	status = card.verify(4)
+	assert status.error(), 'tampered keycard passed verification'
+	assert status['index'] == 27, f"wrong bad entry index {status['index']}"
+
+	other_card = keycard.Keycard()
+	other_card.entries.append(make_test_userentry())
+	status = keycard.verify_keycards([other_card, card])
+	assert status.error(), 'tampered keycard passed batch verification'
+	assert status['card'] == 1 and status['index'] == 27, 'wrong bad card or entry index'
+
+
+def test_keycard_checkpoint():
+	'''Tests incremental verification using the verified-prefix checkpoint'''
+	userentry = make_test_userentry()
+	card = keycard.Keycard()
+	card.entries.append(userentry)
+
+	crskeystring = CryptoString('ED25519:ip52{ps^jH)t$k-9bc_RzkegpIW?}FFe~BX&<V}9')
+	oskeystring = CryptoString('ED25519:msvXw(nII<Qm6oBHc+92xwRI3>VFF-RcZ=7DEu3|')
+	for _ in range(3):
+		chaindata = card.chain(crskeystring, False)
+		assert not chaindata.error(), f'keycard chain failed: {chaindata}'
+		new_entry = chaindata['entry']
+		new_entry.sign(oskeystring, 'Organization')
+		new_entry.prev_hash = card.entries[-2].hash
+		new_entry.generate_hash('BLAKE2B-256')
+		new_entry.sign(CryptoString(chaindata['sign.private']), 'User')
+		crskeystring = CryptoString(chaindata['crsign.private'])
+
+		status = card.verify()
+		assert not status.error(), f'keycard failed to verify: {status}'
+		assert card.verified_index() == len(card.entries) - 1, 'checkpoint not advanced'
+
+	test_folder = setup_test('keycard_checkpoint')
+	checkpoint_path = os.path.join(test_folder, 'user_keycard.kc.checkpoint')
+	status = card.save_checkpoint(checkpoint_path)
+	assert not status.error(), f'checkpoint failed to save: {status}'
+
+	newcard = keycard.Keycard()
+	newcard.entries = card.entries
+	status = newcard.load_checkpoint(checkpoint_path)
+	assert not status.error(), f'checkpoint failed to load: {status}'
+	assert newcard.verified_index() == 3, 'loaded checkpoint not applied'
+
+	status = newcard.get_chain_data()
+	assert not status.error() and not status['items'], 'checkpointed entries checked again'
+
+	# Changing the checkpointed entry invalidates the checkpoint
+	newcard.entries[-1].signatures['User'] = newcard.entries[-2].signatures['User']
+	assert newcard.verified_index() == 0, 'stale checkpoint was used'
+
+
 def bench_hashers():
 	'''Quick benchmark for the different hash algorithms'''
 	entry = make_test_userentry()
@@ -0,0 +1,119 @@
+'''This module tests the KeycardCache class'''
+import os
+import shutil
+import time
+
+# pylint: disable=import-error
+import pyanselus.dbconn as dbconn
+import pyanselus.keycard as keycard
+from pyanselus.cryptostring import CryptoString
+from pyanselus.keycardcache import KeycardCache
+from pyanselus.retval import RetVal, ResourceNotFound
+from pyanselus.userprofile import Profile
+from test_keycard import make_test_userentry
+
+def setup_test(name):
+	'''Creates a new test folder hierarchy'''
+	test_folder = os.path.join(os.path.dirname(os.path.realpath(__file__)),'testfiles')
+	if not os.path.exists(test_folder):
+		os.mkdir(test_folder)
+
+	unittest_folder = os.path.join(test_folder, name)
+	while os.path.exists(unittest_folder):
+		try:
+			shutil.rmtree(unittest_folder)
+		except:
+			print("Waiting a second for test folder to unlock")
+			time.sleep(1.0)
+	os.mkdir(unittest_folder)
+	return unittest_folder
+
+
+def make_test_keycard() -> keycard.Keycard:
+	'''Returns a user keycard with two entries'''
+	userentry = make_test_userentry()
+	card = keycard.Keycard()
+	card.entries.append(userentry)
+
+	chaindata = card.chain(CryptoString('ED25519:ip52{ps^jH)t$k-9bc_RzkegpIW?}FFe~BX&<V}9'), True)
+	new_entry = chaindata['entry']
+	new_entry.sign(CryptoString('ED25519:msvXw(nII<Qm6oBHc+92xwRI3>VFF-RcZ=7DEu3|'),
+		'Organization')
+	new_entry.prev_hash = userentry.hash
+	new_entry.generate_hash('BLAKE2B-256')
+	new_entry.sign(CryptoString(chaindata['sign.private']), 'User')
+	return card
+
+
+class FakeConnection:
+	'''Stands in for a ServerConnection, answering ISCURRENT with a fixed response'''
+	def __init__(self, is_current: bool):
+		self.is_current = is_current
+		self.requests = list()
+
+	def send_message(self, command: dict) -> RetVal:
+		'''Records the request'''
+		self.requests.append(command)
+		return RetVal()
+
+	def read_response(self, schema: dict) -> RetVal: # pylint: disable=unused-argument
+		'''Returns the canned response'''
+		return RetVal().set_values({
+			'Code' : 200,
+			'Status' : 'OK',
+			'Info' : '',
+			'Data' : { 'Is-Current' : 'YES' if self.is_current else 'NO' }
+		})
+
+
+def test_keycardcache():
+	'''Tests adding, looking up, refreshing, and removing cached keycards'''
+	test_folder = setup_test('keycardcache')
+	profile = Profile(test_folder)
+	profile.activate()
+	cache = KeycardCache(profile.db)
+
+	card = make_test_keycard()
+	identity = '4418bf6c-000b-4bb3-8111-316e72030468/example.com'
+	status = cache.add(card, identity)
+	assert not status.error(), f"add() failed: {status.info()}"
+	fingerprint = status['fingerprint']
+	assert fingerprint == card.entries[-1].hash, 'fingerprint was not the entry hash'
+
+	for status in [cache.get(identity), cache.get(fingerprint=fingerprint)]:
+		assert not status.error(), f"get() failed: {status.info()}"
+		assert not status['stale'], 'freshly cached card is stale'
+		assert status['card'].make_bytestring() == card.make_bytestring(), 'card data mismatch'
+		assert not status['card'].get_chain_data()['items'], 'cached card verified again'
+
+	# A card within its Time-To-Live doesn't need the server
+	conn = FakeConnection(True)
+	status = cache.refresh(conn, identity)
+	assert not status.error() and status['iscurrent'], 'refresh() of fresh card failed'
+	assert not conn.requests, 'refresh() of fresh card contacted the server'
+
+	# Once the Time-To-Live runs out, the server is asked
+	profile.db.execute("UPDATE keycards SET expires='20200101T000000Z'")
+	status = cache.get(identity)
+	assert status['stale'], 'card past its Time-To-Live is not stale'
+
+	status = cache.refresh(conn, identity)
+	assert not status.error() and status['iscurrent'], 'refresh() of stale card failed'
+	assert conn.requests[0]['Data']['Index'] == '2', 'wrong entry index checked'
+	assert not cache.get(identity)['stale'], 'refresh() did not reset the Time-To-Live'
+
+	profile.db.execute("UPDATE keycards SET expires='20200101T000000Z'")
+	status = cache.refresh(FakeConnection(False), identity)
+	assert not status.error() and not status['iscurrent'], 'outdated card reported as current'
+	assert cache.get(identity).error() == ResourceNotFound, 'outdated card not removed'
+
+	status = cache.add(card, identity)
+	status = cache.evict_expired()
+	assert status['count'] == 0, 'unexpired card evicted'
+
+	# Inside a unit of work, the cache's changes are kept or discarded along with the caller's
+	with dbconn.transaction(profile.db) as unit:
+		assert not cache.remove(identity).error(), 'remove() failed'
+		unit.abort()
+	assert not cache.get(identity).error(), 'cache committed inside a unit of work'
+	profile.deactivate()
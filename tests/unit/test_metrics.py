@@ -0,0 +1,109 @@
+'''This module tests the metrics module'''
+
+import asyncio
+
+# pylint: disable=import-error
+import pyanselus.asyncconn as asyncconn
+import pyanselus.metrics as metrics
+import pyanselus.serverconn as serverconn
+from pyanselus.encryption import EncryptionPair, SecretKey, decrypt_envelope, encrypt_envelope
+from pyanselus.mockserver import MockServer
+
+def test_histogram():
+	'''Tests bucket counting'''
+	histogram = metrics.Histogram((0.1, 1.0))
+	for value in [0.05, 0.1, 0.5, 2.0]:
+		histogram.observe(value)
+
+	assert histogram.count == 4 and abs(histogram.sum - 2.65) < 1e-9, 'wrong totals'
+	assert histogram.cumulative() == [(0.1, 2), (1.0, 3), (float('inf'), 4)], 'wrong buckets'
+
+
+def test_metrics():
+	'''Tests collection from instrumented code and both export formats'''
+	metrics.reset()
+	key = SecretKey()
+	key.encrypt(b'data')
+	assert not metrics.snapshot()[metrics.CRYPTO], 'data collected while disabled'
+
+	metrics.enable()
+	try:
+		key.encrypt(b'data')
+		with MockServer() as server:
+			server.add_workspace('11111111-1111-1111-1111-111111111111', 'csimons')
+			conn = serverconn.ServerConnection()
+			conn.connect('127.0.0.1', server.port)
+			for _ in range(3):
+				status = serverconn.getwid(conn, 'csimons', 'example.com')
+				assert not status.error(), f"getwid() failed: {status.info()}"
+			conn.disconnect()
+	finally:
+		metrics.disable()
+
+	data = metrics.snapshot()
+	assert data[metrics.CRYPTO]['SecretKey.encrypt']['count'] == 1, 'crypto call not timed'
+	assert data[metrics.COMMAND]['getwid']['count'] == 3, 'commands not timed'
+	assert data[metrics.BYTES_SENT] == conn.bytes_sent > 0, 'bytes sent not counted'
+	assert data[metrics.BYTES_RECEIVED] == conn.bytes_received > 0, 'bytes received not counted'
+
+	text = metrics.to_prometheus()
+	assert '# TYPE anselus_command_seconds histogram' in text, 'histogram type missing'
+	assert 'anselus_command_seconds_bucket{name="getwid",le="+Inf"} 3' in text, 'bucket missing'
+	assert 'anselus_command_seconds_count{name="getwid"} 3' in text, 'count missing'
+	assert f"anselus_bytes_sent_total {conn.bytes_sent}" in text, 'counter missing'
+
+	metrics.reset()
+	assert not metrics.snapshot()[metrics.COMMAND], 'reset() left data'
+
+
+def test_crypto_operations():
+	'''Tests that operations made of timed primitives are kept out of the primitives' family'''
+	metrics.reset()
+	pairs = [EncryptionPair(), EncryptionPair()]
+	metrics.enable()
+	try:
+		status = encrypt_envelope(b'data', pairs)
+		assert not status.error(), f"encrypt_envelope() failed: {status.info()}"
+		status = decrypt_envelope(status['envelope'], pairs[0])
+		assert not status.error(), f"decrypt_envelope() failed: {status.info()}"
+	finally:
+		metrics.disable()
+
+	data = metrics.snapshot()
+	assert set(data[metrics.CRYPTO_OPERATION]) == {'encrypt_envelope', 'decrypt_envelope'}, \
+		'operations not timed in their own family'
+	assert 'encrypt_envelope' not in data[metrics.CRYPTO], 'operation timed as a primitive'
+	assert data[metrics.CRYPTO]['EncryptionPair.encrypt']['count'] == 2, 'key wrapping not timed'
+	assert 'anselus_crypto_operation_seconds_count{name="encrypt_envelope"} 1' \
+		in metrics.to_prometheus(), 'operation family not exported'
+	metrics.reset()
+
+
+def test_async_commands():
+	'''Tests that the async commands are timed and their traffic counted'''
+
+	async def run_test(server: MockServer):
+		conn = asyncconn.AsyncServerConnection()
+		status = await conn.connect('127.0.0.1', server.port)
+		assert not status.error(), f"connect() failed: {status.info()}"
+		for _ in range(2):
+			status = await asyncconn.getwid(conn, 'csimons', 'example.com')
+			assert not status.error(), f"getwid() failed: {status.info()}"
+		await conn.disconnect()
+		return conn
+
+	metrics.reset()
+	metrics.enable()
+	try:
+		with MockServer() as server:
+			server.add_workspace('11111111-1111-1111-1111-111111111111', 'csimons')
+			conn = asyncio.run(run_test(server))
+	finally:
+		metrics.disable()
+
+	data = metrics.snapshot()
+	assert data[metrics.COMMAND]['getwid']['count'] == 2, 'async commands not timed'
+	assert data[metrics.BYTES_SENT] == conn.bytes_sent > 0, 'async bytes sent not counted'
+	assert data[metrics.BYTES_RECEIVED] == conn.bytes_received > 0, \
+		'async bytes received not counted'
+	metrics.reset()
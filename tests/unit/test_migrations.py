@@ -0,0 +1,108 @@
+'''This module tests the schema migration engine'''
+import os
+import shutil
+import sqlite3
+import time
+
+# pylint: disable=import-error
+import pyanselus.migrations as migrations
+from pyanselus.userprofile import Profile
+
+def setup_test(name):
+	'''Creates a new test folder hierarchy'''
+	test_folder = os.path.join(os.path.dirname(os.path.realpath(__file__)),'testfiles')
+	if not os.path.exists(test_folder):
+		os.mkdir(test_folder)
+
+	unittest_folder = os.path.join(test_folder, name)
+	while os.path.exists(unittest_folder):
+		try:
+			shutil.rmtree(unittest_folder)
+		except:
+			print("Waiting a second for test folder to unlock")
+			time.sleep(1.0)
+	os.mkdir(unittest_folder)
+	return unittest_folder
+
+
+def test_migrate():
+	'''Tests creating a database, upgrading an unversioned one in place, and refusing newer ones'''
+	test_folder = setup_test('migrations')
+	db = sqlite3.connect(':memory:')
+	status = migrations.migrate(db)
+	assert not status.error(), f"migrate() failed: {status.info()}"
+	assert status['version'] == migrations.SCHEMA_VERSION, 'wrong schema version returned'
+	assert migrations.get_version(db) == migrations.SCHEMA_VERSION, 'user_version not set'
+	assert not migrations.migrate(db).error(), 'migrating a current database failed'
+
+	# Databases made before versioning have the version 1 tables but a user_version of 0
+	dbpath = os.path.join(test_folder, 'storage.db')
+	db = sqlite3.connect(dbpath)
+	for sqlcmd in migrations.MIGRATIONS[0]:
+		db.execute(sqlcmd)
+	db.execute("INSERT INTO notes(id,title,created) VALUES('1','Keep me','20200101T000000Z')")
+	db.commit()
+	db.close()
+
+	profile = Profile(test_folder)
+	status = profile.activate()
+	assert not status.error(), f"activate() failed: {status.info()}"
+	assert migrations.get_version(profile.db) == migrations.SCHEMA_VERSION, 'database not upgraded'
+	assert profile.db.execute('SELECT title FROM notes').fetchall() == [('Keep me',)], \
+		'migration lost data'
+
+	profile.db.execute(f"PRAGMA user_version={migrations.SCHEMA_VERSION + 1}")
+	profile.deactivate()
+	status = profile.activate()
+	assert status.error() == migrations.UnsupportedSchema, 'newer schema version not rejected'
+	assert profile.db is None, 'database left open after failed migration'
+
+
+def test_query_plans():
+	'''Makes sure that lookups by address, device, thread, and date use an index'''
+	db = sqlite3.connect(':memory:')
+	assert not migrations.migrate(db).error(), 'migrate() failed'
+
+	queries = [
+		"DELETE FROM folders WHERE address=?",
+		"SELECT public_key FROM sessions WHERE address=?",
+		"SELECT private_key FROM sessions WHERE address=?",
+		"DELETE FROM sessions WHERE devid=?",
+		"DELETE FROM keys WHERE address=?",
+		"SELECT fingerprint,carddata,identity,expires FROM keycards WHERE identity=?",
+		"DELETE FROM messages WHERE address=?",
+		"SELECT id FROM messages WHERE address=? ORDER BY date DESC",
+		"SELECT id FROM messages WHERE thread_id=? ORDER BY date",
+		"DELETE FROM notes WHERE address=?",
+	]
+	for query in queries:
+		plan = ' '.join([x[-1] for x in db.execute('EXPLAIN QUERY PLAN ' + query, ('x',))])
+		assert 'USING' in plan and 'INDEX' in plan, f"no index used for {query}: {plan}"
+		assert 'TEMP B-TREE' not in plan, f"extra sort needed for {query}: {plan}"
+
+
+def test_migrate_transactions(monkeypatch):
+	'''Tests that migrate() leaves open transactions alone and rechecks the version under lock'''
+	db = sqlite3.connect(':memory:')
+	db.execute('CREATE TABLE "pending"("id" TEXT)')
+	db.execute("INSERT INTO pending(id) VALUES('1')")
+	assert db.in_transaction, 'test transaction not open'
+	status = migrations.migrate(db)
+	assert status.error() == migrations.TransactionOpen, 'open transaction not refused'
+	db.rollback()
+	assert not db.execute('SELECT * FROM pending').fetchall(), "caller's transaction committed"
+
+	# A newer client may upgrade the database between the first version check and the lock
+	db.execute(f"PRAGMA user_version={migrations.SCHEMA_VERSION + 1}")
+	get_version = migrations.get_version
+	calls = list()
+	def racing_get_version(conn):
+		calls.append(conn)
+		return 0 if len(calls) == 1 else get_version(conn)
+
+	monkeypatch.setattr(migrations, 'get_version', racing_get_version)
+	status = migrations.migrate(db)
+	monkeypatch.undo()
+	assert status.error() == migrations.UnsupportedSchema, 'newer schema not rejected under lock'
+	assert migrations.get_version(db) == migrations.SCHEMA_VERSION + 1, 'schema version lowered'
+	assert not db.in_transaction, 'migration transaction left open'
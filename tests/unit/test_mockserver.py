@@ -0,0 +1,88 @@
+'''This module tests the mock server using the client functions in serverconn'''
+import time
+
+# pylint: disable=import-error
+import pyanselus.serverconn as serverconn
+from pyanselus.encryption import EncryptionPair, SigningPair
+from pyanselus.keycard import UserEntry
+from pyanselus.mockserver import MockServer
+from pyanselus.retval import ResourceExists
+
+def test_session():
+	'''Runs registration, login, and a keycard update against the mock server'''
+	with MockServer() as server:
+		conn = serverconn.ServerConnection()
+		status = conn.connect('127.0.0.1', server.port)
+		assert not status.error(), f"connect() failed: {status.info()}"
+
+		devpair = EncryptionPair()
+		status = serverconn.register(conn, 'csimons', 'pwhash', devpair.public)
+		assert not status.error(), f"register() failed: {status.info()}"
+		assert status['domain'] == 'example.com', 'register() returned the wrong domain'
+		wid = status['wid']
+		devid = status['devid']
+
+		status = serverconn.register(conn, 'csimons', 'pwhash', devpair.public)
+		assert status.error() == ResourceExists, 'duplicate user ID not rejected'
+
+		status = serverconn.getwid(conn, 'csimons', 'example.com')
+		assert status['Workspace-ID'] == wid, 'getwid() returned the wrong workspace'
+
+		status = serverconn.login(conn, wid, server.org_encryption.public)
+		assert not status.error(), f"login() failed: {status.info()}"
+		status = serverconn.password(conn, wid, 'pwhash')
+		assert not status.error(), f"password() failed: {status.info()}"
+		status = serverconn.device(conn, devid, devpair)
+		assert not status.error(), f"device() failed: {status.info()}"
+
+		spair = SigningPair()
+		for index in range(1, 3):
+			entry = UserEntry()
+			entry.set_fields({
+				'Index':str(index),
+				'Name':'Corbin Simons',
+				'Workspace-ID':wid,
+				'User-ID':'csimons',
+				'Domain':'example.com',
+				'Contact-Request-Verification-Key':spair.public.as_string(),
+				'Contact-Request-Encryption-Key':EncryptionPair().public.as_string(),
+				'Public-Encryption-Key':EncryptionPair().public.as_string()
+			})
+			status = serverconn.addentry(conn, entry, server.org_signing.public, spair)
+			assert not status.error(), f"addentry() {index} failed: {status.info()}"
+
+		assert len(server.workspaces[wid]['entries']) == 2, 'entries not stored'
+		assert server.workspaces[wid]['entries'][1].prev_hash == \
+			server.workspaces[wid]['entries'][0].hash, 'entries not chained'
+
+		status = serverconn.iscurrent(conn, 2, wid)
+		assert not status.error() and status['iscurrent'], 'newest entry not current'
+		status = serverconn.iscurrent(conn, 1, wid)
+		assert not status.error() and not status['iscurrent'], 'old entry reported as current'
+
+		status = serverconn.preregister(conn, '', 'rbrannan', 'example.com')
+		assert not status.error(), f"preregister() failed: {status.info()}"
+		assert status['uid'] == 'rbrannan' and status['regcode'], 'preregister() data missing'
+
+		conn.disconnect()
+		assert server.counts['ADDENTRY'] == 4, 'requests not counted'
+
+
+def test_latency_and_padding():
+	'''Tests that responses are delayed and padded as configured'''
+	with MockServer(latency=0.05, payload_size=4096) as server:
+		server.add_workspace('11111111-1111-1111-1111-111111111111', 'csimons')
+		conn = serverconn.ServerConnection()
+		status = conn.connect('127.0.0.1', server.port)
+		assert not status.error(), f"connect() failed: {status.info()}"
+
+		start = time.perf_counter()
+		status = serverconn.getwid(conn, 'csimons', 'example.com')
+		assert time.perf_counter() - start >= 0.05, 'response not delayed'
+		assert not status.error(), f"getwid() failed: {status.info()}"
+
+		server.latency = 0.0
+		conn.send_message({ 'Action':'GETWID', 'Data':{ 'User-ID':'csimons' } })
+		response = conn.read_response(serverconn.server_response)
+		assert len(response['Data']['Padding']) == 4096, 'response not padded'
+		conn.disconnect()
@@ -39,3 +39,14 @@ def test_count():
 	assert r.count() == 1, '''Incorrect item count in RetVal'''
 	r.empty()
 	assert r.count() == 0, '''Emptied RetVal is not empty'''
+
+def test_fields():
+	'''Tests that values and the error state are kept apart'''
+	r = RetVal(BadParameterValue, 'info')
+	assert r['_error'] == BadParameterValue and r['_info'] == 'info', 'error state not readable'
+	assert r.fields() == {} and list(r) == ['_error', '_info'], 'empty RetVal has fields'
+	r.set_values({ 'foo':'bar', 'spam':'eggs' })
+	assert r.fields() == { 'foo':'bar', 'spam':'eggs' }, 'wrong fields returned'
+	assert r.error() == BadParameterValue, 'fields() changed the error state'
+	assert 'foo' in r and 'missing' not in r, 'membership test failed'
+	assert not hasattr(r, '__dict__'), 'RetVal has a per-instance dictionary'
@@ -0,0 +1,96 @@
+'''This module tests full-text search of messages and notes'''
+import sqlite3
+
+# pylint: disable=import-error
+import pyanselus.migrations as migrations
+import pyanselus.search as search
+from pyanselus.retval import BadParameterValue
+
+def make_test_db() -> sqlite3.Connection:
+	'''Returns an in-memory profile database with some messages and notes'''
+	db = sqlite3.connect(':memory:')
+	assert not migrations.migrate(db).error(), 'migrate() failed'
+
+	messages = [
+		('1', 'a/example.com', '20200101', 'Quarterly budget', 'Numbers for the budget review'),
+		('2', 'a/example.com', '20200102', 'Lunch', 'Want to talk about the budget over lunch?'),
+		('3', 'b/example.com', '20200103', 'Budget', 'Another workspace'),
+		('4', 'a/example.com', '20200104', 'Vacation', 'Out of the office next week'),
+	]
+	for msg in messages:
+		db.execute('''INSERT INTO messages(id,"from",address,date,thread_id,subject,body)
+			VALUES(?,'sender',?,?,'t',?,?)''', (msg[0], msg[1], msg[2], msg[3], msg[4]))
+	db.execute('''INSERT INTO notes(id,address,title,body,created)
+		VALUES('n1','a/example.com','Groceries','eggs, milk, "budget" bread','20200101')''')
+	db.commit()
+	return db
+
+
+def test_search_messages():
+	'''Tests ranked message searches and index maintenance'''
+	db = make_test_db()
+
+	status = search.search_messages(db, 'budget', 'a/example.com')
+	assert not status.error(), f"search_messages() failed: {status.info()}"
+	results = status['results']
+	assert [x['id'] for x in results] == ['1', '2'], 'wrong results or ranking'
+	assert '[budget]' in results[1]['snippet'].casefold(), 'match not marked in snippet'
+
+	assert len(search.search_messages(db, 'budget')['results']) == 3, 'address filter not optional'
+	assert [x['id'] for x in search.search_messages(db, 'vaca')['results']] == ['4'], \
+		'prefix search failed'
+
+	# Changes to the messages table are reflected in the index
+	db.execute("UPDATE messages SET subject='Holiday', body='Away' WHERE id='4'")
+	db.execute("DELETE FROM messages WHERE id='1'")
+	db.commit()
+	assert not search.search_messages(db, 'vacation')['results'], 'update not indexed'
+	assert [x['id'] for x in search.search_messages(db, 'holiday')['results']] == ['4'], \
+		'updated text not found'
+	assert [x['id'] for x in search.search_messages(db, 'budget', 'a/example.com')['results']] \
+		== ['2'], 'deleted message still found'
+
+	assert not search.optimize(db).error(), 'optimize() failed'
+	assert not search.optimize(db, 16).error(), 'incremental optimize() failed'
+	assert not search.rebuild(db).error(), 'rebuild() failed'
+	assert len(search.search_messages(db, 'budget')['results']) == 2, 'rebuild() lost data'
+
+	assert search.search_messages(db, '   ').error() == BadParameterValue, 'empty search accepted'
+	assert search.search_messages(db, 'budget AND', raw=True).error() == BadParameterValue, \
+		'bad raw query accepted'
+
+
+def test_search_notes():
+	'''Tests note searches, including text which looks like query syntax'''
+	db = make_test_db()
+	status = search.search_notes(db, '"budget" AND')
+	assert not status.error(), f"search_notes() failed: {status.info()}"
+	assert not status['results'], 'unexpected match'
+
+	status = search.search_notes(db, 'milk bread')
+	assert [x['title'] for x in status['results']] == ['Groceries'], 'note not found'
+
+
+def test_search_unavailable(monkeypatch):
+	'''Tests that a database can be used without FTS5 and gets its indexes once FTS5 is there'''
+	monkeypatch.setattr(migrations, 'has_fts5', lambda db: False)
+	db = sqlite3.connect(':memory:')
+	status = migrations.migrate(db)
+	assert not status.error(), f"migrate() without FTS5 failed: {status.info()}"
+	assert status['version'] == migrations.SCHEMA_VERSION and not status['search'], \
+		'wrong migrate() result without FTS5'
+	db.execute('''INSERT INTO notes(id,address,title,body,created)
+		VALUES('n1','a/example.com','Groceries','eggs','20200101')''')
+	db.commit()
+
+	assert not search.is_available(db), 'search reported as available'
+	assert search.search_notes(db, 'eggs').error() == search.SearchUnavailable, \
+		'missing index not reported'
+	assert search.rebuild(db).error() == search.SearchUnavailable, 'rebuild() without index'
+
+	monkeypatch.undo()
+	status = migrations.migrate(db)
+	assert not status.error() and status['search'], f"adding indexes failed: {status.info()}"
+	assert search.is_available(db), 'search not available after migrating with FTS5'
+	assert [x['id'] for x in search.search_notes(db, 'eggs')['results']] == ['n1'], \
+		'existing note not indexed'
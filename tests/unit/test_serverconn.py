@@ -0,0 +1,288 @@
+'''This module tests the serverconn module without needing a real server'''
+import json
+import os
+import shutil
+import socket
+import struct
+import threading
+import time
+
+import pytest
+
+try:
+	import msgpack
+except ImportError:
+	msgpack = None
+
+# pylint: disable=import-error
+import pyanselus.serverconn as serverconn
+from pyanselus.cryptostring import CryptoString
+from pyanselus.encryption import EncryptionPair
+from pyanselus.framing import MessageTooLarge
+from pyanselus.mockserver import MockServer
+
+def setup_test(name):
+	'''Creates a new test folder hierarchy'''
+	test_folder = os.path.join(os.path.dirname(os.path.realpath(__file__)),'testfiles')
+	if not os.path.exists(test_folder):
+		os.mkdir(test_folder)
+
+	unittest_folder = os.path.join(test_folder, name)
+	while os.path.exists(unittest_folder):
+		try:
+			shutil.rmtree(unittest_folder)
+		except:
+			print("Waiting a second for test folder to unlock")
+			time.sleep(1.0)
+	os.mkdir(unittest_folder)
+	return unittest_folder
+
+
+def make_wid(uid: str) -> str:
+	'''Makes a fake but consistent workspace ID for a user ID'''
+	return '%08d-0000-0000-0000-000000000000' % int(uid[4:])
+
+
+def run_fake_server(listener: socket.socket, encodings=None):
+	'''Answers GETWID requests for users named userN until the client disconnects. If encodings 
+	is given, they are offered in the greeting, but requests to switch are refused.'''
+	client, _ = listener.accept()
+	greeting = { 'Name':'Anselus', 'Version':'0.1', 'Code':200, 'Status':'OK' }
+	if encodings:
+		greeting['Encodings'] = encodings
+	client.sendall(json.dumps(greeting).encode() + b'\r\n')
+
+	with client.makefile('rb') as reader:
+		for line in reader:
+			request = json.loads(line)
+			if request['Action'] == 'QUIT':
+				break
+
+			if request['Action'] == 'ENCODING':
+				client.sendall(b'{"Code":400,"Status":"BAD REQUEST","Info":"","Data":{}}\r\n')
+				continue
+
+			uid = request['Data']['User-ID']
+			if uid.startswith('user'):
+				response = { 'Code':200, 'Status':'OK', 'Info':'',
+					'Data':{ 'Workspace-ID':make_wid(uid) } }
+			else:
+				response = { 'Code':404, 'Status':'RESOURCE NOT FOUND', 'Info':'', 'Data':{} }
+			client.sendall(json.dumps(response).encode() + b'\r\n')
+	client.close()
+
+
+def test_getwid_many():
+	'''Tests pipelined user ID lookups'''
+	listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+	listener.bind(('127.0.0.1', 0))
+	listener.listen(1)
+	thread = threading.Thread(target=run_fake_server, args=(listener,))
+	thread.start()
+
+	conn = serverconn.ServerConnection()
+	status = conn.connect('127.0.0.1', listener.getsockname()[1])
+	assert not status.error(), f"connect() failed: {status.info()}"
+
+	uids = [f"user{x}" for x in range(250)]
+	uids[5] = 'bad user'
+	uids[7] = 'missing'
+	status = serverconn.getwid_many(conn, uids, 'example.com')
+	assert not status.error(), f"getwid_many() failed: {status.info()}"
+
+	results = status['results']
+	assert len(results) == len(uids), 'getwid_many() returned the wrong number of results'
+	assert results[5].error() == serverconn.BadParameterValue, 'bad user ID was not rejected'
+	assert results[7].error() == serverconn.ServerError, 'missing user ID not reported'
+	for i, result in enumerate(results):
+		if i in [5, 7]:
+			continue
+		assert not result.error(), f"lookup {i} failed: {result.info()}"
+		assert result['Workspace-ID'] == make_wid(uids[i]), f"lookup {i} out of order"
+
+	# The connection has to be usable for regular commands afterward
+	status = serverconn.getwid(conn, 'user42', 'example.com')
+	assert status['Workspace-ID'] == make_wid('user42'), 'getwid() after pipeline failed'
+
+	conn.disconnect()
+	thread.join()
+	listener.close()
+
+
+def test_framing_error():
+	'''Tests that a response too large to read ends the connection instead of leaving the rest of 
+	it to be read as the next response'''
+	left, right = socket.socketpair()
+	conn = serverconn.ServerConnection(max_frame_size=64)
+	conn.socket = left
+	right.sendall(b'{"Code":200,"Status":"OK","Info":"","Data":{"Padding":"' + b'x' * 128 +
+		b'"}}\r\n')
+
+	status = conn.read_response(serverconn.server_response)
+	assert status.error() == MessageTooLarge, 'oversized response not rejected'
+	assert not conn.is_connected(), 'connection kept after a framing error'
+	right.close()
+
+
+def run_msgpack_server(listener: socket.socket, requests: list):
+	'''Offers MessagePack in its greeting, switches to it when asked, and then echoes the
+	Data of each request back in its response'''
+	client, _ = listener.accept()
+	client.sendall(b'{"Name":"Anselus","Version":"0.1","Code":200,"Status":"OK",'
+		b'"Encodings":["msgpack","json"]}\r\n')
+
+	reader = client.makefile('rb')
+	request = json.loads(reader.readline())
+	requests.append(request)
+	client.sendall(b'{"Code":200,"Status":"OK","Info":"","Data":{}}\r\n')
+
+	while True:
+		header = reader.read(4)
+		if len(header) < 4:
+			break
+		request = msgpack.unpackb(reader.read(struct.unpack('>I', header)[0]), raw=False)
+		requests.append(request)
+		if request['Action'] == 'QUIT':
+			break
+		response = msgpack.packb({ 'Code':200, 'Status':'OK', 'Info':'',
+			'Data':request['Data'] }, use_bin_type=True)
+		client.sendall(struct.pack('>I', len(response)) + response)
+	reader.close()
+	client.close()
+
+
+def test_msgpack_encoding():
+	'''Tests negotiating MessagePack and sending keys as raw bytes'''
+	if msgpack is None:
+		pytest.skip('msgpack is not installed')
+
+	listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+	listener.bind(('127.0.0.1', 0))
+	listener.listen(1)
+	requests = list()
+	thread = threading.Thread(target=run_msgpack_server, args=(listener, requests))
+	thread.start()
+
+	conn = serverconn.ServerConnection()
+	status = conn.connect('127.0.0.1', listener.getsockname()[1])
+	assert not status.error(), f"connect() failed: {status.info()}"
+	assert conn.codec.name == 'msgpack', 'MessagePack not negotiated'
+	assert requests[0] == { 'Action':'ENCODING', 'Data':{ 'Encoding':'msgpack' } }, \
+		'bad ENCODING request'
+
+	key = EncryptionPair().public
+	status = conn.send_message({ 'Action':'ECHO', 'Data':{ 'Key':key, 'Payload':b'\r\n\0' } })
+	assert not status.error(), f"send_message() failed: {status.info()}"
+	status = conn.read_response(serverconn.server_response)
+	assert not status.error(), f"read_response() failed: {status.info()}"
+
+	# The key is raw bytes on the wire, but is a string again in the response
+	ext = requests[1]['Data']['Key']
+	assert isinstance(ext, msgpack.ExtType) and ext.data.endswith(key.raw_data()), \
+		'key not sent as raw bytes'
+	assert status['Data']['Key'] == key.as_string(), 'key mismatch'
+	assert CryptoString(status['Data']['Key']) == key, 'key not usable'
+	assert status['Data']['Payload'] == b'\r\n\0', 'payload mismatch'
+
+	conn.disconnect()
+	thread.join()
+	listener.close()
+
+	# The greeting of a server without MessagePack support keeps the connection on JSON
+	listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+	listener.bind(('127.0.0.1', 0))
+	listener.listen(1)
+	thread = threading.Thread(target=run_fake_server, args=(listener,))
+	thread.start()
+	conn = serverconn.ServerConnection()
+	assert not conn.connect('127.0.0.1', listener.getsockname()[1]).error(), 'connect() failed'
+	assert conn.codec.name == 'json', 'encoding changed without server support'
+	conn.disconnect()
+	thread.join()
+	listener.close()
+
+	# A server which offers MessagePack but then refuses to switch leaves the connection on JSON
+	listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+	listener.bind(('127.0.0.1', 0))
+	listener.listen(1)
+	thread = threading.Thread(target=run_fake_server, args=(listener, ['msgpack', 'json']))
+	thread.start()
+	conn = serverconn.ServerConnection()
+	status = conn.connect('127.0.0.1', listener.getsockname()[1])
+	assert not status.error(), f"connect() failed after a refused switch: {status.info()}"
+	assert conn.codec.name == 'json', 'encoding changed after the server refused'
+	status = serverconn.getwid(conn, 'user7', 'example.com')
+	assert status['Workspace-ID'] == make_wid('user7'), 'connection unusable after a refused switch'
+	conn.disconnect()
+	thread.join()
+	listener.close()
+
+
+def test_upload_download():
+	'''Tests streaming file transfers, including resuming after a dropped connection'''
+	test_folder = setup_test('serverconn_transfer')
+	localpath = os.path.join(test_folder, 'upload.bin')
+	filedata = os.urandom(3 * serverconn.TRANSFER_CHUNK_SIZE + 1000)
+	with open(localpath, 'wb') as fhandle:
+		fhandle.write(filedata)
+
+	server = MockServer()
+	server.start()
+	server.drop_after = serverconn.TRANSFER_CHUNK_SIZE + 500
+	conn = serverconn.ServerConnection()
+	assert not conn.connect('127.0.0.1', server.port).error(), 'connect() failed'
+
+	updates = list()
+	status = serverconn.upload(conn, localpath, '/ wsp files', lambda x, y: updates.append(x))
+	assert status.error(), 'dropped connection not detected'
+	assert status['resume-id'], 'resume ID not returned'
+
+	conn = serverconn.ServerConnection()
+	assert not conn.connect('127.0.0.1', server.port).error(), 'connect() failed'
+	status = serverconn.upload(conn, localpath, '/ wsp files', lambda x, y: updates.append(x),
+		status['resume-id'])
+	assert not status.error(), f"resumed upload() failed: {status.info()}"
+	assert status['name'], 'file name not returned'
+	assert server.files['/ wsp files'] == filedata, 'uploaded data mismatch'
+	assert updates[-1] == len(filedata), 'progress not reported'
+
+	# A local file which isn't part of an earlier download is replaced, even if it is the same size
+	downpath = os.path.join(test_folder, 'download.bin')
+	with open(downpath, 'wb') as fhandle:
+		fhandle.write(b'x' * len(filedata))
+	status = serverconn.download(conn, '/ wsp files', downpath)
+	assert not status.error(), f"download() failed: {status.info()}"
+	with open(downpath, 'rb') as fhandle:
+		assert fhandle.read() == filedata, 'existing local file not replaced'
+
+	# Downloads resume from the end of the partial local file
+	server.drop_after = serverconn.TRANSFER_CHUNK_SIZE + 500
+	status = serverconn.download(conn, '/ wsp files', downpath)
+	assert status.error(), 'dropped connection not detected'
+	assert os.path.getsize(downpath) == serverconn.TRANSFER_CHUNK_SIZE + 500, \
+		'partial download not kept'
+	resume_id = status['resume-id']
+
+	conn = serverconn.ServerConnection()
+	assert not conn.connect('127.0.0.1', server.port).error(), 'connect() failed'
+	updates = list()
+	status = serverconn.download(conn, '/ wsp files', downpath, lambda x, y: updates.append(x),
+		resume_id)
+	assert not status.error(), f"resumed download() failed: {status.info()}"
+	assert status['size'] == len(filedata), 'wrong size returned'
+	with open(downpath, 'rb') as fhandle:
+		assert fhandle.read() == filedata, 'downloaded data mismatch'
+	assert updates[0] > serverconn.TRANSFER_CHUNK_SIZE and updates[-1] == len(filedata), \
+		'progress not reported from the resume point'
+
+	# If the file changed on the server since the ID was handed out, it is downloaded again in full
+	with open(downpath, 'r+b') as fhandle:
+		fhandle.truncate(1000)
+	server.files['/ wsp files'] = filedata[::-1]
+	status = serverconn.download(conn, '/ wsp files', downpath, None, resume_id)
+	assert not status.error(), f"download() of a changed file failed: {status.info()}"
+	with open(downpath, 'rb') as fhandle:
+		assert fhandle.read() == filedata[::-1], 'stale partial file was resumed'
+
+	conn.disconnect()
+	server.stop()
@@ -66,7 +66,20 @@ def test_profile_dbinit():
 	profile.wid = 'b5a9367e-680d-46c0-bb2c-73932a6d4007'
 	profile.domain = 'example.com'
 
-	assert profile.reset_db()
+	status = profile.reset_db()
+	assert not status.error(), f"reset_db() failed: {status.info()}"
+	assert status['db'] is profile.db, 'reset_db() did not return the connection'
+	profile.deactivate()
+
+	# A database which can't be deleted or opened is reported instead of leaving the profile
+	# active without one
+	os.remove(os.path.join(profile_test_folder, 'storage.db'))
+	os.mkdir(os.path.join(profile_test_folder, 'storage.db'))
+	status = profile.reset_db()
+	assert status.error(), 'reset_db() did not report an undeletable database'
+	status = profile.activate()
+	assert status.error(), 'activate() did not report an unusable database'
+	assert profile.db is None and profile.dbman is None, 'profile left with a database'
 
 
 def test_pman_init():
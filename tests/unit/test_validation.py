@@ -0,0 +1,53 @@
+'''This module tests the validation module'''
+import jsonschema
+import pytest
+
+# pylint: disable=import-error
+import pyanselus.rpc_schemas as rpc_schemas
+from pyanselus.serverconn import server_response
+from pyanselus.validation import get_validator, validate
+
+def test_validate():
+	'''Tests that cached and fast-path validation match jsonschema'''
+	assert get_validator(server_response) is get_validator(server_response), 'validator not cached'
+	assert get_validator(server_response)[2] is not None, 'no fast path for server_response'
+	assert get_validator(rpc_schemas.greeting)[2] is not None, 'no fast path for greeting'
+
+	good = [
+		{ 'Code' : 200, 'Status' : 'OK', 'Info' : '', 'Data' : {} },
+		{ 'Code' : 200.0, 'Status' : 'OK', 'Data' : { 'Foo' : 'Bar' } },
+	]
+	bad = [
+		[],
+		{ 'Code' : 200, 'Status' : 'OK' },
+		{ 'Code' : '200', 'Status' : 'OK', 'Data' : {} },
+		{ 'Code' : True, 'Status' : 'OK', 'Data' : {} },
+		{ 'Code' : 200, 'Status' : 'OK', 'Data' : [] },
+	]
+	for instance in good:
+		jsonschema.validate(instance, server_response)
+		validate(instance, server_response)
+	for instance in bad:
+		with pytest.raises(jsonschema.ValidationError):
+			jsonschema.validate(instance, server_response)
+		with pytest.raises(jsonschema.ValidationError):
+			validate(instance, server_response)
+
+	# Schemas using other keywords get only the full validator
+	schema = { 'type' : 'object', 'properties' : { 'Code' : { 'type' : 'integer',
+		'minimum' : 100 } } }
+	assert get_validator(schema)[2] is None, 'fast path used for a complex schema'
+	validate({ 'Code' : 100 }, schema)
+	with pytest.raises(jsonschema.ValidationError):
+		validate({ 'Code' : 99 }, schema)
+
+	# List types are valid JSON Schema and must not break compiling the fast path
+	schema = { 'type' : 'object', 'properties' : { 'Info' : { 'type' : [ 'string', 'null' ] } } }
+	assert get_validator(schema)[2] is None, 'fast path used for a list type'
+	validate({ 'Info' : 'foo' }, schema)
+	validate({ 'Info' : None }, schema)
+	with pytest.raises(jsonschema.ValidationError):
+		validate({ 'Info' : 1 }, schema)
+
+	with pytest.raises(jsonschema.SchemaError):
+		validate({}, { 'type' : 'nonsense' })
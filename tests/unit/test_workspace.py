@@ -46,3 +46,12 @@ def test_workspace_generate():
 	w = Workspace(profile.db, unit_test_folder)
 	status = w.generate('testname', profile.domain, profile.wid, pw)
 	assert not status.error(), f"Failed to generate workspace: {status.info()}"
+	assert profile.db.execute('SELECT userid FROM workspaces WHERE wid=?',
+		(profile.wid,)).fetchone()[0] == 'testname', 'user ID not saved'
+
+	# A bad user ID fails the whole operation and leaves nothing behind
+	w = Workspace(profile.db, unit_test_folder)
+	status = w.generate('bad name', profile.domain, '34fe6e6b-9e3e-4b4a-8c3e-0ad3bd2e5b5e', pw)
+	assert status.error(), 'bad user ID accepted'
+	assert not profile.db.execute("SELECT COUNT(*) FROM keys WHERE address LIKE '34fe6e6b%'") \
+		.fetchone()[0], 'keys kept after a failed generate()'